@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+
+from dataiku.customrecipe import get_recipe_config, get_input_names_for_role, get_output_names_for_role
+
+from amazon_comprehend_recipe import run_recipe
+from amazon_comprehend_api_formatting import (
+    EntityTypeEnum,
+    KeyPhraseExtractionAPIFormatter,
+    LanguageDetectionAPIFormatter,
+    NamedEntityRecognitionAPIFormatter,
+    SentimentAnalysisAPIFormatter,
+)
+
+
+# ==============================================================================
+# SETUP
+# ==============================================================================
+
+analyses = get_recipe_config().get("analyses", [])
+if len(analyses) == 0:
+    raise ValueError("Please select at least one analysis")
+entity_types = [EntityTypeEnum[i] for i in get_recipe_config().get("entity_types", [])]
+minimum_score = float(get_recipe_config().get("minimum_score", 0))
+if minimum_score < 0 or minimum_score > 1:
+    raise ValueError("Minimum confidence score must be between 0 and 1")
+num_key_phrases = int(get_recipe_config().get("num_key_phrases", 3))
+
+analysis_list = [
+    ("LANGUAGE_DETECTION", "detect_dominant_language", LanguageDetectionAPIFormatter),
+    ("SENTIMENT_ANALYSIS", "detect_sentiment", SentimentAnalysisAPIFormatter),
+    (
+        "NAMED_ENTITY_RECOGNITION",
+        "detect_entities",
+        partial(NamedEntityRecognitionAPIFormatter, entity_types=entity_types, minimum_score=minimum_score),
+    ),
+    (
+        "KEY_PHRASE_EXTRACTION",
+        "detect_key_phrases",
+        partial(KeyPhraseExtractionAPIFormatter, num_key_phrases=num_key_phrases),
+    ),
+]
+
+
+# ==============================================================================
+# RUN
+# ==============================================================================
+
+run_recipe(
+    recipe_config=get_recipe_config(),
+    input_dataset_name=get_input_names_for_role("input_dataset")[0],
+    output_dataset_name=get_output_names_for_role("output_dataset")[0],
+    analyses=[(operation, formatter_class) for (name, operation, formatter_class) in analysis_list if name in analyses],
+)
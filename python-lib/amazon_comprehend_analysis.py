@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Module with the call and format pipeline of Amazon Comprehend analyses, shared by all recipes"""
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import AnyStr, Dict, List
+
+import pandas as pd
+
+from api_cache import ApiResponseCache
+from api_parallelizer import DEFAULT_BATCH_SIZE, DEFAULT_PARALLEL_WORKERS, api_parallelizer
+from api_rate_limiter import AdaptiveRateLimiter
+from amazon_comprehend_api_client import (
+    API_EXCEPTIONS,
+    SUPPORTED_LANGUAGE_CODES,
+    batch_api_response_parser,
+    build_batch_request,
+    build_language_error_batch_response,
+    is_throttling_exception,
+    is_transient_error,
+    merge_entity_responses,
+    merge_key_phrase_responses,
+    merge_language_responses,
+    merge_sentiment_responses,
+    validate_row,
+)
+from amazon_comprehend_api_formatting import GenericAPIFormatter
+from amazon_comprehend_batch_job import ComprehendBatchJob
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+LANGUAGE_DETECTION_OPERATION = "detect_dominant_language"
+SEGMENT_RESPONSE_MERGERS = {
+    "detect_dominant_language": merge_language_responses,
+    "detect_sentiment": merge_sentiment_responses,
+    "detect_entities": merge_entity_responses,
+    "detect_key_phrases": merge_key_phrase_responses,
+}
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def call_api_operation(
+    batch: List[Dict],
+    client,
+    operation: AnyStr,
+    text_column: AnyStr,
+    text_language: AnyStr = None,
+    language_column: AnyStr = None,
+) -> Dict:
+    """
+    Call the batch API of an operation on a batch of rows, e.g. batch_detect_sentiment for "detect_sentiment".
+    Batches with an empty or unsupported language code get an error response without calling the API.
+    """
+    request = build_batch_request(
+        batch, text_column, text_language, language_column, SUPPORTED_LANGUAGE_CODES.get(operation)
+    )
+    if request is None:
+        return build_language_error_batch_response(batch, language_column)
+    responses = getattr(client, "batch_" + operation)(**request)
+    return responses
+
+
+class ComprehendAnalysis:
+    """
+    Call and format pipeline of one Amazon Comprehend operation on chunks of a dataset:
+    - rows are validated locally, deduplicated, looked up in the API cache and split if their text is too long
+    - the batch API is called in parallel through the shared rate limiter, and transient errors are retried
+    - if text_language is "language_column", batches are grouped by the language code of this column
+    - if a batch job is specified, results are taken from its completed job instead of calling the API
+    - responses are formatted into the output columns of the API formatter
+    """
+
+    def __init__(
+        self,
+        operation: AnyStr,
+        api_formatter: GenericAPIFormatter,
+        client,
+        text_column: AnyStr,
+        text_language: AnyStr = None,
+        language_column: AnyStr = None,
+        parallel_workers: int = DEFAULT_PARALLEL_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        length_bucketing: bool = False,
+        rate_limiter: AdaptiveRateLimiter = None,
+        api_cache: ApiResponseCache = None,
+        batch_job: ComprehendBatchJob = None,
+    ):
+        self.operation = operation
+        self.api_formatter = api_formatter
+        self.client = client
+        self.text_column = text_column
+        self.language_kwargs = {}
+        if operation != LANGUAGE_DETECTION_OPERATION:
+            self.language_kwargs = {"text_language": text_language, "language_column": language_column}
+        self.parallel_workers = parallel_workers
+        self.batch_size = batch_size
+        self.length_bucketing = length_bucketing
+        self.rate_limiter = rate_limiter
+        self.api_cache = api_cache
+        self.batch_job = batch_job
+        self.row_validator = partial(
+            validate_row,
+            text_column=text_column,
+            supported_languages=SUPPORTED_LANGUAGE_CODES.get(operation),
+            **self.language_kwargs
+        )
+
+    @property
+    def language_code(self) -> AnyStr:
+        """Language code of all texts, or None if languages are detected or taken from a column"""
+        text_language = self.language_kwargs.get("text_language")
+        return text_language if text_language != "language_column" else None
+
+    def compute(self, input_df: pd.DataFrame, pool: Executor = None) -> pd.DataFrame:
+        """
+        Return the output columns of the analysis for a chunk, with the index of the chunk.
+        If a thread pool is specified, API calls are submitted to it, see api_parallelizer.
+        """
+        error_handling = self.api_formatter.error_handling
+        if self.batch_job is not None:
+            df = self.batch_job.compute_api_results(
+                input_df=input_df,
+                operation=self.operation,
+                column_prefix=self.api_formatter.column_prefix,
+                row_validator=self.row_validator,
+                segment_response_merger=SEGMENT_RESPONSE_MERGERS[self.operation],
+                error_handling=error_handling,
+            )
+        else:
+            api_input_columns = [self.text_column]
+            batch_group_column = None
+            if self.language_kwargs.get("text_language") == "language_column":
+                batch_group_column = self.language_kwargs["language_column"]
+                api_input_columns.append(batch_group_column)
+            df = api_parallelizer(
+                input_df=input_df,
+                api_call_function=call_api_operation,
+                api_exceptions=API_EXCEPTIONS,
+                column_prefix=self.api_formatter.column_prefix,
+                input_columns=api_input_columns,
+                client=self.client,
+                operation=self.operation,
+                text_column=self.text_column,
+                parallel_workers=self.parallel_workers,
+                pool=pool,
+                api_cache=self.api_cache,
+                row_validator=self.row_validator,
+                rate_limiter=self.rate_limiter,
+                is_throttling_exception=is_throttling_exception,
+                is_retryable_error=is_transient_error,
+                segmentation_column=self.text_column,
+                segment_response_merger=SEGMENT_RESPONSE_MERGERS[self.operation],
+                deduplicate=True,
+                error_handling=error_handling,
+                api_support_batch=True,
+                batch_size=self.batch_size,
+                batch_api_response_parser=batch_api_response_parser,
+                batch_group_column=batch_group_column,
+                length_bucketing_column=self.text_column if self.length_bucketing else None,
+                **self.language_kwargs
+            )
+        df = self.api_formatter.format_df(df)
+        output_df = df[[c for c in df.columns if c not in input_df.columns]]
+        output_df.index = input_df.index
+        return output_df
+
+    def close(self) -> None:
+        if self.api_cache is not None:
+            self.api_cache.close()
+
+
+def compute_analyses(
+    input_df: pd.DataFrame,
+    analyses: List[ComprehendAnalysis],
+    parallel_workers: int = DEFAULT_PARALLEL_WORKERS,
+    detect_language_first: bool = False,
+) -> pd.DataFrame:
+    """
+    Run all analyses on a chunk and append their output columns to it, sharing the client and the rate limiter.
+    If detect_language_first is True, language detection runs first, so that other analyses can use the
+    detected language column. Other analyses run concurrently, so that their API calls are scheduled
+    from a single rate budget. All API calls go through a single pool of parallel_workers threads,
+    whatever the number of analyses.
+    """
+    output_dfs = [input_df]
+    concurrent_analyses = list(analyses)
+    with ThreadPoolExecutor(max_workers=parallel_workers) as pool:
+        if detect_language_first:
+            language_detection = [a for a in analyses if a.operation == LANGUAGE_DETECTION_OPERATION][0]
+            output_dfs.append(language_detection.compute(input_df, pool))
+            concurrent_analyses.remove(language_detection)
+        api_input_df = pd.concat(output_dfs, axis=1)
+        if len(concurrent_analyses) == 1:
+            output_dfs.append(concurrent_analyses[0].compute(api_input_df, pool))
+        elif len(concurrent_analyses) > 1:
+            with ThreadPoolExecutor(max_workers=len(concurrent_analyses)) as analysis_pool:
+                output_dfs += list(analysis_pool.map(lambda a: a.compute(api_input_df, pool), concurrent_analyses))
+    return pd.concat(output_dfs, axis=1)
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 """Module with utility functions to call the Amazon Comprehend API"""
 
+import re
 import logging
-import json
-from typing import Dict, List, Union, NamedTuple
+from typing import AnyStr, Dict, List, Set, Tuple, Union, NamedTuple
 
 import boto3
 from boto3.exceptions import Boto3Error
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
 # ==============================================================================
@@ -14,6 +15,41 @@ from botocore.exceptions import BotoCoreError, ClientError
 # ==============================================================================
 
 API_EXCEPTIONS = (Boto3Error, BotoCoreError, ClientError)
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 10
+DEFAULT_READ_TIMEOUT_SECONDS = 60
+DEFAULT_RETRY_MODE = "standard"
+DEFAULT_MAX_ATTEMPTS = 3
+BATCH_INDEX_ERROR_TYPE = "InvalidBatchResponseIndex"
+BATCH_MISSING_INDEX_ERROR_MESSAGE = "No result or error returned by the API for this row"
+BATCH_DUPLICATE_INDEX_ERROR_MESSAGE = "Several results or errors returned by the API for this row"
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "Throttling", "RequestLimitExceeded"}
+TRANSIENT_ERROR_CODES = THROTTLING_ERROR_CODES | {
+    "InternalServerException",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    BATCH_INDEX_ERROR_TYPE,
+}
+TRANSIENT_EXCEPTION_TYPES = {
+    "botocore.exceptions.EndpointConnectionError",
+    "botocore.exceptions.ConnectionClosedError",
+    "botocore.exceptions.ConnectTimeoutError",
+    "botocore.exceptions.ReadTimeoutError",
+}
+EMPTY_TEXT_ERROR_TYPE = "EmptyText"
+EMPTY_TEXT_ERROR_MESSAGE = "Text is empty or null"
+EMPTY_LANGUAGE_ERROR_TYPE = "EmptyLanguageCode"
+EMPTY_LANGUAGE_ERROR_MESSAGE = "Language code is empty"
+UNSUPPORTED_LANGUAGE_ERROR_TYPE = "UnsupportedLanguageCode"
+UNSUPPORTED_LANGUAGE_ERROR_MESSAGE = "Language code '{}' is not supported by this API"
+TEXT_ANALYSIS_LANGUAGE_CODES = {"ar", "de", "en", "es", "fr", "hi", "it", "ja", "ko", "pt", "zh", "zh-TW"}
+SUPPORTED_LANGUAGE_CODES = {
+    "detect_sentiment": TEXT_ANALYSIS_LANGUAGE_CODES,
+    "detect_entities": TEXT_ANALYSIS_LANGUAGE_CODES,
+    "detect_key_phrases": TEXT_ANALYSIS_LANGUAGE_CODES,
+}
+CLIENT_ERROR_CODE_REGEX = re.compile(r"An error occurred \((\w+)\)")
 
 
 # ==============================================================================
@@ -21,37 +57,280 @@ API_EXCEPTIONS = (Boto3Error, BotoCoreError, ClientError)
 # ==============================================================================
 
 
-def get_client(api_configuration_preset):
+def get_client_config(
+    api_configuration_preset: Dict, max_pool_connections: int = None, rate_limited: bool = False
+) -> Config:
+    """
+    Build the botocore configuration of the client from the API configuration preset.
+    The connection pool is sized to the number of parallel workers by default, so that concurrent threads
+    reuse kept-alive connections instead of waiting for a free one or opening new TLS connections.
+    If rate_limited is True, calls are made through the adaptive rate limiter of api_parallelizer, which retries
+    throttled calls and rows with transient errors itself. Retries of the AWS SDK are then turned off, so that
+    throttling reaches the rate limiter at once instead of being retried inside the client first.
+    Attempts are counted with total_max_attempts, including the first one, as max_attempts of botocore
+    only counts retries.
+    """
+    if max_pool_connections is None:
+        max_pool_connections = max(
+            DEFAULT_MAX_POOL_CONNECTIONS, int(api_configuration_preset.get("parallel_workers") or 0)
+        )
+    retries = {
+        "mode": api_configuration_preset.get("retry_mode") or DEFAULT_RETRY_MODE,
+        "total_max_attempts": api_configuration_preset.get("max_attempts") or DEFAULT_MAX_ATTEMPTS,
+    }
+    if rate_limited:
+        retries = {"mode": DEFAULT_RETRY_MODE, "total_max_attempts": 1}
+    return Config(
+        max_pool_connections=max_pool_connections,
+        connect_timeout=api_configuration_preset.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=api_configuration_preset.get("read_timeout") or DEFAULT_READ_TIMEOUT_SECONDS,
+        retries=retries,
+    )
+
+
+def get_client(api_configuration_preset: Dict, max_pool_connections: int = None, rate_limited: bool = False):
     client = boto3.client(
         service_name="comprehend",
         aws_access_key_id=api_configuration_preset.get("aws_access_key"),
         aws_secret_access_key=api_configuration_preset.get("aws_secret_key"),
         region_name=api_configuration_preset.get("aws_region"),
+        endpoint_url=api_configuration_preset.get("endpoint_url") or None,
+        config=get_client_config(api_configuration_preset, max_pool_connections, rate_limited),
     )
     logging.info("Credentials loaded")
     return client
 
 
+def get_s3_client(api_configuration_preset: Dict):
+    """
+    Create an S3 client with the credentials and region of the API configuration preset, for batch jobs
+    """
+    return boto3.client(
+        service_name="s3",
+        aws_access_key_id=api_configuration_preset.get("aws_access_key"),
+        aws_secret_access_key=api_configuration_preset.get("aws_secret_key"),
+        region_name=api_configuration_preset.get("aws_region"),
+        config=get_client_config(api_configuration_preset),
+    )
+
+
+def is_throttling_exception(exception: Exception) -> bool:
+    """
+    Function to detect throttling by the Amazon Comprehend API.
+    Needed for api_parallelizer.api_parallelizer to slow down its rate limiter.
+    """
+    if isinstance(exception, ClientError):
+        return exception.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return False
+
+
+def is_transient_error(error_type: AnyStr, error_raw: AnyStr) -> bool:
+    """
+    Function to tell transient errors, worth retrying, from permanent ones such as TextSizeLimitExceededException.
+    Needed for api_parallelizer.api_parallelizer to retry failed rows.
+    Batch errors have their ErrorCode as error type. Exceptions raised by the client are either modeled
+    exception classes named after their error code, e.g. botocore.errorfactory.InternalServerException,
+    or generic ClientError exceptions with the error code in their raw error.
+    """
+    if error_type in TRANSIENT_EXCEPTION_TYPES or str(error_type).rsplit(".", 1)[-1] in TRANSIENT_ERROR_CODES:
+        return True
+    match = CLIENT_ERROR_CODE_REGEX.search(str(error_raw))
+    return match is not None and match.group(1) in TRANSIENT_ERROR_CODES
+
+
+def get_batch_language_code(batch: List[Dict], language_column: AnyStr) -> AnyStr:
+    """
+    Function to get the language code of a batch grouped by language column, or an empty string if it is invalid.
+    All rows share the same language code, as api_parallelizer.api_parallelizer groups batches by language column.
+    """
+    language_code = batch[0].get(language_column) if len(batch) != 0 else None
+    if not isinstance(language_code, str):
+        return ""
+    return language_code.strip()
+
+
+def validate_row(
+    row: Dict,
+    text_column: AnyStr,
+    text_language: AnyStr = None,
+    language_column: AnyStr = None,
+    supported_languages: Set[AnyStr] = None,
+) -> Tuple[AnyStr, AnyStr]:
+    """
+    Function to validate a row locally before calling the API, to be used as row_validator in api_parallelizer.
+    Return None if the row is valid, else a tuple of (error type, error message) for:
+    - null or blank texts
+    - if text_language is "language_column", empty language codes or codes not in the supported languages
+    """
+    text = row.get(text_column)
+    if not isinstance(text, str) or text.strip() == "":
+        return (EMPTY_TEXT_ERROR_TYPE, EMPTY_TEXT_ERROR_MESSAGE)
+    if text_language == "language_column":
+        language_code = get_batch_language_code([row], language_column)
+        if language_code == "":
+            return (EMPTY_LANGUAGE_ERROR_TYPE, EMPTY_LANGUAGE_ERROR_MESSAGE)
+        if supported_languages is not None and language_code not in supported_languages:
+            return (UNSUPPORTED_LANGUAGE_ERROR_TYPE, UNSUPPORTED_LANGUAGE_ERROR_MESSAGE.format(language_code))
+    return None
+
+
+def build_batch_request(
+    batch: List[Dict],
+    text_column: AnyStr,
+    text_language: AnyStr = None,
+    language_column: AnyStr = None,
+    supported_languages: Set[AnyStr] = None,
+) -> Dict:
+    """
+    Function to build the keyword arguments of a batch API call: stripped texts, and the language code if any.
+    If text_language is "language_column", the language code is taken from the language column of the batch.
+    Return None if this language code is empty or not in the supported languages,
+    in which case the API should not be called.
+    """
+    request = {"TextList": [str(r.get(text_column, "")).strip() for r in batch]}
+    if text_language == "language_column":
+        request["LanguageCode"] = get_batch_language_code(batch, language_column)
+        if request["LanguageCode"] == "":
+            return None
+        if supported_languages is not None and request["LanguageCode"] not in supported_languages:
+            return None
+    elif text_language is not None:
+        request["LanguageCode"] = text_language
+    return request
+
+
+def build_language_error_batch_response(batch: List[Dict], language_column: AnyStr = None) -> Dict:
+    """
+    Function to build a batch API response flagging all rows of the batch with an empty or unsupported
+    language code error, in place of calling the API.
+    """
+    language_code = get_batch_language_code(batch, language_column) if language_column else ""
+    (error_code, error_message) = (EMPTY_LANGUAGE_ERROR_TYPE, EMPTY_LANGUAGE_ERROR_MESSAGE)
+    if language_code != "":
+        (error_code, error_message) = (UNSUPPORTED_LANGUAGE_ERROR_TYPE, UNSUPPORTED_LANGUAGE_ERROR_MESSAGE)
+    return {
+        "ErrorList": [
+            {"Index": i, "ErrorCode": error_code, "ErrorMessage": error_message.format(language_code)}
+            for i in range(len(batch))
+        ]
+    }
+
+
 def batch_api_response_parser(batch: List[Dict], response: Union[Dict, List], api_column_names: NamedTuple) -> Dict:
     """
     Function to parse API results in the batch case.
     Needed for api_parallelizer.api_call_batch as each batch API needs specific response parsing.
+    Results and errors are indexed by their integer 'Index' in a single pass.
+    Rows with a missing or duplicate index are flagged with an error instead of being left blank.
     """
-    results = response.get("ResultList", [])
-    errors = response.get("ErrorList", [])
+    indexed_items = {}
+    duplicate_indices = set()
+    items = [(False, r) for r in response.get("ResultList", [])] + [(True, e) for e in response.get("ErrorList", [])]
+    for is_error, item in items:
+        try:
+            index = int(item.get("Index"))
+        except (TypeError, ValueError):
+            logging.warning("Invalid index in batch API response item: " + str(item))
+            continue
+        if index in indexed_items:
+            duplicate_indices.add(index)
+        indexed_items[index] = (is_error, item)
     for i in range(len(batch)):
         for k in api_column_names:
             batch[i][k] = ""
-        result = [r for r in results if str(r.get("Index", "")) == str(i)]
-        error = [r for r in errors if str(r.get("Index", "")) == str(i)]
-        if len(result) != 0:
-            # result must be json serializable
-            batch[i][api_column_names.response] = json.dumps(result[0])
-        if len(error) != 0:
-            inner_error = error[0]
-            logging.warning(str(inner_error))
-            # custom for Azure edge case which is highly nested
-            batch[i][api_column_names.error_message] = inner_error.get("ErrorMessage", "")
-            batch[i][api_column_names.error_type] = inner_error.get("ErrorCode", "")
-            batch[i][api_column_names.error_raw] = str(inner_error)
+        is_error, item = indexed_items.get(i, (False, None))
+        if item is None or i in duplicate_indices:
+            error_message = BATCH_MISSING_INDEX_ERROR_MESSAGE if item is None else BATCH_DUPLICATE_INDEX_ERROR_MESSAGE
+            logging.warning(error_message + " (index {})".format(i))
+            batch[i][api_column_names.error_message] = error_message
+            batch[i][api_column_names.error_type] = BATCH_INDEX_ERROR_TYPE
+            batch[i][api_column_names.error_raw] = str(item)
+        elif is_error:
+            logging.warning(str(item))
+            batch[i][api_column_names.error_message] = item.get("ErrorMessage", "")
+            batch[i][api_column_names.error_type] = item.get("ErrorCode", "")
+            batch[i][api_column_names.error_raw] = str(item)
+        else:
+            # result is kept as a dict, and only serialized to JSON by the formatter if needed
+            batch[i][api_column_names.response] = item
     return batch
+
+
+def remap_offsets(items: List[Dict], offset: int) -> List[Dict]:
+    """
+    Function to shift the BeginOffset and EndOffset of entities or key phrases found in a segment of text,
+    so that they refer to the original text
+    """
+    remapped_items = []
+    for item in items:
+        item = dict(item)
+        for k in ["BeginOffset", "EndOffset"]:
+            if isinstance(item.get(k), int):
+                item[k] += offset
+        remapped_items.append(item)
+    return remapped_items
+
+
+def compute_segment_weights(segments: List[Tuple[int, AnyStr]]) -> List[float]:
+    lengths = [len(segment) for _, segment in segments]
+    return [length / sum(lengths) for length in lengths]
+
+
+def merge_sentiment_responses(responses: List[Dict], segments: List[Tuple[int, AnyStr]]) -> Dict:
+    """
+    Function to merge sentiment analysis responses of segments of a long text.
+    Needed for api_parallelizer.api_parallelizer to segment texts above the API size limit.
+    Sentiment scores are averaged with weights proportional to segment length,
+    and the merged sentiment is the one with the highest score.
+    """
+    sentiment_scores = {}
+    for response, weight in zip(responses, compute_segment_weights(segments)):
+        for sentiment, score in response.get("SentimentScore", {}).items():
+            sentiment_scores[sentiment] = sentiment_scores.get(sentiment, 0.0) + score * weight
+    sentiment = max(sentiment_scores, key=sentiment_scores.get).upper() if len(sentiment_scores) != 0 else ""
+    return {"Sentiment": sentiment, "SentimentScore": sentiment_scores}
+
+
+def merge_entity_responses(responses: List[Dict], segments: List[Tuple[int, AnyStr]]) -> Dict:
+    """
+    Function to merge named entity recognition responses of segments of a long text.
+    Needed for api_parallelizer.api_parallelizer to segment texts above the API size limit.
+    Entity offsets are shifted to refer to the original text.
+    """
+    entities = []
+    for response, (offset, _) in zip(responses, segments):
+        entities += remap_offsets(response.get("Entities", []), offset)
+    return {"Entities": entities}
+
+
+def merge_key_phrase_responses(responses: List[Dict], segments: List[Tuple[int, AnyStr]]) -> Dict:
+    """
+    Function to merge key phrase extraction responses of segments of a long text.
+    Needed for api_parallelizer.api_parallelizer to segment texts above the API size limit.
+    Key phrases found in several segments are kept once with their highest score, sorted by descending score.
+    Offsets are shifted to refer to the original text.
+    """
+    key_phrases_by_text = {}
+    for response, (offset, _) in zip(responses, segments):
+        for key_phrase in remap_offsets(response.get("KeyPhrases", []), offset):
+            text = str(key_phrase.get("Text", "")).lower()
+            best_score = key_phrases_by_text.get(text, {}).get("Score", -1)
+            if key_phrase.get("Score", 0) > best_score:
+                key_phrases_by_text[text] = key_phrase
+    key_phrases = sorted(key_phrases_by_text.values(), key=lambda x: x.get("Score", 0), reverse=True)
+    return {"KeyPhrases": key_phrases}
+
+
+def merge_language_responses(responses: List[Dict], segments: List[Tuple[int, AnyStr]]) -> Dict:
+    """
+    Function to merge language detection responses of segments of a long text.
+    Needed for api_parallelizer.api_parallelizer to segment texts above the API size limit.
+    Language scores are averaged with weights proportional to segment length, sorted by descending score.
+    """
+    language_scores = {}
+    for response, weight in zip(responses, compute_segment_weights(segments)):
+        for language in response.get("Languages", []):
+            language_code = language.get("LanguageCode")
+            language_scores[language_code] = language_scores.get(language_code, 0.0) + language.get("Score", 0) * weight
+    languages = [{"LanguageCode": k, "Score": v} for k, v in language_scores.items()]
+    return {"Languages": sorted(languages, key=lambda x: x["Score"], reverse=True)}
@@ -2,17 +2,19 @@
 """Module with classes to format results from the Amazon Comprehend API"""
 
 import logging
-from typing import AnyStr, Dict, List
+from typing import AnyStr, Dict, List, Union
 from enum import Enum
 
+import numpy as np
 import pandas as pd
 
 from plugin_io_utils import (
     API_COLUMN_NAMES_DESCRIPTION_DICT,
     ErrorHandlingEnum,
+    OutputColumnLayout,
     build_unique_column_names,
-    generate_unique,
     safe_json_loads,
+    safe_json_dumps,
     move_api_columns_to_end,
 )
 
@@ -39,12 +41,23 @@ class EntityTypeEnum(Enum):
 # ==============================================================================
 
 
+def is_non_empty_response(response: Union[AnyStr, Dict]) -> bool:
+    """
+    Check if an API response should be parsed. Empty or null responses of rows which were not sent to the API,
+    e.g. rows skipped by local validation, give an empty result even in the FAIL error handling mode.
+    """
+    return isinstance(response, dict) or (isinstance(response, str) and response != "")
+
+
 class GenericAPIFormatter:
     """
     Geric Formatter class for API responses:
     - initialize with generic parameters
+    - compute the layout of output columns once
     - compute generic column descriptions
-    - apply format_row to dataframe
+    - compute the output schema
+    - apply format_responses to all API responses of a dataframe at once
+    - serialize raw responses to JSON, or drop them if keep_raw_response is False
     """
 
     def __init__(
@@ -52,22 +65,61 @@ class GenericAPIFormatter:
         input_df: pd.DataFrame,
         column_prefix: AnyStr = "api",
         error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+        keep_raw_response: bool = True,
     ):
         self.input_df = input_df
         self.column_prefix = column_prefix
         self.error_handling = error_handling
+        self.keep_raw_response = keep_raw_response
         self.api_column_names = build_unique_column_names(input_df, column_prefix)
+        self.output_column_layout = OutputColumnLayout(input_df.keys(), column_prefix)
+        self._compute_column_layout()
         self.column_description_dict = {
             v: API_COLUMN_NAMES_DESCRIPTION_DICT[k] for k, v in self.api_column_names._asdict().items()
         }
-
-    def format_row(self, row: Dict) -> Dict:
-        return row
+        self.column_description_dict.update(self.output_column_layout.column_description_dict)
+
+    def _compute_column_layout(self):
+        pass
+
+    def get_output_schema(self, input_schema: List[Dict], verbose: bool = False) -> List[Dict]:
+        """
+        Compute the schema of the output of format_df from the input schema, without calling the API.
+        Columns of the output layout are placed before the API columns, as done by move_api_columns_to_end.
+        """
+        api_column_names_dict = self.api_column_names._asdict()
+        if self.error_handling == ErrorHandlingEnum.FAIL:
+            api_column_names_dict = {k: v for k, v in api_column_names_dict.items() if "error" not in k}
+        if not verbose:
+            api_column_names_dict.pop("error_raw", None)
+        if not self.keep_raw_response:
+            api_column_names_dict.pop("response", None)
+        output_schema = [dict(col) for col in input_schema]
+        output_schema += self.output_column_layout.get_schema()
+        output_schema += [{"name": v, "type": "string"} for v in api_column_names_dict.values()]
+        return output_schema
+
+    def format_responses(self, responses: List[Dict]) -> Dict:
+        """
+        Build all formatted columns at once from the list of parsed responses.
+        Returns a dict of column name to list or array of values, in the order of the responses:
+        NumPy float arrays for scores, and categoricals for predictions with few distinct values.
+        """
+        return {}
 
     def format_df(self, df: pd.DataFrame) -> pd.DataFrame:
         logging.info("Formatting API results...")
-        df = df.apply(func=self.format_row, axis=1)
+        responses_column = df[self.api_column_names.response].tolist()
+        responses = [
+            safe_json_loads(r, self.error_handling) if is_non_empty_response(r) else {} for r in responses_column
+        ]
+        formatted_columns = self.format_responses(responses)
+        df = df.assign(**{k: pd.Series(v, index=df.index) for k, v in formatted_columns.items()})
         df = move_api_columns_to_end(df, self.api_column_names, self.error_handling)
+        if self.keep_raw_response:
+            df[self.api_column_names.response] = [safe_json_dumps(r) for r in responses_column]
+        else:
+            df = df.drop(columns=[self.api_column_names.response])
         logging.info("Formatting API results: Done.")
         return df
 
@@ -77,7 +129,7 @@ class LanguageDetectionAPIFormatter(GenericAPIFormatter):
     Formatter class for Language Detection API responses:
     - make sure response is valid JSON
     - extract language code from response
-    - compute column descriptions
+    - compute column layout
     """
 
     def __init__(
@@ -85,26 +137,26 @@ class LanguageDetectionAPIFormatter(GenericAPIFormatter):
         input_df: pd.DataFrame,
         column_prefix: AnyStr = "lang_detect_api",
         error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+        keep_raw_response: bool = True,
     ):
-        super().__init__(input_df, column_prefix, error_handling)
-        self.language_code_column = generate_unique("language_code", input_df.keys(), self.column_prefix)
-        self.language_score_column = generate_unique("language_score", input_df.keys(), self.column_prefix)
-        self._compute_column_description()
-
-    def _compute_column_description(self):
-        self.column_description_dict[self.language_code_column] = "Language code from the API in ISO 639 format"
-        self.column_description_dict[self.language_score_column] = "Confidence score of the API from 0 to 1"
-
-    def format_row(self, row: Dict) -> Dict:
-        raw_response = row[self.api_column_names.response]
-        response = safe_json_loads(raw_response, self.error_handling)
-        row[self.language_code_column] = ""
-        row[self.language_score_column] = None
-        languages = response.get("Languages", [])
-        if len(languages) != 0:
-            row[self.language_code_column] = languages[0].get("LanguageCode", "")
-            row[self.language_score_column] = languages[0].get("Score", None)
-        return row
+        super().__init__(input_df, column_prefix, error_handling, keep_raw_response)
+
+    def _compute_column_layout(self):
+        self.language_code_column = self.output_column_layout.add_column(
+            "language_code", "string", "Language code from the API in ISO 639 format"
+        )
+        self.language_score_column = self.output_column_layout.add_column(
+            "language_score", "double", "Confidence score of the API from 0 to 1"
+        )
+
+    def format_responses(self, responses: List[Dict]) -> Dict:
+        top_languages = [(r.get("Languages") or [{}])[0] for r in responses]
+        return {
+            self.language_code_column: pd.Categorical([language.get("LanguageCode", "") for language in top_languages]),
+            self.language_score_column: np.array(
+                [language.get("Score") for language in top_languages], dtype=np.float64
+            ),
+        }
 
 
 class SentimentAnalysisAPIFormatter(GenericAPIFormatter):
@@ -112,7 +164,7 @@ class SentimentAnalysisAPIFormatter(GenericAPIFormatter):
     Formatter class for Sentiment Analysis API responses:
     - make sure response is valid JSON
     - extract sentiment scores from response
-    - compute column descriptions
+    - compute column layout
     """
 
     def __init__(
@@ -120,35 +172,30 @@ class SentimentAnalysisAPIFormatter(GenericAPIFormatter):
         input_df: pd.DataFrame,
         column_prefix: AnyStr = "sentiment_api",
         error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+        keep_raw_response: bool = True,
     ):
-        super().__init__(input_df, column_prefix, error_handling)
-        self.sentiment_prediction_column = generate_unique("prediction", input_df.keys(), column_prefix)
+        super().__init__(input_df, column_prefix, error_handling, keep_raw_response)
+
+    def _compute_column_layout(self):
+        self.sentiment_prediction_column = self.output_column_layout.add_column(
+            "prediction", "string", "Sentiment prediction from the API (POSITIVE/NEUTRAL/NEGATIVE/MIXED)"
+        )
         self.sentiment_score_column_dict = {
-            p: generate_unique("score_" + p.lower(), input_df.keys(), column_prefix)
+            p: self.output_column_layout.add_column(
+                "score_" + p.lower(), "double", "Confidence score in the {} prediction from 0 to 1".format(p.upper())
+            )
             for p in ["Positive", "Neutral", "Negative", "Mixed"]
         }
-        self._compute_column_description()
 
-    def _compute_column_description(self):
-        self.column_description_dict[
-            self.sentiment_prediction_column
-        ] = "Sentiment prediction from the API (POSITIVE/NEUTRAL/NEGATIVE/MIXED)"
-        for prediction, column_name in self.sentiment_score_column_dict.items():
-            self.column_description_dict[column_name] = "Confidence score in the {} prediction from 0 to 1".format(
-                prediction.upper()
-            )
-
-    def format_row(self, row: Dict) -> Dict:
-        raw_response = row[self.api_column_names.response]
-        response = safe_json_loads(raw_response, self.error_handling)
-        row[self.sentiment_prediction_column] = response.get("Sentiment", "")
-        sentiment_score = response.get("SentimentScore", {})
+    def format_responses(self, responses: List[Dict]) -> Dict:
+        formatted_columns = {
+            self.sentiment_prediction_column: pd.Categorical([r.get("Sentiment", "") for r in responses])
+        }
+        sentiment_scores = [r.get("SentimentScore", {}) for r in responses]
         for prediction, column_name in self.sentiment_score_column_dict.items():
-            row[column_name] = None
-            score = sentiment_score.get(prediction)
-            if score is not None:
-                row[column_name] = round(score, 3)
-        return row
+            scores = np.array([score.get(prediction) for score in sentiment_scores], dtype=np.float64)
+            formatted_columns[column_name] = np.round(scores, 3)
+        return formatted_columns
 
 
 class NamedEntityRecognitionAPIFormatter(GenericAPIFormatter):
@@ -156,7 +203,7 @@ class NamedEntityRecognitionAPIFormatter(GenericAPIFormatter):
     Formatter class for Named Entity Recognition API responses:
     - make sure response is valid JSON
     - expand results to multiple columns (one by entity type)
-    - compute column descriptions
+    - compute column layout
     """
 
     def __init__(
@@ -166,34 +213,32 @@ class NamedEntityRecognitionAPIFormatter(GenericAPIFormatter):
         minimum_score: float,
         column_prefix: AnyStr = "entity_api",
         error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+        keep_raw_response: bool = True,
     ):
-        super().__init__(input_df, column_prefix, error_handling)
         self.entity_types = entity_types
         self.minimum_score = float(minimum_score)
-        self._compute_column_description()
-
-    def _compute_column_description(self):
-        for n, m in EntityTypeEnum.__members__.items():
-            entity_type_column = generate_unique("entity_type_" + n.lower(), self.input_df.keys(), self.column_prefix)
-            self.column_description_dict[entity_type_column] = "List of '{}' entities recognized by the API".format(
-                str(m.value)
+        super().__init__(input_df, column_prefix, error_handling, keep_raw_response)
+
+    def _compute_column_layout(self):
+        self.entity_type_column_dict = {
+            n: self.output_column_layout.add_column(
+                "entity_type_" + n.lower(),
+                "string",
+                "List of '{}' entities recognized by the API".format(str(EntityTypeEnum[n].value)),
             )
+            for n in sorted([e.name for e in self.entity_types])
+        }
 
-    def format_row(self, row: Dict) -> Dict:
-        raw_response = row[self.api_column_names.response]
-        response = safe_json_loads(raw_response, self.error_handling)
-        entities = response.get("Entities", [])
-        selected_entity_types = sorted([e.name for e in self.entity_types])
-        for n in selected_entity_types:
-            entity_type_column = generate_unique("entity_type_" + n.lower(), row.keys(), self.column_prefix)
-            row[entity_type_column] = [
-                e.get("Text")
-                for e in entities
-                if e.get("Type", "") == n and float(e.get("Score", 0)) >= self.minimum_score
-            ]
-            if len(row[entity_type_column]) == 0:
-                row[entity_type_column] = ""
-        return row
+    def format_responses(self, responses: List[Dict]) -> Dict:
+        entity_texts = {n: [""] * len(responses) for n in self.entity_type_column_dict}
+        for i, response in enumerate(responses):
+            for e in response.get("Entities", []):
+                entity_type = e.get("Type", "")
+                if entity_type in entity_texts and float(e.get("Score", 0)) >= self.minimum_score:
+                    if entity_texts[entity_type][i] == "":
+                        entity_texts[entity_type][i] = []
+                    entity_texts[entity_type][i].append(e.get("Text"))
+        return {entity_type_column: entity_texts[n] for n, entity_type_column in self.entity_type_column_dict.items()}
 
 
 class KeyPhraseExtractionAPIFormatter(GenericAPIFormatter):
@@ -201,7 +246,7 @@ class KeyPhraseExtractionAPIFormatter(GenericAPIFormatter):
     Formatter class for Key Phrase Extraction API responses:
     - make sure response is valid JSON
     - extract a given number of key phrases
-    - compute column descriptions
+    - compute column layout
     """
 
     def __init__(
@@ -210,37 +255,33 @@ class KeyPhraseExtractionAPIFormatter(GenericAPIFormatter):
         num_key_phrases: int,
         column_prefix: AnyStr = "keyphrase_api",
         error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+        keep_raw_response: bool = True,
     ):
-        super().__init__(input_df, column_prefix, error_handling)
         self.num_key_phrases = num_key_phrases
-        self._compute_column_description()
+        super().__init__(input_df, column_prefix, error_handling, keep_raw_response)
 
-    def _compute_column_description(self):
+    def _compute_column_layout(self):
+        self.keyphrase_column_list = []
         for n in range(self.num_key_phrases):
-            keyphrase_column = generate_unique(
-                "keyphrase_" + str(n + 1) + "_text", self.input_df.keys(), self.column_prefix,
-            )
-            confidence_column = generate_unique(
-                "keyphrase_" + str(n + 1) + "_confidence", self.input_df.keys(), self.column_prefix,
+            keyphrase_column = self.output_column_layout.add_column(
+                "keyphrase_" + str(n + 1) + "_text", "string", "Keyphrase {} extracted by the API".format(str(n + 1)),
             )
-            self.column_description_dict[keyphrase_column] = "Keyphrase {} extracted by the API".format(str(n + 1))
-            self.column_description_dict[confidence_column] = "Confidence score in Keyphrase {} from 0 to 1".format(
-                str(n + 1)
+            confidence_column = self.output_column_layout.add_column(
+                "keyphrase_" + str(n + 1) + "_confidence",
+                "double",
+                "Confidence score in Keyphrase {} from 0 to 1".format(str(n + 1)),
             )
-
-    def format_row(self, row: Dict) -> Dict:
-        raw_response = row[self.api_column_names.response]
-        response = safe_json_loads(raw_response, self.error_handling)
-        key_phrases = sorted(response.get("KeyPhrases", []), key=lambda x: x.get("Score"), reverse=True)
-        for n in range(self.num_key_phrases):
-            keyphrase_column = generate_unique("keyphrase_" + str(n + 1) + "_text", row.keys(), self.column_prefix)
-            confidence_column = generate_unique(
-                "keyphrase_" + str(n + 1) + "_confidence", row.keys(), self.column_prefix,
+            self.keyphrase_column_list.append((keyphrase_column, confidence_column))
+
+    def format_responses(self, responses: List[Dict]) -> Dict:
+        key_phrases = [
+            sorted(r.get("KeyPhrases", []), key=lambda x: x.get("Score"), reverse=True)[: self.num_key_phrases]
+            for r in responses
+        ]
+        formatted_columns = {}
+        for n, (keyphrase_column, confidence_column) in enumerate(self.keyphrase_column_list):
+            formatted_columns[keyphrase_column] = [k[n].get("Text", "") if len(k) > n else "" for k in key_phrases]
+            formatted_columns[confidence_column] = np.array(
+                [k[n].get("Score") if len(k) > n else None for k in key_phrases], dtype=np.float64
             )
-            if len(key_phrases) > n:
-                row[keyphrase_column] = key_phrases[n].get("Text", "")
-                row[confidence_column] = key_phrases[n].get("Score")
-            else:
-                row[keyphrase_column] = ""
-                row[confidence_column] = None
-        return row
+        return formatted_columns
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""Module with a runner of Amazon Comprehend asynchronous batch jobs, for datasets too large for batch API calls"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import logging
+import tarfile
+import tempfile
+from bisect import bisect_right, insort
+from enum import Enum
+from threading import Lock
+from urllib.parse import urlparse
+from typing import AnyStr, Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from plugin_io_utils import ErrorHandlingEnum, build_unique_column_names
+from amazon_comprehend_api_client import batch_api_response_parser, get_client, get_s3_client
+from api_parallelizer import check_batch_errors, convert_api_results_to_df
+from text_segmentation import DEFAULT_MAX_SEGMENT_BYTES, split_text
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+BATCH_JOB_API_DICT = {
+    "detect_dominant_language": ("dominant_language_detection_job", "DominantLanguageDetectionJobProperties"),
+    "detect_sentiment": ("sentiment_detection_job", "SentimentDetectionJobProperties"),
+    "detect_entities": ("entities_detection_job", "EntitiesDetectionJobProperties"),
+    "detect_key_phrases": ("key_phrases_detection_job", "KeyPhrasesDetectionJobProperties"),
+}
+JOB_COMPLETED_STATUS = "COMPLETED"
+JOB_FAILED_STATUSES = {"FAILED", "STOP_REQUESTED", "STOPPED"}
+SHARD_FILE_NAME_FORMAT = "shard_{:012d}.txt"
+MANIFEST_FILE_NAME = "manifest.json"
+LINE_BREAKS_TO_SPACES = {ord(c): " " for c in "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"}
+RESULTS_FILE_NAME = "batch_job_results.sqlite"
+RESULTS_INSERT_BATCH_SIZE = 10000
+SQLITE_TIMEOUT_SECONDS = 60
+DEFAULT_POLL_INITIAL_DELAY_SECONDS = 15.0
+DEFAULT_POLL_MAX_DELAY_SECONDS = 300.0
+DEFAULT_JOB_TIMEOUT_SECONDS = 48 * 3600
+
+
+class ExecutionModeEnum(Enum):
+    SYNCHRONOUS = "Synchronous API calls"
+    BATCH_JOB = "Asynchronous batch job"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def parse_s3_uri(s3_uri: AnyStr) -> Tuple[AnyStr, AnyStr]:
+    """
+    Split an S3 URI into its bucket and its key prefix, without leading or trailing slashes
+    """
+    parsed_uri = urlparse(s3_uri)
+    if parsed_uri.scheme != "s3" or parsed_uri.netloc == "":
+        raise ValueError("Invalid S3 URI '{}', it must be of the form s3://bucket/prefix".format(s3_uri))
+    return (parsed_uri.netloc, parsed_uri.path.strip("/"))
+
+
+class ComprehendBatchJob:
+    """
+    Runner of Amazon Comprehend asynchronous batch jobs on the text column of a dataset:
+    - texts are uploaded to S3 as shards of one document per line, one shard per dataset chunk.
+      Chunks may be subsets of rows, e.g. only the new or changed rows of a chunk in incremental mode.
+    - texts above the byte size limit of the API are split into segments, each on its own line,
+      and the results of their segments are merged as for synchronous API calls
+    - one job per operation processes all shards, and all jobs are polled with exponential backoff
+    - the gzipped output archive of each job is streamed from S3, and its results are indexed
+      by shard and line number in a temporary SQLite database
+    - results are mapped back to rows by their row id, as batch API results, to be formatted as usual
+    Runs are resumable: a manifest in the run prefix records the hash of each shard and the id of each job,
+    so that a run with the same name only uploads changed shards, and reuses jobs started on the same input.
+    """
+
+    def __init__(
+        self,
+        client,
+        s3_client,
+        s3_uri: AnyStr,
+        data_access_role_arn: AnyStr,
+        text_column: AnyStr,
+        run_name: AnyStr,
+        max_document_bytes: int = DEFAULT_MAX_SEGMENT_BYTES,
+        poll_initial_delay: float = DEFAULT_POLL_INITIAL_DELAY_SECONDS,
+        poll_max_delay: float = DEFAULT_POLL_MAX_DELAY_SECONDS,
+        timeout: float = DEFAULT_JOB_TIMEOUT_SECONDS,
+    ):
+        self.client = client
+        self.s3_client = s3_client
+        self.data_access_role_arn = data_access_role_arn
+        self.text_column = text_column
+        self.max_document_bytes = max_document_bytes
+        self.poll_initial_delay = poll_initial_delay
+        self.poll_max_delay = poll_max_delay
+        self.timeout = timeout
+        self.run_name = run_name
+        (self.bucket, prefix) = parse_s3_uri(s3_uri)
+        self.run_prefix = "/".join([p for p in [prefix, run_name] if p != ""])
+        self.input_prefix = self.run_prefix + "/input/"
+        self.manifest_key = self.run_prefix + "/" + MANIFEST_FILE_NAME
+        self.manifest = {"input_hash": "", "shards": {}, "jobs": {}}
+        self.job_ids = {}
+        self.completed_operations = set()
+        self.shard_starts = []
+        self.shard_row_ids = {}
+        self._directory = tempfile.mkdtemp(prefix="batch_job_results_")
+        self.file_path = os.path.join(self._directory, RESULTS_FILE_NAME)
+        self._lock = Lock()
+        self._connect()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                + "(operation TEXT, file TEXT, line INTEGER, item TEXT, PRIMARY KEY (operation, file, line))"
+            )
+
+    def _connect(self) -> None:
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(self.file_path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        SQLite connection of the current process, reconnecting in processes forked after results were loaded
+        as SQLite connections must not be shared across processes
+        """
+        if self._pid != os.getpid():
+            self._connect()
+        return self._connection
+
+    def get_shard_name(self, shard_start: int) -> AnyStr:
+        return SHARD_FILE_NAME_FORMAT.format(shard_start)
+
+    def locate_rows(self, row_ids: Iterable) -> List[Tuple[int, int, int]]:
+        """
+        Return the (shard start, first line number, number of lines) of each row id,
+        or (None, None, 0) for rows which were not uploaded.
+        Row ids of chunks read from a dataset are increasing, so the shard of a row is the one with the last start
+        before its row id, and its lines are found by binary search in the row id of each line of this shard.
+        """
+        locations = []
+        for row_id in row_ids:
+            row_id = int(row_id)
+            i = bisect_right(self.shard_starts, row_id) - 1
+            if i >= 0:
+                line_row_ids = self.shard_row_ids[self.shard_starts[i]]
+                first_line = int(np.searchsorted(line_row_ids, row_id, side="left"))
+                num_lines = int(np.searchsorted(line_row_ids, row_id, side="right")) - first_line
+                if num_lines != 0:
+                    locations.append((self.shard_starts[i], first_line, num_lines))
+                    continue
+            locations.append((None, None, 0))
+        return locations
+
+    def split_document(self, text) -> List[Tuple[int, AnyStr]]:
+        """
+        Split a text into segments within the byte size limit of the API, as done for synchronous API calls.
+        Line breaks are replaced by spaces so that each segment holds on one line, without changing offsets.
+        """
+        if not isinstance(text, str):
+            return [(0, "")]
+        return split_text(text.translate(LINE_BREAKS_TO_SPACES), self.max_document_bytes)
+
+    def load_manifest(self) -> Dict:
+        """
+        Return the manifest of a previous run with the same name, or an empty dictionary for a new run
+        """
+        try:
+            response_body = self.s3_client.get_object(Bucket=self.bucket, Key=self.manifest_key)["Body"]
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in {"NoSuchKey", "404"}:
+                return {}
+            raise
+        return json.loads(response_body.read().decode("utf-8"))
+
+    def save_manifest(self) -> None:
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self.manifest_key, Body=json.dumps(self.manifest, sort_keys=True).encode("utf-8")
+        )
+
+    def upload_chunks(self, chunks: Iterable[pd.DataFrame]) -> None:
+        """
+        Upload the text column of chunks of the input dataset to S3, as one shard per chunk with one document
+        per line, or one line per segment for long texts. Shards unchanged since a previous run with the same name
+        are not uploaded again, and shards of this previous run which are not part of the current input are deleted.
+        """
+        previous_manifest = self.load_manifest()
+        previous_shards = previous_manifest.get("shards", {})
+        shards = {}
+        (num_rows, num_segmented_rows, num_uploaded_shards) = (0, 0, 0)
+        for input_df in chunks:
+            if len(input_df.index) == 0:
+                continue
+            (documents, line_row_ids) = ([], [])
+            for row_id, text in zip(input_df.index, input_df[self.text_column]):
+                segments = self.split_document(text)
+                documents += [segment for _, segment in segments]
+                line_row_ids += [int(row_id)] * len(segments)
+                num_segmented_rows += int(len(segments) > 1)
+            shard_start = line_row_ids[0]
+            shard_name = self.get_shard_name(shard_start)
+            body = "\n".join(documents).encode("utf-8")
+            shards[shard_name] = hashlib.sha256(body).hexdigest()
+            if previous_shards.get(shard_name) != shards[shard_name]:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.input_prefix + shard_name, Body=body)
+                num_uploaded_shards += 1
+            insort(self.shard_starts, shard_start)
+            self.shard_row_ids[shard_start] = np.array(line_row_ids, dtype=np.int64)
+            num_rows += len(input_df.index)
+        for shard_name in set(previous_shards) - set(shards):
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.input_prefix + shard_name)
+        input_hash = hashlib.sha256(json.dumps(shards, sort_keys=True).encode("utf-8")).hexdigest()
+        previous_jobs = previous_manifest.get("jobs", {}) if previous_manifest.get("input_hash") == input_hash else {}
+        self.manifest = {"input_hash": input_hash, "shards": shards, "jobs": previous_jobs}
+        self.save_manifest()
+        logging.info(
+            "Batch job: {} rows in {} shards of s3://{}/{}, of which {} shards uploaded and {} unchanged".format(
+                num_rows,
+                len(shards),
+                self.bucket,
+                self.input_prefix,
+                num_uploaded_shards,
+                len(shards) - num_uploaded_shards,
+            )
+        )
+        if num_segmented_rows != 0:
+            logging.warning(
+                "Batch job: {} texts above the size limit of {} bytes were split into segments".format(
+                    num_segmented_rows, self.max_document_bytes
+                )
+            )
+
+    def start_job(self, operation: AnyStr, language_code: AnyStr = None) -> AnyStr:
+        """
+        Start the batch job of an operation on all uploaded shards, and return its id.
+        A job of a previous run with the same name is reused if it ran on the same input and did not fail.
+        """
+        previous_job = self.manifest["jobs"].get(operation)
+        if previous_job is not None and previous_job.get("language_code") == language_code:
+            self.job_ids[operation] = previous_job["job_id"]
+            job_status = self.describe_job(operation).get("JobStatus")
+            if job_status not in JOB_FAILED_STATUSES:
+                logging.info(
+                    "Batch job: resuming {} job {} with status {}".format(
+                        operation, self.job_ids[operation], job_status
+                    )
+                )
+                return self.job_ids[operation]
+        (job_api_name, _) = BATCH_JOB_API_DICT[operation]
+        job_kwargs = {
+            "JobName": "{}_{}".format(self.run_name, operation),
+            "InputDataConfig": {
+                "S3Uri": "s3://{}/{}".format(self.bucket, self.input_prefix),
+                "InputFormat": "ONE_DOC_PER_LINE",
+            },
+            "OutputDataConfig": {"S3Uri": "s3://{}/{}/output/{}/".format(self.bucket, self.run_prefix, operation)},
+            "DataAccessRoleArn": self.data_access_role_arn,
+        }
+        if language_code is not None:
+            job_kwargs["LanguageCode"] = language_code
+        response = getattr(self.client, "start_" + job_api_name)(**job_kwargs)
+        self.job_ids[operation] = response["JobId"]
+        self.manifest["jobs"][operation] = {"job_id": response["JobId"], "language_code": language_code}
+        self.save_manifest()
+        logging.info("Batch job: started {} job {}".format(operation, response["JobId"]))
+        return response["JobId"]
+
+    def describe_job(self, operation: AnyStr) -> Dict:
+        (job_api_name, properties_key) = BATCH_JOB_API_DICT[operation]
+        response = getattr(self.client, "describe_" + job_api_name)(JobId=self.job_ids[operation])
+        return response[properties_key]
+
+    def wait_for_jobs(self) -> None:
+        """
+        Poll all started jobs with exponential backoff until they complete, and load the results of each job
+        once it completes. Raise an exception if a job fails or does not complete before the timeout.
+        """
+        pending_operations = [o for o in self.job_ids if o not in self.completed_operations]
+        delay = self.poll_initial_delay
+        start_time = time.monotonic()
+        while len(pending_operations) != 0:
+            for operation in list(pending_operations):
+                job_properties = self.describe_job(operation)
+                job_status = job_properties.get("JobStatus")
+                if job_status == JOB_COMPLETED_STATUS:
+                    self.load_results(operation, job_properties["OutputDataConfig"]["S3Uri"])
+                    self.completed_operations.add(operation)
+                    pending_operations.remove(operation)
+                elif job_status in JOB_FAILED_STATUSES:
+                    raise RuntimeError(
+                        "Batch job {} of {} ended with status {}: {}".format(
+                            self.job_ids[operation], operation, job_status, job_properties.get("Message", "")
+                        )
+                    )
+            if len(pending_operations) == 0:
+                break
+            if time.monotonic() - start_time > self.timeout:
+                raise TimeoutError("Batch jobs did not complete within {} seconds".format(self.timeout))
+            logging.info("Batch job: waiting {:.0f} seconds for {} jobs".format(delay, len(pending_operations)))
+            time.sleep(delay)
+            delay = min(2 * delay, self.poll_max_delay)
+
+    def load_results(self, operation: AnyStr, output_s3_uri: AnyStr) -> None:
+        """
+        Stream the gzipped output archive of a job from S3, and index its results by shard and line number
+        without extracting the archive or holding it in memory
+        """
+        (bucket, key) = parse_s3_uri(output_s3_uri)
+        response_body = self.s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        num_results = 0
+        with tarfile.open(fileobj=response_body, mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                rows = []
+                for line in archive.extractfile(member):
+                    if line.strip() == b"":
+                        continue
+                    item = json.loads(line.decode("utf-8"))
+                    rows.append(
+                        (operation, os.path.basename(item.pop("File", "")), int(item.pop("Line", -1)), json.dumps(item))
+                    )
+                    if len(rows) == RESULTS_INSERT_BATCH_SIZE:
+                        num_results += self._insert_results(rows)
+                        rows = []
+                num_results += self._insert_results(rows)
+        logging.info("Batch job: loaded {} results of {} from {}".format(num_results, operation, output_s3_uri))
+
+    def _insert_results(self, rows: Iterable[Tuple]) -> int:
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (operation, file, line, item) VALUES (?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def get_shard_results(self, operation: AnyStr, shard_name: AnyStr) -> Dict[int, Dict]:
+        """
+        Return a dictionary of results or errors of a job for a shard, keyed by line number
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT line, item FROM results WHERE operation = ? AND file = ?", (operation, shard_name)
+            ).fetchall()
+        return {line: json.loads(item) for line, item in rows}
+
+    def compute_api_results(
+        self,
+        input_df: pd.DataFrame,
+        operation: AnyStr,
+        column_prefix: AnyStr,
+        row_validator: Callable = None,
+        segment_response_merger: Callable = None,
+        error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
+    ) -> pd.DataFrame:
+        """
+        Add the API columns of rows from the results of a completed job, in the same format as api_parallelizer.
+        Results are mapped to rows by the shard and line numbers of their row id, as batch API results are mapped
+        by index, and rows without result are flagged with an error. Rows rejected by the row validator are flagged too,
+        but they do not raise an exception in the FAIL error handling mode, as in api_parallelizer.
+        Results of the segments of long texts are merged by segment_response_merger, or take the error of the first
+        failed segment.
+        """
+        api_column_names = build_unique_column_names(input_df.columns, column_prefix)
+        row_locations = self.locate_rows(input_df.index)
+        shard_results = {
+            shard_start: self.get_shard_results(operation, self.get_shard_name(shard_start))
+            for shard_start in set(shard_start for shard_start, _, _ in row_locations if shard_start is not None)
+        }
+        batch = [{self.text_column: text} for text in input_df[self.text_column]]
+        response = {"ResultList": [], "ErrorList": []}
+        validated_indices = []
+        for i, (row, (shard_start, first_line, num_lines)) in enumerate(zip(batch, row_locations)):
+            validation_error = row_validator(row) if row_validator is not None else None
+            if validation_error is not None:
+                response["ErrorList"].append(
+                    {"Index": i, "ErrorCode": validation_error[0], "ErrorMessage": validation_error[1]}
+                )
+                continue
+            validated_indices.append(i)
+            if num_lines == 0:
+                continue  # rows without result are flagged with an error by the response parser
+            lines = shard_results[shard_start]
+            items = [lines[line] for line in range(first_line, first_line + num_lines) if line in lines]
+            if len(items) != num_lines:
+                continue
+            failed_items = [item for item in items if "ErrorCode" in item]
+            if len(failed_items) != 0:
+                response["ErrorList"].append({"Index": i, **failed_items[0]})
+            elif len(items) == 1:
+                response["ResultList"].append({"Index": i, **items[0]})
+            elif segment_response_merger is None:
+                raise ValueError("Results of the segments of a long text cannot be merged without a response merger")
+            else:
+                merged_item = segment_response_merger(
+                    responses=items, segments=self.split_document(row[self.text_column])
+                )
+                response["ResultList"].append({"Index": i, **merged_item})
+        batch = batch_api_response_parser(batch, response, api_column_names)
+        if error_handling == ErrorHandlingEnum.FAIL:
+            check_batch_errors([batch[i] for i in validated_indices], api_column_names)
+        api_results = {c: [row[c] for row in batch] for c in api_column_names}
+        return convert_api_results_to_df(input_df, api_results, api_column_names, error_handling)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+        logging.info("Batch job: input and output files are kept in s3://{}/{}".format(self.bucket, self.run_prefix))
+
+
+def get_batch_job(api_configuration_preset: Dict, text_column: AnyStr, run_params: Dict) -> ComprehendBatchJob:
+    """
+    Initialize the batch job runner from the API configuration preset,
+    or return None if the execution mode is synchronous API calls.
+    The run name is a hash of the run parameters, e.g. the recipe configuration and the output dataset,
+    so that running the same recipe again resumes the previous run instead of starting over.
+    Job calls are not rate limited, so its client keeps the retries of the AWS SDK.
+    """
+    execution_mode = ExecutionModeEnum[api_configuration_preset.get("execution_mode") or "SYNCHRONOUS"]
+    if execution_mode != ExecutionModeEnum.BATCH_JOB:
+        return None
+    s3_uri = api_configuration_preset.get("batch_job_s3_uri")
+    data_access_role_arn = api_configuration_preset.get("batch_job_data_access_role_arn")
+    if not s3_uri or not data_access_role_arn:
+        raise ValueError(
+            "You must specify an S3 URI and a data access role ARN for batch jobs in the API configuration preset."
+        )
+    run_fingerprint = hashlib.sha256(json.dumps(run_params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return ComprehendBatchJob(
+        client=get_client(api_configuration_preset),
+        s3_client=get_s3_client(api_configuration_preset),
+        s3_uri=s3_uri,
+        data_access_role_arn=data_access_role_arn,
+        text_column=text_column,
+        run_name="dss_" + run_fingerprint[:16],
+    )
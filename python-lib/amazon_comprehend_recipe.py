@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Module with the setup, run and teardown steps shared by all recipes of the plugin"""
+
+from functools import partial
+from typing import AnyStr, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+import dataiku
+
+from plugin_io_utils import ErrorHandlingEnum, validate_column_input
+from dku_io_utils import DEFAULT_CHUNK_SIZE, get_previous_output_index, set_column_description, process_dataset_chunks
+from amazon_comprehend_api_client import get_client
+from amazon_comprehend_api_formatting import LanguageDetectionAPIFormatter
+from amazon_comprehend_analysis import LANGUAGE_DETECTION_OPERATION, ComprehendAnalysis, compute_analyses
+from amazon_comprehend_batch_job import get_batch_job
+from api_cache import get_api_cache
+from api_rate_limiter import AdaptiveRateLimiter
+from chunk_checkpoint import get_chunk_checkpoint
+from chunk_parallelizer import DEFAULT_PARALLEL_PROCESSES
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def run_recipe(
+    recipe_config: Dict,
+    input_dataset_name: AnyStr,
+    output_dataset_name: AnyStr,
+    analyses: List[Tuple[AnyStr, Callable]],
+) -> None:
+    """
+    Run analyses of Amazon Comprehend on the text column of the input dataset, and write the output dataset.
+    Analyses are given as tuples of (operation, API formatter class), e.g. ("detect_sentiment",
+    SentimentAnalysisAPIFormatter). Formatter classes are called with the input dataframe template,
+    the error handling and the raw response option of the recipe; use functools.partial for other parameters.
+    The recipe configuration is parsed for the parameters common to all recipes:
+    - the API configuration preset: concurrency, batching, rate limit, cache, checkpoint and execution mode
+    - the text column, and the language option if any: a language code, "language_column", or "auto"
+      to detect the language of each text first, with language detection columns added to the output
+    - error handling, raw response and incremental mode options
+    """
+    api_configuration_preset = recipe_config.get("api_configuration_preset")
+    parallel_workers = api_configuration_preset.get("parallel_workers")
+    chunk_size = api_configuration_preset.get("chunk_size", DEFAULT_CHUNK_SIZE)
+    parallel_processes = api_configuration_preset.get("parallel_processes") or DEFAULT_PARALLEL_PROCESSES
+    text_column = recipe_config.get("text_column")
+    text_language = recipe_config.get("language")
+    language_column = recipe_config.get("language_column")
+    error_handling = ErrorHandlingEnum[recipe_config.get("error_handling")]
+    keep_raw_response = bool(recipe_config.get("keep_raw_response", True))
+    incremental_mode = bool(recipe_config.get("incremental_mode", False))
+    key_column = recipe_config.get("key_column")
+    text_hash_column = recipe_config.get("text_hash_column")
+
+    input_dataset = dataiku.Dataset(input_dataset_name)
+    input_schema = input_dataset.read_schema()
+    input_columns_names = [col["name"] for col in input_schema]
+    output_dataset = dataiku.Dataset(output_dataset_name)
+
+    validate_column_input(text_column, input_columns_names)
+    if incremental_mode:
+        validate_column_input(key_column, input_columns_names)
+        if text_hash_column:
+            validate_column_input(text_hash_column, input_columns_names)
+    if text_language == "language_column":
+        validate_column_input(language_column, input_columns_names)
+
+    operations = [operation for (operation, _) in analyses]
+    run_params = {
+        "input_dataset": input_dataset_name,
+        "output_dataset": output_dataset_name,
+        "recipe_config": {k: v for k, v in recipe_config.items() if k != "api_configuration_preset"},
+    }
+    client = get_client(api_configuration_preset, rate_limited=True)
+    batch_job = get_batch_job(
+        api_configuration_preset, text_column, run_params={"operations": operations, **run_params}
+    )
+    if batch_job is not None and text_language in {"auto", "language_column"}:
+        raise ValueError("The batch job execution mode requires a single language for all texts.")
+    rate_limiter = AdaptiveRateLimiter(
+        rate_limit=api_configuration_preset.get("api_quota_rate_limit"),
+        period=api_configuration_preset.get("api_quota_period"),
+        shared=parallel_processes > 1,
+    )
+    checkpoint = get_chunk_checkpoint(api_configuration_preset, operation="+".join(operations), params=run_params)
+    input_df_template = pd.DataFrame(columns=input_columns_names)
+    api_formatters = [
+        formatter_class(input_df=input_df_template, error_handling=error_handling, keep_raw_response=keep_raw_response)
+        for (_, formatter_class) in analyses
+    ]
+    detect_language_first = text_language == "auto"
+    if detect_language_first:
+        if LANGUAGE_DETECTION_OPERATION not in operations:
+            # Languages are detected first as an additional analysis, without keeping the raw response
+            operations.insert(0, LANGUAGE_DETECTION_OPERATION)
+            api_formatters.insert(
+                0,
+                LanguageDetectionAPIFormatter(
+                    input_df=input_df_template, error_handling=error_handling, keep_raw_response=False
+                ),
+            )
+        # Rows are grouped in batches by the language code detected by the API, as with a language column
+        text_language = "language_column"
+        language_column = api_formatters[operations.index(LANGUAGE_DETECTION_OPERATION)].language_code_column
+    comprehend_analyses = [
+        ComprehendAnalysis(
+            operation=operation,
+            api_formatter=api_formatter,
+            client=client,
+            text_column=text_column,
+            text_language=text_language,
+            language_column=language_column,
+            parallel_workers=parallel_workers,
+            batch_size=api_configuration_preset.get("batch_size"),
+            length_bucketing=bool(api_configuration_preset.get("length_bucketing", False)),
+            rate_limiter=rate_limiter,
+            api_cache=get_api_cache(
+                api_configuration_preset,
+                operation=operation,
+                params={"language": text_language} if operation != LANGUAGE_DETECTION_OPERATION else None,
+            ),
+            batch_job=batch_job,
+        )
+        for (operation, api_formatter) in zip(operations, api_formatters)
+    ]
+
+    output_schema = [dict(col) for col in input_schema]
+    column_description_dict = {}
+    for api_formatter in api_formatters:
+        output_schema += api_formatter.get_output_schema(input_schema)[len(input_schema) :]
+        column_description_dict.update(api_formatter.column_description_dict)
+    previous_output_index = None
+    if incremental_mode:
+        previous_output_index = get_previous_output_index(
+            output_dataset=output_dataset,
+            output_schema=output_schema,
+            input_schema=input_schema,
+            key_column=key_column,
+            text_column=text_column,
+            text_hash_column=text_hash_column,
+            chunksize=chunk_size,
+        )
+    if batch_job is not None:
+        upload_columns = [text_column]
+        if previous_output_index is not None:
+            upload_columns += [c for c in [key_column, text_hash_column] if c and c not in upload_columns]
+        upload_chunks = input_dataset.iter_dataframes(
+            chunksize=chunk_size, infer_with_pandas=False, columns=upload_columns
+        )
+        if previous_output_index is not None:
+            # Rows which will be copied from the previous output are not sent to the jobs
+            upload_chunks = (previous_output_index.filter_rows_to_process(df) for df in upload_chunks)
+        batch_job.upload_chunks(upload_chunks)
+        if len(batch_job.shard_starts) != 0:
+            # All jobs read the same uploaded texts and run concurrently
+            for analysis in comprehend_analyses:
+                batch_job.start_job(analysis.operation, language_code=analysis.language_code)
+            batch_job.wait_for_jobs()
+    process_dataset_chunks(
+        input_dataset=input_dataset,
+        output_dataset=output_dataset,
+        output_schema=output_schema,
+        func=partial(
+            compute_analyses,
+            analyses=comprehend_analyses,
+            parallel_workers=parallel_workers,
+            detect_language_first=detect_language_first,
+        ),
+        chunksize=chunk_size,
+        parallel_processes=parallel_processes,
+        checkpoint=checkpoint,
+        previous_output_index=previous_output_index,
+    )
+    if previous_output_index is not None:
+        previous_output_index.close()
+    if batch_job is not None:
+        batch_job.close()
+    for analysis in comprehend_analyses:
+        analysis.close()
+    set_column_description(
+        input_dataset=input_dataset, output_dataset=output_dataset, column_description_dict=column_description_dict,
+    )
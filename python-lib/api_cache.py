@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Module with a persistent cache of API responses, to avoid calling the API again on unchanged inputs"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from threading import Lock
+from typing import AnyStr, Dict, List, Union
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+CACHE_FILE_NAME = "api_response_cache.sqlite"
+DEFAULT_CACHE_MAX_ENTRIES = 1000000
+DEFAULT_CACHE_MAX_AGE_DAYS = 30
+SQLITE_TIMEOUT_SECONDS = 60
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class ApiResponseCache:
+    """
+    Persistent cache of API responses stored in a SQLite database:
+    - compute cache keys as a hash of the API operation, its parameters and the normalized row values
+    - look up and store responses for many keys at once
+    - evict entries by age and by total number of entries
+    - keep hit and miss statistics
+    """
+
+    def __init__(
+        self,
+        path: AnyStr,
+        operation: AnyStr,
+        params: Dict = None,
+        max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+        max_age_days: float = DEFAULT_CACHE_MAX_AGE_DAYS,
+    ):
+        os.makedirs(path, exist_ok=True)
+        self.file_path = os.path.join(path, CACHE_FILE_NAME)
+        self.operation = operation
+        self.params = params or {}
+        self.max_entries = int(max_entries)
+        self.max_age_seconds = float(max_age_days) * 24 * 3600
+        self.num_hits = 0
+        self.num_misses = 0
+        self._lock = Lock()
+        self._connect()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created_at REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        logging.info("API response cache loaded from {}".format(self.file_path))
+        self.evict()
+
+    def _connect(self) -> None:
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(self.file_path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        SQLite connection of the current process, reconnecting in processes forked after the cache was loaded
+        as SQLite connections must not be shared across processes
+        """
+        if self._pid != os.getpid():
+            self._connect()
+        return self._connection
+
+    def compute_key(self, values: List) -> AnyStr:
+        """
+        Hash the API operation, its parameters and the row values sent to the API.
+        String values are stripped, as done before sending them to the API.
+        """
+        normalized_values = [v.strip() if isinstance(v, str) else v for v in values]
+        key_content = json.dumps([self.operation, self.params, normalized_values], sort_keys=True, default=str)
+        return hashlib.sha256(key_content.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[AnyStr]) -> Dict[AnyStr, Union[Dict, AnyStr]]:
+        """
+        Return cached responses for the given keys, ignoring expired entries
+        """
+        responses = {}
+        min_created_at = time.time() - self.max_age_seconds
+        unique_keys = list(set(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), 500):  # SQLite limits the number of query parameters
+                keys_chunk = unique_keys[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT key, response FROM responses WHERE created_at >= ? AND key IN ({})".format(
+                        ",".join(["?"] * len(keys_chunk))
+                    ),
+                    [min_created_at] + keys_chunk,
+                ).fetchall()
+                responses.update({key: json.loads(response) for key, response in rows})
+            num_hits = sum([key in responses for key in keys])
+            self.num_hits += num_hits
+            self.num_misses += len(keys) - num_hits
+        return responses
+
+    def set_many(self, responses: Dict[AnyStr, Union[Dict, AnyStr]]) -> None:
+        """
+        Store responses for the given keys, replacing existing entries
+        """
+        created_at = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(response), created_at) for key, response in responses.items()],
+            )
+
+    def evict(self) -> None:
+        """
+        Delete entries older than the maximum age, then the oldest entries beyond the maximum number of entries
+        """
+        with self._lock, self.connection:
+            num_expired = self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", [time.time() - self.max_age_seconds]
+            ).rowcount
+            num_excess = self.connection.execute(
+                "DELETE FROM responses WHERE key IN "
+                + "(SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                [self.max_entries],
+            ).rowcount
+        if num_expired + num_excess != 0:
+            logging.info("API response cache: evicted {} expired and {} excess entries".format(num_expired, num_excess))
+
+    def log_stats(self) -> None:
+        num_lookups = self.num_hits + self.num_misses
+        hit_ratio = self.num_hits / num_lookups if num_lookups != 0 else 0
+        logging.info(
+            "API response cache: {} hits, {} misses, hit ratio {:.1%}".format(self.num_hits, self.num_misses, hit_ratio)
+        )
+
+    def close(self) -> None:
+        self.evict()
+        self.log_stats()
+        with self._lock:
+            self._connection.close()
+
+
+def get_api_cache(api_configuration_preset: Dict, operation: AnyStr, params: Dict = None) -> ApiResponseCache:
+    """
+    Initialize the API response cache from the API configuration preset, or return None if it is disabled
+    """
+    if not api_configuration_preset.get("cache_enabled", False):
+        return None
+    cache_path = api_configuration_preset.get("cache_path")
+    if cache_path is None or len(cache_path) == 0:
+        raise ValueError("You must specify a valid cache directory path in the API configuration preset.")
+    return ApiResponseCache(
+        path=cache_path,
+        operation=operation,
+        params=params,
+        max_entries=api_configuration_preset.get("cache_max_entries", DEFAULT_CACHE_MAX_ENTRIES),
+        max_age_days=api_configuration_preset.get("cache_max_age_days", DEFAULT_CACHE_MAX_AGE_DAYS),
+    )
@@ -4,14 +4,21 @@
 import logging
 import inspect
 import math
-from typing import Callable, AnyStr, List, Tuple, NamedTuple, Dict, Union
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import time
+from itertools import islice
+from typing import Callable, AnyStr, List, Tuple, NamedTuple, Dict, Union, Iterable, Generator
+from concurrent.futures import ThreadPoolExecutor, Executor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
 
 import pandas as pd
-from more_itertools import chunked, flatten
+from more_itertools import chunked
 from tqdm.auto import tqdm as tqdm_auto
 
 from plugin_io_utils import ErrorHandlingEnum, build_unique_column_names
+from api_cache import ApiResponseCache
+from api_rate_limiter import AdaptiveRateLimiter
+from text_segmentation import DEFAULT_MAX_SEGMENT_BYTES, split_text, utf8_byte_length
 
 
 # ==============================================================================
@@ -20,7 +27,14 @@ from plugin_io_utils import ErrorHandlingEnum, build_unique_column_names
 
 DEFAULT_PARALLEL_WORKERS = 4
 DEFAULT_BATCH_SIZE = 10
+DEFAULT_TASKS_IN_FLIGHT_PER_WORKER = 3
+DEFAULT_DEDUPLICATE = False
+DEFAULT_MAX_THROTTLING_RETRIES = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY_SECONDS = 1.0
+DEFAULT_RETRY_MAX_DELAY_SECONDS = 30.0
 DEFAULT_API_SUPPORT_BATCH = False
+DEFAULT_MAX_BATCH_BYTES = 2 * DEFAULT_MAX_SEGMENT_BYTES
 DEFAULT_VERBOSE = False
 
 
@@ -29,6 +43,60 @@ DEFAULT_VERBOSE = False
 # ==============================================================================
 
 
+def set_api_exception(rows: List[Dict], exception: Exception, api_column_names: NamedTuple) -> None:
+    """
+    Helper function to the API call wrappers.
+    Log an API exception and write it to the error keys of rows, with an empty response.
+    """
+    logging.warning(str(exception))
+    error_type = str(type(exception).__qualname__)
+    module = inspect.getmodule(exception)
+    if module is not None:
+        error_type = str(module.__name__) + "." + error_type
+    for row in rows:
+        row[api_column_names.response] = ""
+        row[api_column_names.error_message] = str(exception)
+        row[api_column_names.error_type] = error_type
+        row[api_column_names.error_raw] = str(exception.args)
+
+
+def check_batch_errors(batch: List[Dict], api_column_names: NamedTuple) -> None:
+    """
+    Helper function to the API call wrappers.
+    Raise an exception if any row of the batch has an error, in the FAIL error handling mode.
+    """
+    errors = [row[api_column_names.error_message] for row in batch if row[api_column_names.error_message] != ""]
+    if len(errors) != 0:
+        raise Exception("API returned errors: " + str(errors))
+
+
+def call_api_with_rate_limiter(
+    api_call_function: Callable,
+    rate_limiter: AdaptiveRateLimiter = None,
+    is_throttling_exception: Callable = None,
+    max_throttling_retries: int = DEFAULT_MAX_THROTTLING_RETRIES,
+    **api_call_function_kwargs
+):
+    """
+    Helper function to the "api_call_single_row" and "api_call_batch" functions.
+    Wait for the rate limiter before each call, and retry calls throttled by the API
+    after the rate limiter has slowed down, up to max_throttling_retries times.
+    """
+    if rate_limiter is None:
+        return api_call_function(**api_call_function_kwargs)
+    for attempt in range(max_throttling_retries + 1):
+        rate_limiter.acquire()
+        try:
+            response = api_call_function(**api_call_function_kwargs)
+        except Exception as e:
+            if is_throttling_exception is None or not is_throttling_exception(e) or attempt == max_throttling_retries:
+                raise
+            rate_limiter.on_throttle()
+            continue
+        rate_limiter.on_success()
+        return response
+
+
 def api_call_single_row(
     api_call_function: Callable,
     api_column_names: NamedTuple,
@@ -36,12 +104,15 @@ def api_call_single_row(
     api_exceptions: Union[Exception, Tuple[Exception]],
     error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
     verbose: bool = DEFAULT_VERBOSE,
+    rate_limiter: AdaptiveRateLimiter = None,
+    is_throttling_exception: Callable = None,
     **api_call_function_kwargs
 ) -> Dict:
     """
     Wraps a single-row API calling function to:
     - ensure it has a 'row' parameter which is a dict
       (for batches of rows, use the api_call_batch function below)
+    - wait for the rate limiter (if any) and retry throttled calls
     - return the row with a new 'response' key containing the function result
     - handles errors from the function with two methods:
         * (default) do not fail on API-related exceptions, just log it
@@ -49,23 +120,20 @@ def api_call_single_row(
         * fail if there is an error and raise it
     """
     if error_handling == ErrorHandlingEnum.FAIL:
-        response = api_call_function(row=row, **api_call_function_kwargs)
+        response = call_api_with_rate_limiter(
+            api_call_function, rate_limiter, is_throttling_exception, row=row, **api_call_function_kwargs
+        )
         row[api_column_names.response] = response
     else:
         for k in api_column_names:
             row[k] = ""
         try:
-            response = api_call_function(row=row, **api_call_function_kwargs)
+            response = call_api_with_rate_limiter(
+                api_call_function, rate_limiter, is_throttling_exception, row=row, **api_call_function_kwargs
+            )
             row[api_column_names.response] = response
         except api_exceptions as e:
-            logging.warning(str(e))
-            error_type = str(type(e).__qualname__)
-            module = inspect.getmodule(e)
-            if module is not None:
-                error_type = str(module.__name__) + "." + error_type
-            row[api_column_names.error_message] = str(e)
-            row[api_column_names.error_type] = error_type
-            row[api_column_names.error_raw] = str(e.args)
+            set_api_exception([row], e, api_column_names)
     return row
 
 
@@ -77,11 +145,14 @@ def api_call_batch(
     api_exceptions: Union[Exception, Tuple[Exception]],
     error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
     verbose: bool = DEFAULT_VERBOSE,
+    rate_limiter: AdaptiveRateLimiter = None,
+    is_throttling_exception: Callable = None,
     **api_call_function_kwargs
 ) -> List[Dict]:
     """
     Wraps a batch API calling function to:
     - ensure it has a 'batch' parameter which is a list of dict
+    - wait for the rate limiter (if any) and retry throttled calls
     - return the batch with a new 'response' key in each dict
       containing the function result
     - handles errors from the function with two methods:
@@ -90,40 +161,316 @@ def api_call_batch(
         * fail if there is an error and raise it
     """
     if error_handling == ErrorHandlingEnum.FAIL:
-        response = api_call_function(batch=batch, **api_call_function_kwargs)
+        response = call_api_with_rate_limiter(
+            api_call_function, rate_limiter, is_throttling_exception, batch=batch, **api_call_function_kwargs
+        )
         batch = batch_api_response_parser(batch=batch, response=response, api_column_names=api_column_names)
-        errors = [row[api_column_names.error_message] for row in batch if row[api_column_names.error_message] != ""]
-        if len(errors) != 0:
-            raise Exception("API returned errors: " + str(errors))
+        check_batch_errors(batch, api_column_names)
     else:
         try:
-            response = api_call_function(batch=batch, **api_call_function_kwargs)
+            response = call_api_with_rate_limiter(
+                api_call_function, rate_limiter, is_throttling_exception, batch=batch, **api_call_function_kwargs
+            )
             batch = batch_api_response_parser(batch=batch, response=response, api_column_names=api_column_names)
         except api_exceptions as e:
-            logging.warning(str(e))
-            error_type = str(type(e).__qualname__)
-            module = inspect.getmodule(e)
-            if module is not None:
-                error_type = str(module.__name__) + "." + error_type
-            for row in batch:
-                row[api_column_names.response] = ""
-                row[api_column_names.error_message] = str(e)
-                row[api_column_names.error_type] = error_type
-                row[api_column_names.error_raw] = str(e.args)
+            set_api_exception(batch, e, api_column_names)
     return batch
 
 
+def validate_positions(
+    column_values: Dict[AnyStr, List],
+    positions: Iterable[int],
+    api_results: Dict[AnyStr, List],
+    api_column_names: NamedTuple,
+    row_validator: Callable,
+) -> List[int]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Apply row_validator to each row, and write the error type and message it returns to the API results
+    of invalid rows, with an empty response. Return the positions of valid rows, to send to the API.
+    """
+    valid_positions = []
+    for p in positions:
+        error = row_validator({c: column_values[c][p] for c in column_values})
+        if error is None:
+            valid_positions.append(p)
+            continue
+        (api_results[api_column_names.error_type][p], api_results[api_column_names.error_message][p]) = error
+    num_invalid = len(positions) - len(valid_positions)
+    if num_invalid != 0:
+        logging.info("Validation: {} invalid rows skipped before calling the API".format(num_invalid))
+    return valid_positions
+
+
+def deduplicate_positions(
+    column_values: Dict[AnyStr, List], positions: Iterable[int]
+) -> Tuple[List[int], Dict[int, List[int]]]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Group rows with identical values so that the API is called once per unique value.
+    Return the position of the first row of each group, and a dict from this position to the positions of duplicates.
+    """
+    columns = list(column_values.keys())
+    first_position_by_values = {}
+    unique_positions = []
+    duplicate_positions = {}
+    for p in positions:
+        values = tuple(column_values[c][p] for c in columns)
+        try:
+            first_position = first_position_by_values.setdefault(values, p)
+        except TypeError:  # Unhashable values cannot be deduplicated
+            first_position = p
+        if first_position == p:
+            unique_positions.append(p)
+        else:
+            duplicate_positions.setdefault(first_position, []).append(p)
+    num_rows = len(unique_positions) + sum([len(d) for d in duplicate_positions.values()])
+    if num_rows != 0:
+        logging.info(
+            "Deduplication: {} unique rows out of {} ({:.1%} duplicates)".format(
+                len(unique_positions), num_rows, 1 - len(unique_positions) / num_rows
+            )
+        )
+    return (unique_positions, duplicate_positions)
+
+
+def group_positions(
+    column_values: Dict[AnyStr, List], positions: Iterable[int], batch_group_column: AnyStr = None
+) -> List[List[int]]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Group row positions by the value of batch_group_column, in order of first appearance,
+    so that batches only contain rows of the same group, e.g. with the same language code.
+    Without batch_group_column, all positions are in a single group.
+    """
+    if batch_group_column is None:
+        return [list(positions)]
+    positions_by_group = {}
+    for p in positions:
+        positions_by_group.setdefault(str(column_values[batch_group_column][p]), []).append(p)
+    return list(positions_by_group.values())
+
+
+def bucket_positions_by_length(
+    column_values: Dict[AnyStr, List],
+    position_groups: List[List[int]],
+    length_bucketing_column: AnyStr,
+    batch_size: int,
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+) -> List[List[int]]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Sort row positions of each group by decreasing UTF-8 byte length of length_bucketing_column, and split them
+    into batches of at most batch_size rows and max_batch_bytes bytes, so that batches contain texts of similar size,
+    the longest batches are sent first, and a batch of long texts is not slower than the others by a wide margin.
+    A row longer than max_batch_bytes is sent in a batch of its own.
+    """
+    values = column_values[length_bucketing_column]
+    batches = []
+    for positions in position_groups:
+        byte_lengths = {p: utf8_byte_length(values[p]) if isinstance(values[p], str) else 0 for p in positions}
+        (batch, batch_bytes) = ([], 0)
+        for p in sorted(positions, key=lambda p: byte_lengths[p], reverse=True):
+            if len(batch) != 0 and (len(batch) == batch_size or batch_bytes + byte_lengths[p] > max_batch_bytes):
+                batches.append(batch)
+                (batch, batch_bytes) = ([], 0)
+            batch.append(p)
+            batch_bytes += byte_lengths[p]
+        if len(batch) != 0:
+            batches.append(batch)
+    return batches
+
+
+def generate_work_items(
+    column_values: Dict[AnyStr, List], position_groups: List[List[int]], api_support_batch: bool, batch_size: int
+) -> Generator:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Build row dictionaries lazily from lists of column values, and yield tuples of (row positions, row or batch).
+    Batches never mix rows from different position groups.
+    """
+    columns = list(column_values.keys())
+    for positions in position_groups:
+        if api_support_batch:
+            for batch_positions in chunked(positions, batch_size):
+                yield (batch_positions, [{c: column_values[c][p] for c in columns} for p in batch_positions])
+        else:
+            for p in positions:
+                yield ([p], {c: column_values[c][p] for c in columns})
+
+
+def submit_with_backpressure(
+    pool: Executor, fn: Callable, work_items: Iterable, work_item_name: AnyStr, max_tasks_in_flight: int, **kwargs
+) -> Generator:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Submit work items, given as tuples of (key, item), to the pool while keeping at most max_tasks_in_flight
+    pending tasks, and refill the queue as tasks complete so that memory scales with concurrency instead of input size.
+    Yield tuples of (key, task result) in completion order.
+    """
+    work_items = iter(work_items)
+    futures = {}
+    for key, item in islice(work_items, max_tasks_in_flight):
+        futures[pool.submit(fn, **{work_item_name: item}, **kwargs)] = key
+    while len(futures) != 0:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for key, item in islice(work_items, len(done)):
+            futures[pool.submit(fn, **{work_item_name: item}, **kwargs)] = key
+        for f in done:
+            yield (futures.pop(f), f.result())
+
+
+def compute_retry_delay(
+    attempt: int,
+    base_delay: float = DEFAULT_RETRY_BASE_DELAY_SECONDS,
+    max_delay: float = DEFAULT_RETRY_MAX_DELAY_SECONDS,
+) -> float:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Compute the delay before a retry attempt (starting at 1) with exponential backoff and jitter,
+    so that retries from concurrent activities do not hit the API at the same time.
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def find_retryable_positions(
+    positions: List[int], api_results: Dict[AnyStr, List], api_column_names: NamedTuple, is_retryable_error: Callable
+) -> List[int]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Return the positions of rows with an error which is worth retrying, according to the is_retryable_error
+    function of the error type and raw error. Successful rows and rows with permanent errors are left as is.
+    """
+    return [
+        p
+        for p in positions
+        if api_results[api_column_names.error_type][p] != ""
+        and is_retryable_error(api_results[api_column_names.error_type][p], api_results[api_column_names.error_raw][p])
+    ]
+
+
+def segment_positions(
+    column_values: Dict[AnyStr, List],
+    positions: Iterable[int],
+    api_results: Dict[AnyStr, List],
+    segmentation_column: AnyStr,
+    max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES,
+) -> Tuple[List[int], Dict[int, List[Tuple[int, int, AnyStr]]]]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Split texts of segmentation_column longer than max_segment_bytes in UTF-8 into segments.
+    Each segment is a new row appended to column values and API results, with the same values in other columns.
+    Return the positions to send to the API, and a dict from the position of each split row
+    to a list of tuples (segment position, character offset, segment).
+    """
+    columns = list(column_values.keys())
+    api_positions = []
+    segments_by_position = {}
+    for p in positions:
+        text = column_values[segmentation_column][p]
+        if not isinstance(text, str) or utf8_byte_length(text.strip()) <= max_segment_bytes:
+            api_positions.append(p)
+            continue
+        segments = []
+        for offset, segment in split_text(text, max_segment_bytes):
+            segments.append((len(column_values[segmentation_column]), offset, segment))
+            for c in columns:
+                column_values[c].append(segment if c == segmentation_column else column_values[c][p])
+            for k in api_results:
+                api_results[k].append("")
+        api_positions += [segment_position for segment_position, _, _ in segments]
+        segments_by_position[p] = segments
+    if len(segments_by_position) != 0:
+        logging.info(
+            "Segmentation: {} rows longer than {} bytes split into {} segments".format(
+                len(segments_by_position), max_segment_bytes, sum([len(s) for s in segments_by_position.values()])
+            )
+        )
+    return (api_positions, segments_by_position)
+
+
+def merge_segment_results(
+    segments_by_position: Dict[int, List[Tuple[int, int, AnyStr]]],
+    api_results: Dict[AnyStr, List],
+    api_column_names: NamedTuple,
+    segment_response_merger: Callable,
+) -> None:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Write back the results of segments to their original row: the error of the first failed segment if any,
+    else the responses of all segments merged by segment_response_merger.
+    """
+    for p, segments in segments_by_position.items():
+        failed_positions = [s for s, _, _ in segments if api_results[api_column_names.error_type][s] != ""]
+        if len(failed_positions) != 0:
+            for k in api_column_names:
+                api_results[k][p] = api_results[k][failed_positions[0]]
+        else:
+            api_results[api_column_names.response][p] = segment_response_merger(
+                responses=[api_results[api_column_names.response][s] for s, _, _ in segments],
+                segments=[(offset, segment) for _, offset, segment in segments],
+            )
+
+
+def lookup_api_cache(
+    api_cache: ApiResponseCache,
+    column_values: Dict[AnyStr, List],
+    positions: Iterable[int],
+    api_results: Dict[AnyStr, List],
+    api_column_names: NamedTuple,
+) -> Tuple[List[int], Dict[int, AnyStr]]:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Fill the API response of rows found in the cache, and return the positions of rows
+    which still need to be sent to the API, along with the cache key of each row.
+    """
+    columns = list(column_values.keys())
+    cache_keys = {p: api_cache.compute_key([column_values[c][p] for c in columns]) for p in positions}
+    cached_responses = api_cache.get_many(list(cache_keys.values()))
+    remaining_positions = []
+    for p, key in cache_keys.items():
+        if key in cached_responses:
+            api_results[api_column_names.response][p] = cached_responses[key]
+        else:
+            remaining_positions.append(p)
+    logging.info("{} rows found in the API response cache".format(len(cache_keys) - len(remaining_positions)))
+    return (remaining_positions, cache_keys)
+
+
+def update_api_cache(
+    api_cache: ApiResponseCache,
+    cache_keys: Dict[int, AnyStr],
+    positions: List[int],
+    api_results: Dict[AnyStr, List],
+    api_column_names: NamedTuple,
+) -> None:
+    """
+    Helper function to the "api_parallelizer" main function.
+    Store successful API responses of the given row positions in the cache.
+    """
+    responses = {
+        cache_keys[p]: api_results[api_column_names.response][p]
+        for p in positions
+        if p in cache_keys
+        and api_results[api_column_names.response][p] != ""
+        and api_results[api_column_names.error_message][p] == ""
+    }
+    if len(responses) != 0:
+        api_cache.set_many(responses)
+
+
 def convert_api_results_to_df(
     input_df: pd.DataFrame,
-    api_results: List[Dict],
+    api_results: Dict[AnyStr, List],
     api_column_names: NamedTuple,
     error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
     verbose: bool = DEFAULT_VERBOSE,
 ) -> pd.DataFrame:
     """
     Helper function to the "api_parallelizer" main function.
-    Combine API results (list of dict) with input dataframe,
-    and convert it to a dataframe.
+    Combine API results (dict of column values in input row order) with the input dataframe.
+    API columns are written by position, so input columns are never copied to records.
     """
     if error_handling == ErrorHandlingEnum.FAIL:
         columns_to_exclude = [v for k, v in api_column_names._asdict().items() if "error" in k]
@@ -131,13 +478,10 @@ def convert_api_results_to_df(
         columns_to_exclude = []
         if not verbose:
             columns_to_exclude = [api_column_names.error_raw]
-    output_schema = {**{v: str for v in api_column_names}, **dict(input_df.dtypes)}
-    output_schema = {k: v for k, v in output_schema.items() if k not in columns_to_exclude}
-    record_list = [{col: result.get(col) for col in output_schema.keys()} for result in api_results]
     api_column_list = [c for c in api_column_names if c not in columns_to_exclude]
-    output_column_list = list(input_df.columns) + api_column_list
-    output_df = pd.DataFrame.from_records(record_list).astype(output_schema).reindex(columns=output_column_list)
-    assert len(output_df.index) == len(input_df.index)
+    for c in api_column_list:
+        assert len(api_results[c]) == len(input_df.index)
+    output_df = input_df.assign(**{c: api_results[c] for c in api_column_list})
     return output_df
 
 
@@ -146,52 +490,171 @@ def api_parallelizer(
     api_call_function: Callable,
     api_exceptions: Union[Exception, Tuple[Exception]],
     column_prefix: AnyStr,
+    input_columns: List[AnyStr] = None,
     parallel_workers: int = DEFAULT_PARALLEL_WORKERS,
     api_support_batch: bool = DEFAULT_API_SUPPORT_BATCH,
     batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_group_column: AnyStr = None,
+    length_bucketing_column: AnyStr = None,
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    max_tasks_in_flight: int = None,
+    pool: Executor = None,
+    api_cache: ApiResponseCache = None,
+    row_validator: Callable = None,
+    deduplicate: bool = DEFAULT_DEDUPLICATE,
+    rate_limiter: AdaptiveRateLimiter = None,
+    is_throttling_exception: Callable = None,
+    is_retryable_error: Callable = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY_SECONDS,
+    segmentation_column: AnyStr = None,
+    segment_response_merger: Callable = None,
+    max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES,
     error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG,
     verbose: bool = DEFAULT_VERBOSE,
     **api_call_function_kwargs
 ) -> pd.DataFrame:
     """
     Apply an API call function in parallel to a pandas.DataFrame.
-    The DataFrame is passed to the function as row dictionaries.
+    The DataFrame is passed to the function as row dictionaries, built from column values.
+    If input_columns is specified, row dictionaries only contain these columns. Other columns
+    are left untouched in the input DataFrame, to which API results are attached at the end.
     Parallelism works by:
     - (default) sending multiple concurrent threads
     - if the API supports it, sending batches of row
+    If batch_group_column is specified, batches only contain rows with the same value in this column,
+    e.g. for batch APIs which take a single language code per batch.
+    If length_bucketing_column is specified, batches are formed from rows with a similar text size in this column,
+    to avoid short texts waiting for a long one in the same batch. Batches of long texts are then capped at
+    max_batch_bytes, so that they do not take much longer than other batches.
+    At most max_tasks_in_flight rows or batches are queued at a time,
+    by default DEFAULT_TASKS_IN_FLIGHT_PER_WORKER times the number of parallel workers.
+    If a thread pool is specified, API calls are submitted to it instead of a new pool of parallel_workers threads,
+    so that concurrent api_parallelizer calls sharing this pool stay within its number of threads.
+    API results are written back to the input rows by position, so the input row order is kept.
+    If a row_validator is specified, it is applied to each row dictionary before anything else. Rows for which
+    it returns a tuple (error type, error message) get this error locally and are never sent to the API.
+    If an api_cache is specified, rows with a cached response skip the API call,
+    and successful responses are added to the cache.
+    If deduplicate is True, the API is called once per unique combination of values of input_columns,
+    and results are copied to all duplicate rows.
+    If a rate_limiter is specified, all workers share it to stay within the API quota. Calls failing with
+    an exception for which is_throttling_exception returns True slow it down and are retried.
+    If is_retryable_error is specified, rows with a transient error (inside a batch or for the whole call)
+    are gathered, re-batched together and sent again up to max_retries times, with exponential backoff.
+    Other rows of their batch keep their result, and rows with permanent errors are not retried.
+    If segmentation_column and segment_response_merger are specified, texts longer than max_segment_bytes
+    are split into segments on sentence or whitespace boundaries, and segment responses are merged per row.
     """
-    df_iterator = (i[1].to_dict() for i in input_df.iterrows())
-    len_iterator = len(input_df.index)
-    log_msg = "Calling remote API endpoint with {} rows...".format(len_iterator)
-    if api_support_batch:
-        log_msg += ", chunked by {}".format(batch_size)
-        df_iterator = chunked(df_iterator, batch_size)
-        len_iterator = math.ceil(len_iterator / batch_size)
-    logging.info(log_msg)
+    len_input = len(input_df.index)
+    if input_columns is None:
+        input_columns = list(input_df.columns)
+    for c in [batch_group_column, length_bucketing_column, segmentation_column]:
+        if c is not None and c not in input_columns:
+            input_columns = input_columns + [c]
+    missing_columns = [c for c in input_columns if c not in input_df.columns]
+    if len(missing_columns) != 0:
+        raise ValueError("Columns {} are not present in the input dataframe.".format(missing_columns))
+    column_values = {c: input_df[c].tolist() for c in input_columns}
     api_column_names = build_unique_column_names(input_df.columns, column_prefix)
+    api_results = {k: [""] * len_input for k in api_column_names}
+    positions = range(len_input)
+    if row_validator is not None:
+        positions = validate_positions(column_values, positions, api_results, api_column_names, row_validator)
+    if api_cache is not None:
+        (positions, cache_keys) = lookup_api_cache(api_cache, column_values, positions, api_results, api_column_names)
+    duplicate_positions = {}
+    if deduplicate:
+        (positions, duplicate_positions) = deduplicate_positions(column_values, positions)
+    segments_by_position = {}
+    if segmentation_column is not None and segment_response_merger is not None:
+        (positions, segments_by_position) = segment_positions(
+            column_values, positions, api_results, segmentation_column, max_segment_bytes
+        )
     pool_kwargs = api_call_function_kwargs.copy()
     more_kwargs = [
         "api_call_function",
         "error_handling",
         "api_exceptions",
         "api_column_names",
+        "rate_limiter",
+        "is_throttling_exception",
     ]
     for k in more_kwargs:
         pool_kwargs[k] = locals()[k]
     for k in ["fn", "row", "batch"]:  # Reserved pool keyword arguments
         pool_kwargs.pop(k, None)
-    api_results = []
-    with ThreadPoolExecutor(max_workers=parallel_workers) as pool:
-        if api_support_batch:
-            futures = [pool.submit(api_call_batch, batch=batch, **pool_kwargs) for batch in df_iterator]
-        else:
-            futures = [pool.submit(api_call_single_row, row=row, **pool_kwargs) for row in df_iterator]
-        for f in tqdm_auto(as_completed(futures), total=len_iterator):
-            api_results.append(f.result())
-    if api_support_batch:
-        api_results = flatten(api_results)
+    if max_tasks_in_flight is None:
+        max_tasks_in_flight = DEFAULT_TASKS_IN_FLIGHT_PER_WORKER * parallel_workers
+    with ExitStack() as exit_stack:
+        if pool is None:
+            pool = exit_stack.enter_context(ThreadPoolExecutor(max_workers=parallel_workers))
+        for attempt in range(max_retries + 1):
+            if attempt != 0:
+                if len(positions) == 0:
+                    break
+                delay = compute_retry_delay(attempt, retry_base_delay)
+                logging.warning(
+                    "Retrying {} rows with transient API errors in {:.1f} seconds (attempt {}/{})".format(
+                        len(positions), delay, attempt, max_retries
+                    )
+                )
+                time.sleep(delay)
+            position_groups = group_positions(column_values, positions, batch_group_column)
+            len_iterator = len(positions)
+            log_msg = "Calling remote API endpoint with {} rows...".format(len_iterator)
+            if api_support_batch:
+                log_msg += ", chunked by {}".format(batch_size)
+                if batch_group_column is not None:
+                    log_msg += " within {} groups of '{}'".format(len(position_groups), batch_group_column)
+                if length_bucketing_column is not None:
+                    position_groups = bucket_positions_by_length(
+                        column_values, position_groups, length_bucketing_column, batch_size, max_batch_bytes
+                    )
+                    log_msg += " and bucketed by length in {} batches".format(len(position_groups))
+                len_iterator = sum([math.ceil(len(g) / batch_size) for g in position_groups])
+            logging.info(log_msg)
+            df_iterator = generate_work_items(column_values, position_groups, api_support_batch, batch_size)
+            if api_support_batch:
+                results = submit_with_backpressure(
+                    pool, api_call_batch, df_iterator, "batch", max_tasks_in_flight, **pool_kwargs
+                )
+            else:
+                results = submit_with_backpressure(
+                    pool, api_call_single_row, df_iterator, "row", max_tasks_in_flight, **pool_kwargs
+                )
+            retry_positions = []
+            for task_positions, result in tqdm_auto(results, total=len_iterator):
+                result_rows = result if api_support_batch else [result]
+                for p, row in zip(task_positions, result_rows):
+                    for k in api_column_names:
+                        api_results[k][p] = row.get(k, "")
+                    for d in duplicate_positions.get(p, []):
+                        for k in api_column_names:
+                            api_results[k][d] = api_results[k][p]
+                if api_cache is not None:
+                    update_api_cache(api_cache, cache_keys, task_positions, api_results, api_column_names)
+                if is_retryable_error is not None:
+                    retry_positions += find_retryable_positions(
+                        task_positions, api_results, api_column_names, is_retryable_error
+                    )
+            positions = retry_positions
+    if len(segments_by_position) != 0:
+        merge_segment_results(segments_by_position, api_results, api_column_names, segment_response_merger)
+        for p in segments_by_position:
+            for d in duplicate_positions.get(p, []):
+                for k in api_column_names:
+                    api_results[k][d] = api_results[k][p]
+        if api_cache is not None:
+            update_api_cache(api_cache, cache_keys, list(segments_by_position), api_results, api_column_names)
+        for k in api_column_names:
+            del api_results[k][len_input:]
     output_df = convert_api_results_to_df(input_df, api_results, api_column_names, error_handling, verbose)
     num_api_error = sum(output_df[api_column_names.response] == "")
     num_api_success = len(input_df.index) - num_api_error
     logging.info("Remote API call results: {} rows succeeded, {} rows failed.".format(num_api_success, num_api_error))
+    if api_cache is not None:
+        api_cache.log_stats()
+    if rate_limiter is not None and rate_limiter.num_throttled != 0:
+        logging.info("{} API calls were throttled by the API".format(rate_limiter.num_throttled))
     return output_df
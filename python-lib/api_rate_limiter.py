@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Module with a thread-safe adaptive rate limiter to stay within API quotas"""
+
+import logging
+import multiprocessing
+from threading import Lock
+from time import monotonic, sleep
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_INCREASE_RATIO = 0.02
+DEFAULT_MIN_RATE_RATIO = 0.05
+DEFAULT_DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe token bucket rate limiter with AIMD (additive increase, multiplicative decrease) throttling:
+    - workers wait for a token before each API call, so that the local quota never causes failures
+    - server-side throttling multiplies the rate by decrease_factor, at most once per cooldown period
+    - each successful call adds a fraction of the maximum rate back, probing up to the quota
+    If shared is True, the state is kept in shared memory so that processes forked after creating the
+    rate limiter share the same rate budget.
+    """
+
+    TOKENS = 0
+    LAST_REFILL = 1
+    RATE = 2
+    LAST_DECREASE = 3
+    NUM_THROTTLED = 4
+
+    def __init__(
+        self,
+        rate_limit: int,
+        period: float = 1.0,
+        decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+        increase_ratio: float = DEFAULT_INCREASE_RATIO,
+        min_rate_ratio: float = DEFAULT_MIN_RATE_RATIO,
+        decrease_cooldown: float = DEFAULT_DECREASE_COOLDOWN_SECONDS,
+        shared: bool = False,
+    ):
+        if rate_limit <= 0 or period <= 0:
+            raise ValueError("Rate limit and period must be positive.")
+        self.max_rate = float(rate_limit) / float(period)
+        self.min_rate = self.max_rate * min_rate_ratio
+        self.capacity = max(1.0, float(rate_limit))
+        self.decrease_factor = decrease_factor
+        self.increase_step = self.max_rate * increase_ratio
+        self.decrease_cooldown = decrease_cooldown
+        state = [self.capacity, monotonic(), self.max_rate, -float("inf"), 0.0]
+        if shared:
+            context = multiprocessing.get_context("fork")
+            self._state = context.RawArray("d", state)
+            self._lock = context.Lock()
+        else:
+            self._state = state
+            self._lock = Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._state[self.RATE]
+
+    @property
+    def num_throttled(self) -> int:
+        return int(self._state[self.NUM_THROTTLED])
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._state[self.LAST_REFILL]
+        self._state[self.TOKENS] = min(self.capacity, self._state[self.TOKENS] + elapsed * self.rate)
+        self._state[self.LAST_REFILL] = now
+
+    def _try_acquire(self) -> float:
+        """
+        Consume a token if one is available and return 0, else return the time to wait for the next token
+        """
+        with self._lock:
+            self._refill(monotonic())
+            if self._state[self.TOKENS] >= 1:
+                self._state[self.TOKENS] -= 1
+                return 0.0
+            return (1 - self._state[self.TOKENS]) / self.rate
+
+    def acquire(self) -> None:
+        """
+        Block until a token is available, then consume it
+        """
+        wait_time = self._try_acquire()
+        while wait_time != 0:
+            sleep(wait_time)
+            wait_time = self._try_acquire()
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._state[self.RATE] = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._state[self.NUM_THROTTLED] += 1
+            now = monotonic()
+            if now - self._state[self.LAST_DECREASE] < self.decrease_cooldown:
+                return
+            self._refill(now)
+            self._state[self.LAST_DECREASE] = now
+            self._state[self.RATE] = max(self.min_rate, self.rate * self.decrease_factor)
+            self._state[self.TOKENS] = min(self._state[self.TOKENS], 0.0)
+        logging.warning("API throttling: reducing rate to {:.2f} calls per second".format(self.rate))
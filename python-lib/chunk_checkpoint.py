@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Module with a checkpoint store of processed dataset chunks, to resume interrupted runs"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from typing import AnyStr, Callable, Dict
+
+import pandas as pd
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+CHECKPOINT_FILE_EXTENSION = ".pkl"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class ChunkCheckpoint:
+    """
+    Checkpoint store of processed dataset chunks, stored as files in a local directory:
+    - one directory per run configuration, identified by a hash of the operation and its parameters
+    - one file per processed chunk, keyed by the chunk number and a hash of the chunk rows and their ids
+    - files are written atomically, so that a run interrupted while writing never leaves a partial chunk
+    A run with the same configuration and input loads processed chunks instead of processing them again.
+    """
+
+    def __init__(self, path: AnyStr, operation: AnyStr, params: Dict = None):
+        self.operation = operation
+        self.params = params or {}
+        fingerprint_content = json.dumps([self.operation, self.params], sort_keys=True, default=str)
+        fingerprint = hashlib.sha256(fingerprint_content.encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(path, "{}_{}".format(operation, fingerprint))
+        os.makedirs(self.directory, exist_ok=True)
+        num_chunks = len([f for f in os.listdir(self.directory) if f.endswith(CHECKPOINT_FILE_EXTENSION)])
+        logging.info("Checkpoint loaded from {} with {} processed chunks".format(self.directory, num_chunks))
+
+    def compute_chunk_key(self, input_df: pd.DataFrame) -> AnyStr:
+        """
+        Identify a chunk by its number and a hash of its rows, including their index as stable row ids.
+        Chunks read from a dataset have a continuous index, so the first row id is used as the chunk number.
+        """
+        chunk_number = int(input_df.index[0]) if len(input_df.index) != 0 else 0
+        row_hashes = pd.util.hash_pandas_object(input_df.astype(str), index=True).values
+        return "chunk_{:012d}_{}".format(chunk_number, hashlib.sha256(row_hashes.tobytes()).hexdigest()[:16])
+
+    def process_chunk(self, func: Callable, input_df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        """
+        Load the output of a chunk if it was already processed, else process it with a function and save it
+        """
+        file_path = os.path.join(self.directory, self.compute_chunk_key(input_df) + CHECKPOINT_FILE_EXTENSION)
+        if os.path.exists(file_path):
+            logging.info("Checkpoint: loading already processed chunk from {}".format(file_path))
+            return pd.read_pickle(file_path)
+        output_df = func(input_df=input_df, **kwargs)
+        temp_file_path = "{}.{}.tmp".format(file_path, os.getpid())
+        output_df.to_pickle(temp_file_path)
+        os.replace(temp_file_path, file_path)
+        return output_df
+
+    def clear(self) -> None:
+        """
+        Delete the checkpoint once all chunks are processed and written
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        logging.info("Checkpoint: deleted {}".format(self.directory))
+
+
+def get_chunk_checkpoint(api_configuration_preset: Dict, operation: AnyStr, params: Dict = None) -> ChunkCheckpoint:
+    """
+    Initialize the chunk checkpoint from the API configuration preset, or return None if it is disabled
+    """
+    if not api_configuration_preset.get("checkpoint_enabled", False):
+        return None
+    checkpoint_path = api_configuration_preset.get("checkpoint_path")
+    if checkpoint_path is None or len(checkpoint_path) == 0:
+        raise ValueError("You must specify a valid checkpoint directory path in the API configuration preset.")
+    return ChunkCheckpoint(path=checkpoint_path, operation=operation, params=params)
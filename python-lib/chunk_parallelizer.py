@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Module with a function to process chunks of a dataset in parallel worker processes"""
+
+import logging
+import multiprocessing
+from collections import deque
+from functools import partial
+from typing import Callable, Iterable, Iterator
+
+import pandas as pd
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_PARALLEL_PROCESSES = 1
+DEFAULT_CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+
+_worker_function = None  # Set before forking worker processes, so that they inherit it instead of unpickling it
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def process_chunk_in_worker(input_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Helper function to the "iterate_chunk_results" main function.
+    Run the function inherited from the parent process on a chunk sent to the worker process.
+    """
+    return _worker_function(input_df=input_df)
+
+
+def iterate_chunk_results(
+    func: Callable,
+    chunks: Iterable[pd.DataFrame],
+    parallel_processes: int = DEFAULT_PARALLEL_PROCESSES,
+    max_chunks_in_flight: int = None,
+    **kwargs
+) -> Iterator[pd.DataFrame]:
+    """
+    Apply a function to chunks of a dataset and yield its outputs in the order of the input chunks.
+    If parallel_processes is greater than 1, chunks are processed by a pool of forked worker processes:
+    - the function and its keyword arguments are inherited by the workers, so they do not need to be picklable,
+      and objects created before (API clients, rate limiters with shared state) are available in the workers
+    - only input and output chunks are sent between processes
+    - at most max_chunks_in_flight chunks are read ahead of the chunk being written, to keep memory bounded
+    """
+    global _worker_function
+    if parallel_processes <= 1:
+        for input_df in chunks:
+            yield func(input_df=input_df, **kwargs)
+        return
+    if max_chunks_in_flight is None:
+        max_chunks_in_flight = parallel_processes * DEFAULT_CHUNKS_IN_FLIGHT_PER_PROCESS
+    _worker_function = partial(func, **kwargs)
+    context = multiprocessing.get_context("fork")
+    logging.info("Processing chunks with {} parallel processes...".format(parallel_processes))
+    try:
+        with context.Pool(processes=parallel_processes) as pool:
+            pending_results = deque()
+            for input_df in chunks:
+                pending_results.append(pool.apply_async(process_chunk_in_worker, (input_df,)))
+                if len(pending_results) >= max_chunks_in_flight:
+                    yield pending_results.popleft().get()
+            while len(pending_results) != 0:
+                yield pending_results.popleft().get()
+    finally:
+        _worker_function = None
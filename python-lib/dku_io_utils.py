@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
 """Module with read/write utility functions based on the Dataiku API"""
 
-from typing import Dict
+import logging
+from functools import partial
+from typing import AnyStr, Callable, Dict, List
 
 import dataiku
 
+from chunk_parallelizer import DEFAULT_PARALLEL_PROCESSES, iterate_chunk_results
+from chunk_checkpoint import ChunkCheckpoint
+from incremental_output import PreviousOutputIndex
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_CHUNK_SIZE = 10000
+
 
 # ==============================================================================
 # CLASS AND FUNCTION DEFINITION
@@ -36,3 +49,80 @@ def set_column_description(
             if len(matched_comment) != 0:
                 output_col_info["comment"] = matched_comment[0]
     output_dataset.write_schema(output_dataset_schema)
+
+
+def get_previous_output_index(
+    output_dataset: dataiku.Dataset,
+    output_schema: List[Dict],
+    input_schema: List[Dict],
+    key_column: AnyStr,
+    text_column: AnyStr,
+    text_hash_column: AnyStr = None,
+    chunksize: int = DEFAULT_CHUNK_SIZE,
+) -> PreviousOutputIndex:
+    """
+    Index the API columns of the previous content of the output dataset, before it is overwritten.
+    Return None if the output dataset is empty or its schema differs from the new output schema.
+    """
+    previous_output_dataset = dataiku.Dataset(output_dataset.full_name, ignore_flow=True)
+    try:
+        previous_output_schema = previous_output_dataset.read_schema()
+    except Exception as e:
+        logging.warning("Incremental mode: cannot read the previous output dataset, processing all rows: {}".format(e))
+        return None
+    output_column_names = [col["name"] for col in output_schema]
+    if [col["name"] for col in previous_output_schema] != output_column_names:
+        logging.warning("Incremental mode: schema of the previous output dataset changed, processing all rows")
+        return None
+    input_column_names = [col["name"] for col in input_schema]
+    api_column_names = [col for col in output_column_names if col not in input_column_names]
+    previous_output_index = PreviousOutputIndex(
+        key_column=key_column,
+        text_column=text_column,
+        api_column_names=api_column_names,
+        text_hash_column=text_hash_column,
+    )
+    previous_output_index.load(
+        previous_output_dataset.iter_dataframes(
+            chunksize=chunksize,
+            infer_with_pandas=False,
+            columns=[key_column, text_hash_column or text_column] + api_column_names,
+        )
+    )
+    return previous_output_index
+
+
+def process_dataset_chunks(
+    input_dataset: dataiku.Dataset,
+    output_dataset: dataiku.Dataset,
+    output_schema: List[Dict],
+    func: Callable,
+    chunksize: int = DEFAULT_CHUNK_SIZE,
+    parallel_processes: int = DEFAULT_PARALLEL_PROCESSES,
+    checkpoint: ChunkCheckpoint = None,
+    previous_output_index: PreviousOutputIndex = None,
+    **kwargs
+) -> None:
+    """
+    Read a dataset by chunks, process each chunk with a function and append it to another dataset.
+    The output schema must be known in advance as it is written before the first chunk.
+    Peak memory is bounded by the chunk size instead of the size of the input dataset.
+    If parallel_processes is greater than 1, chunks are processed in parallel worker processes
+    and written in the order of the input dataset.
+    If a checkpoint is given, chunks already processed by an interrupted run are loaded instead of processed,
+    and the checkpoint is deleted once all chunks are written.
+    If a previous output index is given, only new or changed rows are processed, see PreviousOutputIndex.
+    """
+    output_dataset.write_schema(output_schema)
+    output_column_names = [col["name"] for col in output_schema]
+    if previous_output_index is not None:
+        func = partial(previous_output_index.process_chunk, func)
+    if checkpoint is not None:
+        func = partial(checkpoint.process_chunk, func)
+    input_chunks = input_dataset.iter_dataframes(chunksize=chunksize, infer_with_pandas=False)
+    with output_dataset.get_writer() as writer:
+        for i, output_df in enumerate(iterate_chunk_results(func, input_chunks, parallel_processes, **kwargs)):
+            writer.write_dataframe(output_df.reindex(columns=output_column_names))
+            logging.info("Processing chunk {} of {} rows: Done.".format(i + 1, len(output_df.index)))
+    if checkpoint is not None:
+        checkpoint.clear()
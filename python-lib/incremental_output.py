@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Module with an index of a previous output dataset, to call the API only on new or changed rows"""
+
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+from typing import AnyStr, Callable, Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INDEX_FILE_NAME = "previous_output_index.sqlite"
+SQLITE_TIMEOUT_SECONDS = 60
+ERROR_COLUMN_KEYS = ("error_message", "error_type")
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class PreviousOutputIndex:
+    """
+    Index of the API columns of a previous output dataset, stored in a temporary SQLite database:
+    - rows are identified by a key column and compared with a hash of their text, or a given text hash column
+    - API column values of unchanged rows are copied as they are, without parsing API responses again
+    - only new or changed rows are processed, as well as rows with an error or an empty result in the previous output
+    """
+
+    def __init__(
+        self,
+        key_column: AnyStr,
+        text_column: AnyStr,
+        api_column_names: List[AnyStr],
+        text_hash_column: AnyStr = None,
+        error_column_names: List[AnyStr] = None,
+    ):
+        self.key_column = key_column
+        self.text_column = text_column
+        self.text_hash_column = text_hash_column
+        self.api_column_names = api_column_names
+        if error_column_names is None:
+            error_column_names = [c for c in api_column_names if any([k in c for k in ERROR_COLUMN_KEYS])]
+        self._error_column_indices = [api_column_names.index(c) for c in error_column_names]
+        self._result_column_indices = [i for i in range(len(api_column_names)) if i not in self._error_column_indices]
+        self._directory = tempfile.mkdtemp(prefix="previous_output_index_")
+        self.file_path = os.path.join(self._directory, INDEX_FILE_NAME)
+        self._lock = Lock()
+        self._connect()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, hash TEXT, api_values TEXT)"
+            )
+
+    def _connect(self) -> None:
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(self.file_path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        SQLite connection of the current process, reconnecting in processes forked after the index was loaded
+        as SQLite connections must not be shared across processes
+        """
+        if self._pid != os.getpid():
+            self._connect()
+        return self._connection
+
+    def compute_text_hashes(self, df: pd.DataFrame) -> List[AnyStr]:
+        """
+        Use the text hash column if given, else hash the stripped text, as sent to the API
+        """
+        if self.text_hash_column:
+            return [str(h) for h in df[self.text_hash_column]]
+        return [hashlib.sha256(str(t).strip().encode("utf-8")).hexdigest() for t in df[self.text_column]]
+
+    def load(self, chunks: Iterable[pd.DataFrame]) -> None:
+        """
+        Store the keys, text hashes and API column values of chunks of the previous output dataset
+        """
+        num_rows = 0
+        for df in chunks:
+            api_values = df.reindex(columns=self.api_column_names).astype(object)
+            api_values = api_values.where(api_values.notnull(), None)
+            with self._lock, self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO rows (key, hash, api_values) VALUES (?, ?, ?)",
+                    zip(
+                        [str(k) for k in df[self.key_column]],
+                        self.compute_text_hashes(df),
+                        [json.dumps(v, default=str) for v in api_values.values.tolist()],
+                    ),
+                )
+            num_rows += len(df.index)
+        logging.info("Previous output dataset: indexed {} rows".format(num_rows))
+
+    def get_many(self, keys: List[AnyStr]) -> Dict[AnyStr, List]:
+        """
+        Return a dictionary of (text hash, API column values) tuples for the keys found in the previous output
+        """
+        rows = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), 500):  # SQLite limits the number of query parameters
+                keys_chunk = unique_keys[i : i + 500]
+                rows.update(
+                    {
+                        key: (text_hash, json.loads(api_values))
+                        for key, text_hash, api_values in self.connection.execute(
+                            "SELECT key, hash, api_values FROM rows WHERE key IN ({})".format(
+                                ",".join(["?"] * len(keys_chunk))
+                            ),
+                            keys_chunk,
+                        ).fetchall()
+                    }
+                )
+        return rows
+
+    def is_reusable(self, previous_row: Tuple[AnyStr, List], text_hash: AnyStr) -> bool:
+        """
+        Reuse a previous row only if its text is unchanged, its error columns are empty and it has a result,
+        so that rows which failed or got an empty response in a previous run are sent to the API again
+        """
+        (previous_text_hash, api_values) = previous_row
+        has_error = any([api_values[i] for i in self._error_column_indices])
+        has_result = any([api_values[i] for i in self._result_column_indices])
+        return previous_text_hash == text_hash and not has_error and has_result
+
+    def get_reused_values(self, input_df: pd.DataFrame) -> List[List]:
+        """
+        Return the previous API column values of each row of a chunk, or None for rows to process
+        """
+        keys = [str(k) for k in input_df[self.key_column]]
+        previous_rows = self.get_many(keys)
+        return [
+            previous_rows[key][1] if key in previous_rows and self.is_reusable(previous_rows[key], text_hash) else None
+            for key, text_hash in zip(keys, self.compute_text_hashes(input_df))
+        ]
+
+    def filter_rows_to_process(self, input_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return the rows of a chunk which process_chunk will process, i.e. without the rows it will reuse
+        """
+        return input_df[[v is None for v in self.get_reused_values(input_df)]]
+
+    def process_chunk(self, func: Callable, input_df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        """
+        Copy the API columns of unchanged rows from the previous output, and process new, changed
+        or previously failed or empty rows with a function. Return all rows in the order of the input chunk.
+        """
+        reused_values = self.get_reused_values(input_df)
+        is_reused = pd.Series([v is not None for v in reused_values], index=input_df.index)
+        output_dfs = []
+        if is_reused.any():
+            reused_df = input_df[is_reused].copy()
+            api_values_df = pd.DataFrame(
+                [v for v in reused_values if v is not None], columns=self.api_column_names, index=reused_df.index
+            )
+            output_dfs.append(pd.concat([reused_df, api_values_df], axis=1))
+        if not is_reused.all():
+            new_df = input_df[~is_reused]
+            output_df = func(input_df=new_df, **kwargs)
+            output_df.index = new_df.index
+            output_dfs.append(output_df)
+        num_reused = int(is_reused.sum())
+        logging.info(
+            "Incremental mode: reusing {} unchanged rows, processing {} new, changed, failed or empty rows".format(
+                num_reused, len(input_df.index) - num_reused
+            )
+        )
+        return pd.concat(output_dfs).loc[input_df.index]
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
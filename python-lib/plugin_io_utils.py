@@ -4,7 +4,7 @@
 import logging
 import json
 from enum import Enum
-from typing import AnyStr, List, NamedTuple, Dict
+from typing import AnyStr, List, NamedTuple, Dict, Union
 from collections import OrderedDict, namedtuple
 
 import pandas as pd
@@ -26,6 +26,8 @@ API_COLUMN_NAMES_DESCRIPTION_DICT = OrderedDict(
 
 ApiColumnNameTuple = namedtuple("ApiColumnNameTuple", API_COLUMN_NAMES_DESCRIPTION_DICT.keys())
 
+OutputColumn = namedtuple("OutputColumn", ["name", "type", "description"])
+
 
 class ErrorHandlingEnum(Enum):
     LOG = "Log"
@@ -63,6 +65,36 @@ def build_unique_column_names(existing_names: List[AnyStr], column_prefix: AnySt
     return api_column_names
 
 
+class OutputColumnLayout:
+    """
+    Ordered layout of the columns added to the output by a formatter:
+    - resolve unique column names once, so that they can be reused for all rows
+    - keep the type and description of each column
+    - convert to a Dataiku dataset schema
+    """
+
+    def __init__(self, existing_names: List[AnyStr], column_prefix: AnyStr = COLUMN_PREFIX):
+        self.existing_names = list(existing_names)
+        self.column_prefix = column_prefix
+        self.columns = OrderedDict()
+
+    def add_column(self, key: AnyStr, column_type: AnyStr, description: AnyStr) -> AnyStr:
+        """
+        Add a column to the layout and return its unique name
+        """
+        column_names = self.existing_names + [c.name for c in self.columns.values()]
+        column_name = generate_unique(key, column_names, self.column_prefix)
+        self.columns[key] = OutputColumn(column_name, column_type, description)
+        return column_name
+
+    @property
+    def column_description_dict(self) -> Dict:
+        return {c.name: c.description for c in self.columns.values()}
+
+    def get_schema(self) -> List[Dict]:
+        return [{"name": c.name, "type": c.type, "comment": c.description} for c in self.columns.values()]
+
+
 def validate_column_input(column_name: AnyStr, column_list: List[AnyStr]) -> None:
     """
     Validate that user input for column parameter is valid.
@@ -74,14 +106,17 @@ def validate_column_input(column_name: AnyStr, column_list: List[AnyStr]) -> Non
 
 
 def safe_json_loads(
-    str_to_check: AnyStr, error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG, verbose: bool = False,
+    str_to_check: Union[AnyStr, Dict], error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG, verbose: bool = False,
 ) -> Dict:
     """
     Wrap json.loads with an additional parameter to handle errors:
     - 'FAIL' to use json.loads, which throws an exception on invalid data
     - 'LOG' to try json.loads and return an empty dict if data is invalid
+    Dicts are returned as is, as API responses may already be parsed.
     """
-    if error_handling == ErrorHandlingEnum.FAIL:
+    if isinstance(str_to_check, dict):
+        output = str_to_check
+    elif error_handling == ErrorHandlingEnum.FAIL:
         output = json.loads(str_to_check)
     else:
         try:
@@ -93,6 +128,15 @@ def safe_json_loads(
     return output
 
 
+def safe_json_dumps(obj_to_dump: Union[AnyStr, Dict]) -> AnyStr:
+    """
+    Serialize API responses to JSON, leaving strings (already serialized or empty responses) untouched
+    """
+    if isinstance(obj_to_dump, str):
+        return obj_to_dump
+    return json.dumps(obj_to_dump)
+
+
 def move_api_columns_to_end(
     df: pd.DataFrame, api_column_names: NamedTuple, error_handling: ErrorHandlingEnum = ErrorHandlingEnum.LOG
 ) -> pd.DataFrame:
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Module with functions to split long texts into segments within the byte size limit of the API"""
+
+import re
+from typing import AnyStr, List, Tuple
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_MAX_SEGMENT_BYTES = 5000
+SENTENCE_BOUNDARY_REGEX = re.compile(r"[.!?]+\s+|[。！？\n]+\s*")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def utf8_byte_length(text: AnyStr) -> int:
+    return len(text.encode("utf-8"))
+
+
+def truncate_to_bytes(text: AnyStr, max_bytes: int) -> AnyStr:
+    """
+    Truncate a text to at most max_bytes UTF-8 bytes, without cutting a multi-byte character
+    """
+    return text[:max_bytes].encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+
+
+def find_segment_end(window: AnyStr) -> Tuple[int, int]:
+    """
+    Find where to cut a window of text: after the last sentence boundary, else at the last whitespace,
+    else at the end of the window. Return a tuple of (end of the segment, start of the next segment).
+    """
+    sentence_ends = [m.end() for m in SENTENCE_BOUNDARY_REGEX.finditer(window) if m.end() < len(window)]
+    if len(sentence_ends) != 0:
+        return (sentence_ends[-1], sentence_ends[-1])
+    whitespaces = [m for m in WHITESPACE_REGEX.finditer(window) if m.start() != 0]
+    if len(whitespaces) != 0:
+        return (whitespaces[-1].start(), whitespaces[-1].end())
+    return (len(window), len(window))
+
+
+def split_text(text: AnyStr, max_bytes: int = DEFAULT_MAX_SEGMENT_BYTES) -> List[Tuple[int, AnyStr]]:
+    """
+    Split a text into segments of at most max_bytes UTF-8 bytes, on sentence boundaries if possible,
+    then on whitespace, and as a last resort between characters.
+    The text is stripped first, as done before sending it to the API.
+    Return a list of tuples (character offset of the segment in the stripped text, segment).
+    """
+    if max_bytes < 4:
+        raise ValueError("Maximum segment size must be at least 4 bytes, to fit any UTF-8 character.")
+    text = text.strip()
+    if utf8_byte_length(text) <= max_bytes:
+        return [(0, text)]
+    segments = []
+    start = 0
+    while start < len(text):
+        window = truncate_to_bytes(text[start:], max_bytes)
+        if start + len(window) >= len(text):
+            (end, next_start) = (len(window), len(window))
+        else:
+            (end, next_start) = find_segment_end(window)
+        segment = window[:end].rstrip()
+        if len(segment) != 0:
+            segments.append((start, segment))
+        start += next_start
+        while start < len(text) and text[start].isspace():
+            start += 1
+    return segments
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of batch composition in api_parallelizer: input order against length bucketing, with batches capped
+at DEFAULT_MAX_BATCH_BYTES. Batches are sent to a stub client whose latency grows with the total and the largest
+payload of the batch.
+Run with: PYTHONPATH=python-lib python tests/python/benchmark/benchmark_batching.py [num_rows]
+"""
+
+import sys
+import random
+from time import perf_counter, sleep
+from threading import Lock
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from text_segmentation import utf8_byte_length
+from api_parallelizer import api_parallelizer
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_NUM_ROWS = 2000
+INPUT_COLUMN = "text"
+BATCH_SIZE = 25
+PARALLEL_WORKERS = 4
+BASE_LATENCY_SECONDS = 0.01
+LATENCY_SECONDS_PER_BYTE = 1e-6
+LATENCY_SECONDS_PER_MAX_BYTE = 5e-6
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class LatencyModelledStubClient:
+    """
+    Stub of a batch API client which sleeps for a modelled latency and records it for each batch
+    """
+
+    def __init__(self):
+        self.batch_latencies = []
+        self._lock = Lock()
+
+    def batch_call(self, batch: List[Dict]) -> List[Dict]:
+        byte_lengths = [utf8_byte_length(row[INPUT_COLUMN]) for row in batch]
+        latency = (
+            BASE_LATENCY_SECONDS
+            + LATENCY_SECONDS_PER_BYTE * sum(byte_lengths)
+            + LATENCY_SECONDS_PER_MAX_BYTE * max(byte_lengths)
+        )
+        sleep(latency)
+        with self._lock:
+            self.batch_latencies.append(latency)
+        return [{"length": length} for length in byte_lengths]
+
+
+def parse_stub_batch_response(batch: List[Dict], response: List[Dict], api_column_names: NamedTuple) -> List[Dict]:
+    for row, result in zip(batch, response):
+        row[api_column_names.response] = result
+    return batch
+
+
+def generate_texts(num_rows: int) -> List[str]:
+    """
+    Generate texts with a long-tailed length distribution: mostly short texts, with a few long articles
+    """
+    lengths = np.clip(np.random.lognormal(mean=5, sigma=1.2, size=num_rows), 10, 4900).astype(int)
+    return ["".join([random.choice("abcdefgh ") for _ in range(n)]) for n in lengths]
+
+
+def run_benchmark(input_df: pd.DataFrame, length_bucketing: bool) -> None:
+    client = LatencyModelledStubClient()
+    start = perf_counter()
+    api_parallelizer(
+        input_df=input_df,
+        api_call_function=client.batch_call,
+        api_exceptions=(ValueError,),
+        column_prefix="benchmark_api",
+        parallel_workers=PARALLEL_WORKERS,
+        api_support_batch=True,
+        batch_size=BATCH_SIZE,
+        length_bucketing_column=INPUT_COLUMN if length_bucketing else None,
+        batch_api_response_parser=parse_stub_batch_response,
+    )
+    wall_time = perf_counter() - start
+    latencies = np.array(client.batch_latencies)
+    print(
+        "{}: {} batches, batch latency p50 {:.1f}ms p95 {:.1f}ms max {:.1f}ms, total latency {:.2f}s, "
+        "wall time {:.2f}s".format(
+            "Length bucketing" if length_bucketing else "Input order",
+            len(latencies),
+            np.percentile(latencies, 50) * 1000,
+            np.percentile(latencies, 95) * 1000,
+            latencies.max() * 1000,
+            latencies.sum(),
+            wall_time,
+        )
+    )
+
+
+def main(num_rows: int = DEFAULT_NUM_ROWS) -> None:
+    random.seed(42)
+    np.random.seed(42)
+    input_df = pd.DataFrame({INPUT_COLUMN: generate_texts(num_rows)})
+    for length_bucketing in [False, True]:
+        run_benchmark(input_df, length_bucketing)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_ROWS)
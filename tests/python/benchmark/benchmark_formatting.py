@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the batch formatting of API results (format_df) against row-by-row formatting,
+which parses and formats each response separately, as the former df.apply path did.
+Batch formatting is measured on JSON string responses and on structured responses, as passed by api_parallelizer.
+Run with: PYTHONPATH=python-lib python tests/python/benchmark/benchmark_formatting.py [num_rows]
+"""
+
+import gc
+import sys
+import json
+import random
+from time import perf_counter
+
+import pandas as pd
+
+from plugin_io_utils import safe_json_loads, move_api_columns_to_end
+from amazon_comprehend_api_formatting import (
+    EntityTypeEnum,
+    LanguageDetectionAPIFormatter,
+    SentimentAnalysisAPIFormatter,
+    NamedEntityRecognitionAPIFormatter,
+    KeyPhraseExtractionAPIFormatter,
+)
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_NUM_ROWS = 10000
+INPUT_COLUMN = "text"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def generate_language_detection_response() -> dict:
+    return {"Languages": [{"LanguageCode": random.choice(["en", "fr", "de"]), "Score": random.random()}]}
+
+
+def generate_sentiment_analysis_response() -> dict:
+    scores = [random.random() for _ in range(4)]
+    return {
+        "Sentiment": random.choice(["POSITIVE", "NEUTRAL", "NEGATIVE", "MIXED"]),
+        "SentimentScore": dict(zip(["Positive", "Neutral", "Negative", "Mixed"], [s / sum(scores) for s in scores])),
+    }
+
+
+def generate_named_entity_recognition_response() -> dict:
+    return {
+        "Entities": [
+            {
+                "Text": "entity {}".format(i),
+                "Type": random.choice(list(EntityTypeEnum.__members__)),
+                "Score": random.random(),
+            }
+            for i in range(random.randint(0, 20))
+        ]
+    }
+
+
+def generate_key_phrase_extraction_response() -> dict:
+    return {
+        "KeyPhrases": [{"Text": "phrase {}".format(i), "Score": random.random()} for i in range(random.randint(0, 10))]
+    }
+
+
+def format_language_detection_row(formatter, response: dict) -> dict:
+    languages = response.get("Languages", [])
+    if len(languages) == 0:
+        return {formatter.language_code_column: "", formatter.language_score_column: None}
+    return {
+        formatter.language_code_column: languages[0].get("LanguageCode", ""),
+        formatter.language_score_column: languages[0].get("Score", None),
+    }
+
+
+def format_sentiment_analysis_row(formatter, response: dict) -> dict:
+    row = {formatter.sentiment_prediction_column: response.get("Sentiment", "")}
+    sentiment_score = response.get("SentimentScore", {})
+    for prediction, column_name in formatter.sentiment_score_column_dict.items():
+        score = sentiment_score.get(prediction)
+        row[column_name] = round(score, 3) if score is not None else None
+    return row
+
+
+def format_named_entity_recognition_row(formatter, response: dict) -> dict:
+    row = {}
+    entities = response.get("Entities", [])
+    for n, entity_type_column in formatter.entity_type_column_dict.items():
+        row[entity_type_column] = [
+            e.get("Text")
+            for e in entities
+            if e.get("Type", "") == n and float(e.get("Score", 0)) >= formatter.minimum_score
+        ] or ""
+    return row
+
+
+def format_key_phrase_extraction_row(formatter, response: dict) -> dict:
+    row = {}
+    key_phrases = sorted(response.get("KeyPhrases", []), key=lambda x: x.get("Score"), reverse=True)
+    for n, (keyphrase_column, confidence_column) in enumerate(formatter.keyphrase_column_list):
+        row[keyphrase_column] = key_phrases[n].get("Text", "") if len(key_phrases) > n else ""
+        row[confidence_column] = key_phrases[n].get("Score") if len(key_phrases) > n else None
+    return row
+
+
+def format_df_row_by_row(formatter, format_row, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reference row-by-row formatting, as done by the former df.apply(format_row, axis=1) path:
+    parse each response and format it separately, in pure Python
+    """
+
+    def apply_format_row(row: pd.Series) -> pd.Series:
+        response = safe_json_loads(row[formatter.api_column_names.response], formatter.error_handling)
+        for k, v in format_row(formatter, response).items():
+            row[k] = v
+        return row
+
+    output_df = df.apply(apply_format_row, axis=1)
+    return move_api_columns_to_end(output_df, formatter.api_column_names, formatter.error_handling)
+
+
+def measure_time(func, *args) -> float:
+    """
+    Measure the execution time of a function, with garbage collection disabled as in the timeit module
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        start = perf_counter()
+        func(*args)
+        return perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def run_benchmark(formatter, generate_response, format_row, num_rows: int) -> None:
+    api_column_names = formatter.api_column_names
+    responses = [generate_response() for _ in range(num_rows)]
+    df = pd.DataFrame(
+        {
+            INPUT_COLUMN: ["text"] * num_rows,
+            api_column_names.response: [json.dumps(r) for r in responses],
+            api_column_names.error_message: [""] * num_rows,
+            api_column_names.error_type: [""] * num_rows,
+        }
+    )
+    row_by_row_time = measure_time(format_df_row_by_row, formatter, format_row, df)
+    batch_time = measure_time(formatter.format_df, df)
+    structured_df = df.assign(**{api_column_names.response: pd.Series(responses, index=df.index, dtype=object)})
+    structured_batch_time = measure_time(formatter.format_df, structured_df)
+    print(
+        "{}: {} rows, row by row {:.2f}s, batch {:.2f}s (x{:.1f}), batch on parsed responses {:.2f}s (x{:.1f})".format(
+            type(formatter).__name__,
+            num_rows,
+            row_by_row_time,
+            batch_time,
+            row_by_row_time / batch_time,
+            structured_batch_time,
+            row_by_row_time / structured_batch_time,
+        )
+    )
+
+
+def main(num_rows: int = DEFAULT_NUM_ROWS) -> None:
+    input_df = pd.DataFrame(columns=[INPUT_COLUMN])
+    formatters = [
+        (LanguageDetectionAPIFormatter(input_df), generate_language_detection_response, format_language_detection_row),
+        (SentimentAnalysisAPIFormatter(input_df), generate_sentiment_analysis_response, format_sentiment_analysis_row),
+        (
+            NamedEntityRecognitionAPIFormatter(input_df, entity_types=list(EntityTypeEnum), minimum_score=0.5),
+            generate_named_entity_recognition_response,
+            format_named_entity_recognition_row,
+        ),
+        (
+            KeyPhraseExtractionAPIFormatter(input_df, num_key_phrases=3),
+            generate_key_phrase_extraction_response,
+            format_key_phrase_extraction_row,
+        ),
+    ]
+    for formatter, generate_response, format_row in formatters:
+        run_benchmark(formatter, generate_response, format_row, num_rows)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_ROWS)
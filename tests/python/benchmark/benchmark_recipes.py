@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the call and format pipeline of each recipe against a simulated Amazon Comprehend client,
+over a grid of parallel workers, batch sizes and dataset sizes.
+The simulated client has a lognormal latency distribution, throttles calls above a given number of transactions
+per second, returns errors for a fraction of items, and returns responses with the structure of the real API.
+Each configuration runs in its own process, to measure its peak RSS and CPU time in isolation.
+Results are saved as JSON, to compare them between versions. Progress bars and API logs are written to stderr.
+Run with: PYTHONPATH=python-lib python tests/python/benchmark/benchmark_recipes.py --help
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import resource
+import subprocess
+from collections import deque
+from datetime import datetime
+from itertools import product
+from functools import partial
+from threading import Lock
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, sleep, monotonic
+from typing import AnyStr, Dict, List
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from plugin_io_utils import ErrorHandlingEnum
+from api_rate_limiter import AdaptiveRateLimiter
+from amazon_comprehend_analysis import ComprehendAnalysis, compute_analyses
+from amazon_comprehend_api_formatting import (
+    EntityTypeEnum,
+    KeyPhraseExtractionAPIFormatter,
+    LanguageDetectionAPIFormatter,
+    NamedEntityRecognitionAPIFormatter,
+    SentimentAnalysisAPIFormatter,
+)
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+LANGUAGE = "en"
+DEFAULT_RECIPES = [
+    "language_detection",
+    "sentiment_analysis",
+    "named_entity_recognition",
+    "key_phrase_extraction",
+    "multi_analysis",
+]
+DEFAULT_PARALLEL_WORKERS_GRID = [1, 4, 16]
+DEFAULT_BATCH_SIZE_GRID = [1, 10, 25]
+DEFAULT_NUM_ROWS_GRID = [1000]
+DEFAULT_MEDIAN_LATENCY_SECONDS = 0.03
+DEFAULT_LATENCY_SIGMA = 0.5
+DEFAULT_LATENCY_SECONDS_PER_BYTE = 2e-7
+DEFAULT_API_TPS = 100
+DEFAULT_RATE_LIMIT = 100
+DEFAULT_ITEM_ERROR_RATE = 0.01
+DEFAULT_SEED = 42
+THROTTLING_LATENCY_SECONDS = 0.005
+ITEM_ERROR_CODES = ["InternalServerException", "TextSizeLimitExceededException"]
+RECIPE_DICT = {
+    "language_detection": {
+        "operation": "detect_dominant_language",
+        "api_formatter_class": LanguageDetectionAPIFormatter,
+    },
+    "sentiment_analysis": {"operation": "detect_sentiment", "api_formatter_class": SentimentAnalysisAPIFormatter},
+    "named_entity_recognition": {
+        "operation": "detect_entities",
+        "api_formatter_class": partial(
+            NamedEntityRecognitionAPIFormatter, entity_types=list(EntityTypeEnum), minimum_score=0.0
+        ),
+    },
+    "key_phrase_extraction": {
+        "operation": "detect_key_phrases",
+        "api_formatter_class": partial(KeyPhraseExtractionAPIFormatter, num_key_phrases=3),
+    },
+}
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class SimulatedComprehendClient:
+    """
+    Simulation of the batch APIs of the Amazon Comprehend client:
+    - each call sleeps for a lognormal latency around a median, plus a latency proportional to the batch size in bytes
+    - calls above api_tps transactions per second fail with a ThrottlingException, as the real API
+    - each item fails with a probability of item_error_rate, with a transient or a permanent error code
+    - results are generated from the words of each text, with the structure and offsets of real responses
+    Latencies of successful calls are recorded, as well as the number of throttled calls.
+    """
+
+    def __init__(
+        self,
+        median_latency: float = DEFAULT_MEDIAN_LATENCY_SECONDS,
+        latency_sigma: float = DEFAULT_LATENCY_SIGMA,
+        latency_per_byte: float = DEFAULT_LATENCY_SECONDS_PER_BYTE,
+        api_tps: float = DEFAULT_API_TPS,
+        item_error_rate: float = DEFAULT_ITEM_ERROR_RATE,
+        seed: int = DEFAULT_SEED,
+    ):
+        self.median_latency = median_latency
+        self.latency_sigma = latency_sigma
+        self.latency_per_byte = latency_per_byte
+        self.api_tps = api_tps
+        self.item_error_rate = item_error_rate
+        self.call_latencies = []
+        self.num_throttled = 0
+        self._call_times = deque()
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    def _acquire_transaction(self) -> bool:
+        with self._lock:
+            now = monotonic()
+            while len(self._call_times) != 0 and self._call_times[0] <= now - 1.0:
+                self._call_times.popleft()
+            if len(self._call_times) >= self.api_tps:
+                self.num_throttled += 1
+                return False
+            self._call_times.append(now)
+            return True
+
+    def _call(self, operation: AnyStr, TextList: List[AnyStr], LanguageCode: AnyStr = None) -> Dict:
+        start = perf_counter()
+        if not self._acquire_transaction():
+            sleep(THROTTLING_LATENCY_SECONDS)
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation)
+        with self._lock:
+            latency = self.median_latency * self._random.lognormvariate(0, self.latency_sigma)
+            item_errors = [self._random.random() < self.item_error_rate for _ in TextList]
+            seed = self._random.random()
+        latency += self.latency_per_byte * sum(len(text.encode("utf-8")) for text in TextList)
+        response = {"ResultList": [], "ErrorList": []}
+        item_random = random.Random(seed)
+        for i, (text, item_error) in enumerate(zip(TextList, item_errors)):
+            if item_error:
+                error_code = item_random.choice(ITEM_ERROR_CODES)
+                response["ErrorList"].append({"Index": i, "ErrorCode": error_code, "ErrorMessage": error_code})
+            else:
+                response["ResultList"].append({"Index": i, **generate_result(operation, text, item_random)})
+        sleep(max(0.0, latency - (perf_counter() - start)))
+        with self._lock:
+            self.call_latencies.append(perf_counter() - start)
+        return response
+
+    def batch_detect_dominant_language(self, TextList: List[AnyStr]) -> Dict:
+        return self._call("detect_dominant_language", TextList)
+
+    def batch_detect_sentiment(self, TextList: List[AnyStr], LanguageCode: AnyStr) -> Dict:
+        return self._call("detect_sentiment", TextList, LanguageCode)
+
+    def batch_detect_entities(self, TextList: List[AnyStr], LanguageCode: AnyStr) -> Dict:
+        return self._call("detect_entities", TextList, LanguageCode)
+
+    def batch_detect_key_phrases(self, TextList: List[AnyStr], LanguageCode: AnyStr) -> Dict:
+        return self._call("detect_key_phrases", TextList, LanguageCode)
+
+
+def generate_spans(text: AnyStr, item_random: random.Random, max_spans: int) -> List[Dict]:
+    """
+    Pick random words of a text as entity or key phrase spans, with their offsets in the text
+    """
+    spans = []
+    offset = 0
+    for word in text.split(" "):
+        if word != "" and len(spans) < max_spans and item_random.random() < 0.1:
+            spans.append({"Text": word, "BeginOffset": offset, "EndOffset": offset + len(word)})
+        offset += len(word) + 1
+    return spans
+
+
+def generate_result(operation: AnyStr, text: AnyStr, item_random: random.Random) -> Dict:
+    if operation == "detect_dominant_language":
+        scores = sorted([item_random.random() for _ in range(2)], reverse=True)
+        return {
+            "Languages": [
+                {"LanguageCode": LANGUAGE, "Score": scores[0]},
+                {"LanguageCode": item_random.choice(["fr", "de", "es"]), "Score": scores[1] / 10},
+            ]
+        }
+    if operation == "detect_sentiment":
+        scores = [item_random.random() for _ in range(4)]
+        return {
+            "Sentiment": item_random.choice(["POSITIVE", "NEUTRAL", "NEGATIVE", "MIXED"]),
+            "SentimentScore": dict(
+                zip(["Positive", "Neutral", "Negative", "Mixed"], [s / sum(scores) for s in scores])
+            ),
+        }
+    if operation == "detect_entities":
+        return {
+            "Entities": [
+                {**span, "Type": item_random.choice(list(EntityTypeEnum.__members__)), "Score": item_random.random()}
+                for span in generate_spans(text, item_random, max_spans=20)
+            ]
+        }
+    return {
+        "KeyPhrases": [
+            {**span, "Score": item_random.random()} for span in generate_spans(text, item_random, max_spans=10)
+        ]
+    }
+
+
+def generate_texts(num_rows: int, seed: int = DEFAULT_SEED) -> List[str]:
+    """
+    Generate texts of words with a long-tailed length distribution: mostly short texts, a few above the API size limit
+    """
+    random_state = np.random.RandomState(seed)
+    text_random = random.Random(seed)
+    lengths = np.clip(random_state.lognormal(mean=5, sigma=1.2, size=num_rows), 10, 8000).astype(int)
+    words = [
+        "".join([text_random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(k)])
+        for k in range(1, 12)
+        for _ in range(50)
+    ]
+    texts = []
+    for length in lengths:
+        text = ""
+        while len(text) < length:
+            text += text_random.choice(words) + " "
+        texts.append(text.strip())
+    return texts
+
+
+def get_analysis(
+    recipe: AnyStr,
+    input_columns: List[AnyStr],
+    client: SimulatedComprehendClient,
+    rate_limiter: AdaptiveRateLimiter,
+    parallel_workers: int,
+    batch_size: int,
+) -> ComprehendAnalysis:
+    """
+    Build the call and format pipeline of a single-analysis recipe, with the same parameters as the recipe
+    """
+    recipe_params = RECIPE_DICT[recipe]
+    return ComprehendAnalysis(
+        operation=recipe_params["operation"],
+        api_formatter=recipe_params["api_formatter_class"](
+            input_df=pd.DataFrame(columns=input_columns), error_handling=ErrorHandlingEnum.LOG
+        ),
+        client=client,
+        text_column=INPUT_COLUMN,
+        text_language=LANGUAGE,
+        parallel_workers=parallel_workers,
+        batch_size=batch_size,
+        rate_limiter=rate_limiter,
+    )
+
+
+def compute_recipe_pipeline(input_df: pd.DataFrame, recipes: List[AnyStr], **kwargs) -> pd.DataFrame:
+    """
+    Run the pipelines of the analyses of a recipe on a chunk, sharing the client, the rate limiter
+    and the pool of parallel workers as the recipes
+    """
+    analyses = [get_analysis(recipe, list(input_df.columns), **kwargs) for recipe in recipes]
+    return compute_analyses(input_df, analyses, parallel_workers=kwargs["parallel_workers"])
+
+
+def run_benchmark(config: Dict, client_params: Dict, rate_limit: float) -> Dict:
+    """
+    Run one configuration of the grid and measure it. Meant to run in a dedicated process,
+    so that peak RSS and CPU time are not mixed with other configurations.
+    """
+    input_df = pd.DataFrame({INPUT_COLUMN: generate_texts(config["num_rows"], client_params["seed"])})
+    client = SimulatedComprehendClient(**client_params)
+    rate_limiter = AdaptiveRateLimiter(rate_limit=rate_limit, period=1.0)
+    pipeline_kwargs = {
+        "client": client,
+        "rate_limiter": rate_limiter,
+        "parallel_workers": config["parallel_workers"],
+        "batch_size": config["batch_size"],
+    }
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = perf_counter()
+    recipes = list(RECIPE_DICT.keys()) if config["recipe"] == "multi_analysis" else [config["recipe"]]
+    output_df = compute_recipe_pipeline(input_df, recipes, **pipeline_kwargs)
+    wall_time = perf_counter() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    error_columns = [c for c in output_df.columns if c.endswith("_error_type")]
+    call_latencies = np.array(client.call_latencies) if len(client.call_latencies) != 0 else np.zeros(1)
+    peak_rss_bytes = usage_end.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        **config,
+        "rows_per_second": config["num_rows"] / wall_time,
+        "wall_time_seconds": wall_time,
+        "cpu_time_seconds": (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime),
+        "peak_rss_mb": peak_rss_bytes / 2 ** 20,
+        "num_calls": len(client.call_latencies),
+        "num_throttled_calls": client.num_throttled,
+        "num_error_rows": int((output_df[error_columns] != "").any(axis=1).sum()),
+        "call_latency_ms": {
+            "p50": float(np.percentile(call_latencies, 50) * 1000),
+            "p95": float(np.percentile(call_latencies, 95) * 1000),
+            "p99": float(np.percentile(call_latencies, 99) * 1000),
+        },
+    }
+
+
+def get_git_commit() -> AnyStr:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_arguments(argv: List[AnyStr]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", nargs="+", choices=DEFAULT_RECIPES, default=DEFAULT_RECIPES)
+    parser.add_argument("--parallel-workers", nargs="+", type=int, default=DEFAULT_PARALLEL_WORKERS_GRID)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=DEFAULT_BATCH_SIZE_GRID)
+    parser.add_argument("--num-rows", nargs="+", type=int, default=DEFAULT_NUM_ROWS_GRID)
+    parser.add_argument("--median-latency", type=float, default=DEFAULT_MEDIAN_LATENCY_SECONDS, help="seconds")
+    parser.add_argument("--latency-sigma", type=float, default=DEFAULT_LATENCY_SIGMA)
+    parser.add_argument("--latency-per-byte", type=float, default=DEFAULT_LATENCY_SECONDS_PER_BYTE, help="seconds")
+    parser.add_argument("--api-tps", type=float, default=DEFAULT_API_TPS, help="throttling threshold of the API")
+    parser.add_argument("--rate-limit", type=float, default=DEFAULT_RATE_LIMIT, help="rate limit of the plugin")
+    parser.add_argument("--item-error-rate", type=float, default=DEFAULT_ITEM_ERROR_RATE)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument(
+        "--output", default="benchmark_recipes_{}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[AnyStr]) -> None:
+    args = parse_arguments(argv)
+    client_params = {
+        "median_latency": args.median_latency,
+        "latency_sigma": args.latency_sigma,
+        "latency_per_byte": args.latency_per_byte,
+        "api_tps": args.api_tps,
+        "item_error_rate": args.item_error_rate,
+        "seed": args.seed,
+    }
+    results = []
+    for recipe, num_rows, batch_size, parallel_workers in product(
+        args.recipes, args.num_rows, args.batch_sizes, args.parallel_workers
+    ):
+        config = {
+            "recipe": recipe,
+            "num_rows": num_rows,
+            "batch_size": batch_size,
+            "parallel_workers": parallel_workers,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("fork")) as executor:
+            result = executor.submit(run_benchmark, config, client_params, args.rate_limit).result()
+        results.append(result)
+        print(
+            "{recipe}, {num_rows} rows, batch size {batch_size}, {parallel_workers} workers: "
+            "{rows_per_second:.0f} rows/s, call latency p50 {p50:.1f}ms p95 {p95:.1f}ms p99 {p99:.1f}ms, "
+            "CPU time {cpu_time_seconds:.2f}s, peak RSS {peak_rss_mb:.0f}MB, {num_throttled_calls} throttled calls, "
+            "{num_error_rows} error rows".format(**result, **result["call_latency_ms"])
+        )
+    output = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": get_git_commit(),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "simulated_client": client_params,
+            "rate_limit": args.rate_limit,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(output, output_file, indent=4)
+    print("Results saved to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
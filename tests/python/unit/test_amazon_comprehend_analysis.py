@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+from threading import Lock
+from typing import AnyStr, List
+
+import pandas as pd
+
+from plugin_io_utils import ErrorHandlingEnum
+from amazon_comprehend_api_client import EMPTY_TEXT_ERROR_TYPE, UNSUPPORTED_LANGUAGE_ERROR_TYPE
+from amazon_comprehend_api_formatting import LanguageDetectionAPIFormatter, SentimentAnalysisAPIFormatter
+from amazon_comprehend_analysis import ComprehendAnalysis, compute_analyses
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+LANGUAGE_BY_FIRST_WORD = {"hello": "en", "bonjour": "fr", "ciao": "it"}
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class MockComprehendClient:
+    """
+    Stand-in of the batch APIs of the Amazon Comprehend client, recording the language code of each call
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = Lock()
+
+    def batch_detect_dominant_language(self, TextList: List[AnyStr]) -> dict:
+        with self._lock:
+            self.calls.append(("detect_dominant_language", None, len(TextList)))
+        languages = [LANGUAGE_BY_FIRST_WORD.get(text.split(" ")[0], "xx") for text in TextList]
+        return {
+            "ResultList": [
+                {"Index": i, "Languages": [{"LanguageCode": language, "Score": 0.9}]}
+                for i, language in enumerate(languages)
+            ],
+            "ErrorList": [],
+        }
+
+    def batch_detect_sentiment(self, TextList: List[AnyStr], LanguageCode: AnyStr) -> dict:
+        with self._lock:
+            self.calls.append(("detect_sentiment", LanguageCode, len(TextList)))
+        return {
+            "ResultList": [{"Index": i, "Sentiment": "POSITIVE"} for i in range(len(TextList))],
+            "ErrorList": [],
+        }
+
+
+def test_compute_analyses_with_detected_language():
+    client = MockComprehendClient()
+    input_df = pd.DataFrame(
+        {INPUT_COLUMN: ["hello world", "bonjour", "hello again", "", "ciao", "unknown words"]}, index=range(10, 16),
+    )
+    input_df_template = pd.DataFrame(columns=input_df.columns)
+    language_detection_formatter = LanguageDetectionAPIFormatter(input_df=input_df_template)
+    analyses = [
+        ComprehendAnalysis(
+            operation="detect_dominant_language",
+            api_formatter=language_detection_formatter,
+            client=client,
+            text_column=INPUT_COLUMN,
+        ),
+        ComprehendAnalysis(
+            operation="detect_sentiment",
+            api_formatter=SentimentAnalysisAPIFormatter(input_df=input_df_template),
+            client=client,
+            text_column=INPUT_COLUMN,
+            text_language="language_column",
+            language_column=language_detection_formatter.language_code_column,
+        ),
+    ]
+    output_df = compute_analyses(input_df, analyses, parallel_workers=2, detect_language_first=True)
+    assert list(output_df.index) == list(input_df.index)
+    assert list(output_df[INPUT_COLUMN]) == list(input_df[INPUT_COLUMN])
+    assert list(output_df["lang_detect_api_language_code"]) == ["en", "fr", "en", "", "it", "xx"]
+    assert list(output_df["sentiment_api_prediction"]) == ["POSITIVE", "POSITIVE", "POSITIVE", "", "POSITIVE", ""]
+    assert list(output_df["sentiment_api_error_type"]) == [
+        "",
+        "",
+        "",
+        EMPTY_TEXT_ERROR_TYPE,
+        "",
+        UNSUPPORTED_LANGUAGE_ERROR_TYPE,
+    ]
+    # Sentiment batches are grouped by detected language, and unsupported languages are not sent to the API
+    assert sorted([c for c in client.calls if c[0] == "detect_sentiment"]) == [
+        ("detect_sentiment", "en", 2),
+        ("detect_sentiment", "fr", 1),
+        ("detect_sentiment", "it", 1),
+    ]
+
+
+def test_compute_analyses_with_language_code():
+    client = MockComprehendClient()
+    input_df = pd.DataFrame({INPUT_COLUMN: ["hello world", "bonjour"]})
+    analysis = ComprehendAnalysis(
+        operation="detect_sentiment",
+        api_formatter=SentimentAnalysisAPIFormatter(
+            input_df=pd.DataFrame(columns=input_df.columns), error_handling=ErrorHandlingEnum.FAIL
+        ),
+        client=client,
+        text_column=INPUT_COLUMN,
+        text_language="en",
+        batch_size=25,
+    )
+    output_df = compute_analyses(input_df, [analysis])
+    assert list(output_df["sentiment_api_prediction"]) == ["POSITIVE", "POSITIVE"]
+    assert "sentiment_api_error_type" not in output_df.columns
+    assert analysis.language_code == "en"
+    assert client.calls == [("detect_sentiment", "en", 2)]
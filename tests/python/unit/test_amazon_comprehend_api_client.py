@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import json
+import time
+from typing import Dict
+from threading import Lock, Thread
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from botocore.stub import Stubber
+
+from plugin_io_utils import build_unique_column_names
+from api_parallelizer import set_api_exception
+from amazon_comprehend_api_client import (  # noqa
+    BATCH_INDEX_ERROR_TYPE,
+    BATCH_MISSING_INDEX_ERROR_MESSAGE,
+    BATCH_DUPLICATE_INDEX_ERROR_MESSAGE,
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    EMPTY_LANGUAGE_ERROR_TYPE,
+    SUPPORTED_LANGUAGE_CODES,
+    UNSUPPORTED_LANGUAGE_ERROR_TYPE,
+    batch_api_response_parser,
+    build_batch_request,
+    build_language_error_batch_response,
+    get_batch_language_code,
+    get_client,
+    get_client_config,
+    is_transient_error,
+    merge_entity_responses,
+    merge_key_phrase_responses,
+    merge_sentiment_responses,
+)
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+API_COLUMN_NAMES = build_unique_column_names(["text"], "test_api")
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def test_batch_api_response_parser():
+    batch = [{"text": str(i)} for i in range(5)]
+    response = {
+        "ResultList": [
+            {"Index": 3, "Sentiment": "NEGATIVE"},
+            {"Index": 0, "Sentiment": "POSITIVE"},
+            {"Index": 2, "Sentiment": "NEUTRAL"},
+        ],
+        "ErrorList": [
+            {"Index": 1, "ErrorCode": "TextSizeLimitExceededException", "ErrorMessage": "Too long"},
+            {"Index": 2, "ErrorCode": "InternalServerException", "ErrorMessage": "Oops"},
+        ],
+    }
+    batch = batch_api_response_parser(batch=batch, response=response, api_column_names=API_COLUMN_NAMES)
+    assert batch[0][API_COLUMN_NAMES.response]["Sentiment"] == "POSITIVE"
+    assert batch[3][API_COLUMN_NAMES.response]["Sentiment"] == "NEGATIVE"
+    assert batch[1][API_COLUMN_NAMES.response] == ""
+    assert batch[1][API_COLUMN_NAMES.error_type] == "TextSizeLimitExceededException"
+    assert batch[1][API_COLUMN_NAMES.error_message] == "Too long"
+    assert batch[2][API_COLUMN_NAMES.error_type] == BATCH_INDEX_ERROR_TYPE
+    assert batch[2][API_COLUMN_NAMES.error_message] == BATCH_DUPLICATE_INDEX_ERROR_MESSAGE
+    assert batch[4][API_COLUMN_NAMES.error_type] == BATCH_INDEX_ERROR_TYPE
+    assert batch[4][API_COLUMN_NAMES.error_message] == BATCH_MISSING_INDEX_ERROR_MESSAGE
+
+
+def test_is_transient_error():
+    assert is_transient_error("InternalServerException", "")
+    assert is_transient_error(BATCH_INDEX_ERROR_TYPE, "")
+    assert is_transient_error("botocore.exceptions.ReadTimeoutError", "")
+    assert not is_transient_error("TextSizeLimitExceededException", "")
+
+
+def test_is_transient_error_raised_by_client():
+    api_configuration_preset = {"aws_access_key": "test", "aws_secret_key": "test", "aws_region": "us-east-1"}
+    client = get_client(api_configuration_preset)
+    error_codes = ["InternalServerException", "ThrottlingException", "TextSizeLimitExceededException"]
+    transient = []
+    with Stubber(client) as stubber:
+        for error_code in error_codes:
+            stubber.add_client_error("batch_detect_sentiment", service_error_code=error_code, http_status_code=500)
+            row = {}
+            try:
+                client.batch_detect_sentiment(TextList=["test"], LanguageCode="en")
+            except Exception as e:
+                set_api_exception([row], e, API_COLUMN_NAMES)
+            transient.append(is_transient_error(row[API_COLUMN_NAMES.error_type], row[API_COLUMN_NAMES.error_raw]))
+    assert transient == [True, True, False]
+
+
+def test_empty_language_batch():
+    batch = [{"text": "a", "language": float("nan")}, {"text": "b", "language": float("nan")}]
+    assert get_batch_language_code(batch, "language") == ""
+    response = build_language_error_batch_response(batch, "language")
+    batch = batch_api_response_parser(batch=batch, response=response, api_column_names=API_COLUMN_NAMES)
+    assert [row[API_COLUMN_NAMES.error_type] for row in batch] == [EMPTY_LANGUAGE_ERROR_TYPE] * 2
+    assert not is_transient_error(EMPTY_LANGUAGE_ERROR_TYPE, "")
+
+
+def test_unsupported_language_batch():
+    supported_languages = SUPPORTED_LANGUAGE_CODES["detect_sentiment"]
+    batch = [{"text": " a ", "language": "en"}, {"text": "b", "language": "en"}]
+    request = build_batch_request(batch, "text", "language_column", "language", supported_languages)
+    assert request == {"TextList": ["a", "b"], "LanguageCode": "en"}
+    batch = [{"text": "a", "language": "nl"}]
+    assert build_batch_request(batch, "text", "language_column", "language", supported_languages) is None
+    response = build_language_error_batch_response(batch, "language")
+    batch = batch_api_response_parser(batch=batch, response=response, api_column_names=API_COLUMN_NAMES)
+    assert batch[0][API_COLUMN_NAMES.error_type] == UNSUPPORTED_LANGUAGE_ERROR_TYPE
+    assert "'nl'" in batch[0][API_COLUMN_NAMES.error_message]
+
+
+def test_merge_segment_responses():
+    segments = [(0, "a" * 30), (31, "b" * 10)]
+    entity_responses = [
+        {"Entities": [{"Text": "Paris", "Type": "LOCATION", "BeginOffset": 2, "EndOffset": 7}]},
+        {"Entities": [{"Text": "Lyon", "Type": "LOCATION", "BeginOffset": 0, "EndOffset": 4}]},
+    ]
+    entities = merge_entity_responses(entity_responses, segments)["Entities"]
+    assert [(e["BeginOffset"], e["EndOffset"]) for e in entities] == [(2, 7), (31, 35)]
+    sentiment_responses = [
+        {"Sentiment": "NEGATIVE", "SentimentScore": {"Positive": 0.2, "Negative": 0.8}},
+        {"Sentiment": "POSITIVE", "SentimentScore": {"Positive": 1.0, "Negative": 0.0}},
+    ]
+    sentiment = merge_sentiment_responses(sentiment_responses, segments)
+    assert sentiment["Sentiment"] == "NEGATIVE"
+    assert abs(sentiment["SentimentScore"]["Positive"] - 0.4) < 1e-9
+    key_phrase_responses = [
+        {"KeyPhrases": [{"Text": "the cat", "Score": 0.5}, {"Text": "a dog", "Score": 0.6}]},
+        {"KeyPhrases": [{"Text": "The cat", "Score": 0.9}]},
+    ]
+    key_phrases = merge_key_phrase_responses(key_phrase_responses, segments)["KeyPhrases"]
+    assert [(k["Text"], k["Score"]) for k in key_phrases] == [("The cat", 0.9), ("a dog", 0.6)]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server handling each connection in a thread, as http.server.ThreadingHTTPServer of Python 3.7+
+    """
+
+    daemon_threads = True
+
+
+class MockComprehendRequestHandler(BaseHTTPRequestHandler):
+    """
+    Local HTTP stand-in for the Amazon Comprehend API, which counts the connections opened by clients.
+    Responses are delayed, so that all threads of the client have a request in flight at the same time.
+    """
+
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+    latency = 0.05
+    num_connections = 0
+    num_requests = 0
+    lock = Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            MockComprehendRequestHandler.num_connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        with self.lock:
+            MockComprehendRequestHandler.num_requests += 1
+        body = json.dumps({"Sentiment": "POSITIVE", "SentimentScore": {"Positive": 1.0}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockThrottlingRequestHandler(MockComprehendRequestHandler):
+    """
+    Local HTTP stand-in for the Amazon Comprehend API, which throttles all requests
+    """
+
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            MockComprehendRequestHandler.num_requests += 1
+        body = json.dumps({"__type": "ThrottlingException", "message": "Rate exceeded"}).encode("utf-8")
+        self.send_response(400)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def count_throttled_attempts(api_configuration_preset: Dict, rate_limited: bool = False) -> int:
+    """
+    Send one request to a local stand-in of the API which throttles all requests,
+    and return the number of HTTP requests sent by the client, including its retries
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockThrottlingRequestHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    MockComprehendRequestHandler.num_requests = 0
+    try:
+        api_configuration_preset = dict(
+            api_configuration_preset, endpoint_url="http://127.0.0.1:{}".format(server.server_address[1])
+        )
+        client = get_client(api_configuration_preset, rate_limited=rate_limited)
+        try:
+            client.detect_sentiment(Text="test", LanguageCode="en")
+        except client.exceptions.ClientError as error:
+            assert error.response["Error"]["Code"] == "ThrottlingException"
+    finally:
+        server.shutdown()
+        server.server_close()
+    return MockComprehendRequestHandler.num_requests
+
+
+def count_connections(api_configuration_preset: Dict, num_bursts: int, max_pool_connections: int = None) -> int:
+    """
+    Send bursts of concurrent requests from parallel_workers threads to a local stand-in of the API,
+    and return the number of connections opened by the client. All connections are idle between bursts,
+    as between batches of rows, and only max_pool_connections of them are kept alive for the next burst.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockComprehendRequestHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    MockComprehendRequestHandler.num_connections = 0
+    MockComprehendRequestHandler.num_requests = 0
+    parallel_workers = api_configuration_preset["parallel_workers"]
+    responses = []
+    try:
+        api_configuration_preset = dict(
+            api_configuration_preset, endpoint_url="http://127.0.0.1:{}".format(server.server_address[1])
+        )
+        client = get_client(api_configuration_preset, max_pool_connections)
+        with ThreadPoolExecutor(max_workers=parallel_workers) as pool:
+            for _ in range(num_bursts):
+                responses += list(
+                    pool.map(lambda i: client.detect_sentiment(Text=str(i), LanguageCode="en"), range(parallel_workers))
+                )
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert all([r["Sentiment"] == "POSITIVE" for r in responses])
+    assert MockComprehendRequestHandler.num_requests == num_bursts * parallel_workers
+    return MockComprehendRequestHandler.num_connections
+
+
+def test_client_reuses_connections():
+    parallel_workers = 3 * DEFAULT_MAX_POOL_CONNECTIONS
+    api_configuration_preset = {
+        "aws_access_key": "test",
+        "aws_secret_key": "test",
+        "aws_region": "us-east-1",
+        "parallel_workers": parallel_workers,
+    }
+    assert count_connections(api_configuration_preset, num_bursts=5) <= parallel_workers
+    # With the default pool size of botocore, connections which do not fit in the pool are opened again
+    num_connections = count_connections(api_configuration_preset, 5, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS)
+    assert num_connections > parallel_workers
+
+
+def test_client_retries():
+    api_configuration_preset = {
+        "aws_access_key": "test",
+        "aws_secret_key": "test",
+        "aws_region": "us-east-1",
+        "retry_mode": "standard",
+        "max_attempts": 2,
+    }
+    config = get_client_config(api_configuration_preset)
+    assert config.retries == {"mode": "standard", "total_max_attempts": 2}
+    # The maximum attempts of the preset include the first one
+    assert count_throttled_attempts(api_configuration_preset) == 2
+    # Throttled calls are not retried by the AWS SDK under the rate limiter
+    assert count_throttled_attempts(api_configuration_preset, rate_limited=True) == 1
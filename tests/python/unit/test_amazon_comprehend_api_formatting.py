@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import json
+import math
+from typing import Dict
+from functools import partial
+
+import pandas as pd
+
+from plugin_io_utils import ErrorHandlingEnum
+from api_parallelizer import api_parallelizer
+from amazon_comprehend_api_client import API_EXCEPTIONS, batch_api_response_parser, build_batch_request, validate_row
+from amazon_comprehend_api_formatting import (  # noqa
+    EntityTypeEnum,
+    GenericAPIFormatter,
+    LanguageDetectionAPIFormatter,
+    SentimentAnalysisAPIFormatter,
+    NamedEntityRecognitionAPIFormatter,
+    KeyPhraseExtractionAPIFormatter,
+)
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+
+LANGUAGE_DETECTION_RESPONSES = [
+    {"Languages": [{"LanguageCode": "fr", "Score": 0.98}, {"LanguageCode": "en", "Score": 0.01}]},
+    {"Languages": []},
+]
+SENTIMENT_ANALYSIS_RESPONSES = [
+    {
+        "Sentiment": "POSITIVE",
+        "SentimentScore": {"Positive": 0.91234, "Negative": 0.01, "Neutral": 0.07, "Mixed": 0.00766},
+    },
+    {"Sentiment": "NEUTRAL", "SentimentScore": {"Neutral": 0.5}},
+]
+NAMED_ENTITY_RECOGNITION_RESPONSES = [
+    {
+        "Entities": [
+            {"Text": "Paris", "Type": "LOCATION", "Score": 0.99},
+            {"Text": "Dataiku", "Type": "ORGANIZATION", "Score": 0.95},
+            {"Text": "Alice", "Type": "PERSON", "Score": 0.2},
+            {"Text": "Bob", "Type": "PERSON", "Score": 0.8},
+        ]
+    },
+    {"Entities": []},
+]
+KEY_PHRASE_EXTRACTION_RESPONSES = [
+    {"KeyPhrases": [{"Text": "a cat", "Score": 0.7}, {"Text": "the mat", "Score": 0.9}, {"Text": "it", "Score": 0.1}]},
+    {"KeyPhrases": [{"Text": "one phrase", "Score": 0.5}]},
+]
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def build_api_output_df(formatter: GenericAPIFormatter, responses) -> pd.DataFrame:
+    api_column_names = formatter.api_column_names
+    num_rows = len(responses) + 2
+    return pd.DataFrame(
+        {
+            INPUT_COLUMN: ["text {}".format(i) for i in range(num_rows)],
+            api_column_names.response: [json.dumps(r) for r in responses] + ["", "invalid JSON"],
+            api_column_names.error_message: [""] * num_rows,
+            api_column_names.error_type: [""] * num_rows,
+        }
+    )
+
+
+def assert_same_values(values, expected_values) -> None:
+    assert len(values) == len(expected_values)
+    for value, expected_value in zip(values, expected_values):
+        if expected_value is None:
+            assert value is None or math.isnan(value)
+        else:
+            assert value == expected_value
+
+
+def check_formatter_output(formatter: GenericAPIFormatter, responses, expected_columns: Dict) -> pd.DataFrame:
+    output_df = formatter.format_df(build_api_output_df(formatter, responses))
+    assert list(output_df.columns[1 : len(expected_columns) + 1]) == list(expected_columns.keys())
+    for column_name, expected_values in expected_columns.items():
+        assert_same_values(list(output_df[column_name]), expected_values)
+    schema = formatter.get_output_schema([{"name": INPUT_COLUMN, "type": "string"}])
+    assert [col["name"] for col in schema] == list(output_df.columns)
+    return output_df
+
+
+def test_language_detection_formatter():
+    formatter = LanguageDetectionAPIFormatter(input_df=pd.DataFrame(columns=[INPUT_COLUMN]))
+    output_df = check_formatter_output(
+        formatter,
+        LANGUAGE_DETECTION_RESPONSES,
+        {
+            "lang_detect_api_language_code": ["fr", "", "", ""],
+            "lang_detect_api_language_score": [0.98, None, None, None],
+        },
+    )
+    assert output_df[formatter.language_code_column].dtype == "category"
+
+
+def test_sentiment_analysis_formatter():
+    formatter = SentimentAnalysisAPIFormatter(input_df=pd.DataFrame(columns=[INPUT_COLUMN]))
+    output_df = check_formatter_output(
+        formatter,
+        SENTIMENT_ANALYSIS_RESPONSES,
+        {
+            "sentiment_api_prediction": ["POSITIVE", "NEUTRAL", "", ""],
+            "sentiment_api_score_positive": [0.912, None, None, None],
+            "sentiment_api_score_neutral": [0.07, 0.5, None, None],
+            "sentiment_api_score_negative": [0.01, None, None, None],
+            "sentiment_api_score_mixed": [0.008, None, None, None],
+        },
+    )
+    assert output_df[formatter.sentiment_prediction_column].dtype == "category"
+
+
+def test_named_entity_recognition_formatter():
+    formatter = NamedEntityRecognitionAPIFormatter(
+        input_df=pd.DataFrame(columns=[INPUT_COLUMN]),
+        entity_types=[EntityTypeEnum.PERSON, EntityTypeEnum.LOCATION],
+        minimum_score=0.5,
+    )
+    check_formatter_output(
+        formatter,
+        NAMED_ENTITY_RECOGNITION_RESPONSES,
+        {
+            "entity_api_entity_type_location": [["Paris"], "", "", ""],
+            "entity_api_entity_type_person": [["Bob"], "", "", ""],
+        },
+    )
+
+
+def test_key_phrase_extraction_formatter():
+    formatter = KeyPhraseExtractionAPIFormatter(input_df=pd.DataFrame(columns=[INPUT_COLUMN]), num_key_phrases=2)
+    check_formatter_output(
+        formatter,
+        KEY_PHRASE_EXTRACTION_RESPONSES,
+        {
+            "keyphrase_api_keyphrase_1_text": ["the mat", "one phrase", "", ""],
+            "keyphrase_api_keyphrase_1_confidence": [0.9, 0.5, None, None],
+            "keyphrase_api_keyphrase_2_text": ["a cat", "", "", ""],
+            "keyphrase_api_keyphrase_2_confidence": [0.7, None, None, None],
+        },
+    )
+
+
+def test_output_column_layout_unique_names():
+    input_columns = [INPUT_COLUMN, "sentiment_api_prediction"]
+    formatter = SentimentAnalysisAPIFormatter(input_df=pd.DataFrame(columns=input_columns))
+    layout_column_names = [col["name"] for col in formatter.output_column_layout.get_schema()]
+    assert formatter.sentiment_prediction_column not in input_columns
+    assert len(set(layout_column_names + input_columns)) == len(layout_column_names) + len(input_columns)
+    schema = formatter.get_output_schema([{"name": c, "type": "string"} for c in input_columns])
+    assert [col["type"] for col in schema[2:7]] == ["string", "double", "double", "double", "double"]
+
+
+def test_structured_responses():
+    formatter = SentimentAnalysisAPIFormatter(input_df=pd.DataFrame(columns=[INPUT_COLUMN]))
+    df = build_api_output_df(formatter, SENTIMENT_ANALYSIS_RESPONSES)
+    df[formatter.api_column_names.response] = SENTIMENT_ANALYSIS_RESPONSES + ["", ""]
+    output_df = formatter.format_df(df)
+    assert list(output_df[formatter.sentiment_prediction_column]) == ["POSITIVE", "NEUTRAL", "", ""]
+    assert json.loads(output_df[formatter.api_column_names.response][0]) == SENTIMENT_ANALYSIS_RESPONSES[0]
+
+
+def test_drop_raw_response():
+    formatter = SentimentAnalysisAPIFormatter(input_df=pd.DataFrame(columns=[INPUT_COLUMN]), keep_raw_response=False)
+    output_df = formatter.format_df(build_api_output_df(formatter, SENTIMENT_ANALYSIS_RESPONSES))
+    assert formatter.api_column_names.response not in output_df.columns
+    schema = formatter.get_output_schema([{"name": INPUT_COLUMN, "type": "string"}])
+    assert [col["name"] for col in schema] == list(output_df.columns)
+
+
+def test_fail_mode_with_invalid_rows():
+    formatter = SentimentAnalysisAPIFormatter(
+        input_df=pd.DataFrame(columns=[INPUT_COLUMN]), error_handling=ErrorHandlingEnum.FAIL
+    )
+
+    def call_mock_batch_api(batch, **kwargs):
+        request = build_batch_request(batch, INPUT_COLUMN, "en")
+        return {"ResultList": [dict(SENTIMENT_ANALYSIS_RESPONSES[0], Index=i) for i in range(len(request["TextList"]))]}
+
+    df = api_parallelizer(
+        input_df=pd.DataFrame({INPUT_COLUMN: ["great", float("nan"), "  "]}),
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=formatter.column_prefix,
+        api_support_batch=True,
+        batch_api_response_parser=batch_api_response_parser,
+        row_validator=partial(validate_row, text_column=INPUT_COLUMN),
+        error_handling=ErrorHandlingEnum.FAIL,
+    )
+    output_df = formatter.format_df(df)
+    assert list(output_df[formatter.sentiment_prediction_column]) == ["POSITIVE", "", ""]
+    schema = formatter.get_output_schema([{"name": INPUT_COLUMN, "type": "string"}])
+    assert [col["name"] for col in schema] == list(output_df.columns)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import io
+import json
+import tarfile
+from functools import partial
+
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+from plugin_io_utils import ErrorHandlingEnum
+from amazon_comprehend_api_client import (
+    BATCH_INDEX_ERROR_TYPE,
+    EMPTY_TEXT_ERROR_TYPE,
+    merge_sentiment_responses,
+    validate_row,
+)
+from amazon_comprehend_batch_job import ComprehendBatchJob, parse_s3_uri
+from incremental_output import PreviousOutputIndex
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+S3_URI = "s3://test-bucket/comprehend"
+ROLE_ARN = "arn:aws:iam::123456789012:role/comprehend-data-access"
+TOO_LONG_TEXT = "too long"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class MockS3Client:
+    """
+    In-memory stand-in of the S3 client, with the object calls used by batch jobs, recording uploaded keys
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.put_keys = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+        self.put_keys.append(Key)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not found"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class MockComprehendClient:
+    """
+    Stand-in of the Amazon Comprehend job endpoint: a sentiment detection job is in progress
+    on its first description, then writes its results to S3 in a gzipped archive as the real service,
+    with one JSON line per document, in reverse order, and an error on too long documents
+    """
+
+    def __init__(self, s3_client: MockS3Client, final_status: str = "COMPLETED"):
+        self.s3_client = s3_client
+        self.final_status = final_status
+        self.jobs = {}
+
+    def start_sentiment_detection_job(self, **kwargs):
+        job_id = "job{}".format(len(self.jobs))
+        self.jobs[job_id] = {"kwargs": kwargs, "num_describe_calls": 0}
+        return {"JobId": job_id, "JobStatus": "SUBMITTED"}
+
+    def write_output(self, job_id: str) -> str:
+        kwargs = self.jobs[job_id]["kwargs"]
+        (bucket, input_prefix) = parse_s3_uri(kwargs["InputDataConfig"]["S3Uri"])
+        lines = []
+        for (object_bucket, key), body in self.s3_client.objects.items():
+            if object_bucket == bucket and key.startswith(input_prefix):
+                for i, document in enumerate(body.decode("utf-8").split("\n")):
+                    item = {"File": key.split("/")[-1], "Line": i}
+                    if document == TOO_LONG_TEXT:
+                        item.update({"ErrorCode": "DOCUMENT_SIZE_EXCEEDED", "ErrorMessage": "Document too long"})
+                    else:
+                        item.update({"Sentiment": "POSITIVE", "SentimentScore": {"Positive": len(document) / 100}})
+                    lines.append(json.dumps(item))
+        output_content = "\n".join(reversed(lines)).encode("utf-8")
+        archive_buffer = io.BytesIO()
+        with tarfile.open(fileobj=archive_buffer, mode="w:gz") as archive:
+            member = tarfile.TarInfo(name="output")
+            member.size = len(output_content)
+            archive.addfile(member, io.BytesIO(output_content))
+        output_key = "123456789012-SENTIMENT-{}/output/output.tar.gz".format(job_id)
+        output_uri = kwargs["OutputDataConfig"]["S3Uri"] + output_key
+        self.s3_client.put_object(*parse_s3_uri(output_uri), archive_buffer.getvalue())
+        return output_uri
+
+    def describe_sentiment_detection_job(self, JobId):
+        job = self.jobs[JobId]
+        job["num_describe_calls"] += 1
+        properties = {"JobId": JobId, "JobStatus": "IN_PROGRESS"}
+        if job["num_describe_calls"] > 1:
+            properties["JobStatus"] = self.final_status
+            if self.final_status == "COMPLETED":
+                properties["OutputDataConfig"] = {"S3Uri": self.write_output(JobId)}
+            else:
+                properties["Message"] = "Access denied to the S3 bucket"
+        return {"SentimentDetectionJobProperties": properties}
+
+
+def generate_chunks():
+    yield pd.DataFrame({INPUT_COLUMN: ["good", "very\ngood", None]}, index=[0, 1, 2])
+    yield pd.DataFrame({INPUT_COLUMN: [TOO_LONG_TEXT, "great"]}, index=[3, 4])
+
+
+def test_batch_job_results_mapped_to_rows():
+    s3_client = MockS3Client()
+    client = MockComprehendClient(s3_client)
+    batch_job = ComprehendBatchJob(
+        client, s3_client, S3_URI, ROLE_ARN, text_column=INPUT_COLUMN, run_name="test", poll_initial_delay=0
+    )
+    batch_job.upload_chunks(generate_chunks())
+    assert s3_client.objects[("test-bucket", "comprehend/test/input/shard_000000000000.txt")] == b"good\nvery good\n"
+    batch_job.start_job("detect_sentiment", language_code="en")
+    job_kwargs = client.jobs["job0"]["kwargs"]
+    assert job_kwargs["LanguageCode"] == "en"
+    assert job_kwargs["InputDataConfig"] == {"S3Uri": S3_URI + "/test/input/", "InputFormat": "ONE_DOC_PER_LINE"}
+    batch_job.wait_for_jobs()
+    assert client.jobs["job0"]["num_describe_calls"] == 2
+    output_dfs = [
+        batch_job.compute_api_results(
+            input_df,
+            operation="detect_sentiment",
+            column_prefix="sentiment_api",
+            row_validator=partial(validate_row, text_column=INPUT_COLUMN),
+        )
+        for input_df in generate_chunks()
+    ]
+    batch_job.close()
+    output_df = pd.concat(output_dfs)
+    assert list(output_df.index) == [0, 1, 2, 3, 4]
+    responses = list(output_df["sentiment_api_response"])
+    assert [r["SentimentScore"]["Positive"] if r else None for r in responses] == [0.04, 0.09, None, None, 0.05]
+    assert list(output_df["sentiment_api_error_type"]) == ["", "", EMPTY_TEXT_ERROR_TYPE, "DOCUMENT_SIZE_EXCEEDED", ""]
+
+
+def test_batch_job_with_incremental_mode():
+    input_df = pd.DataFrame({"id": ["1", "2", "3", "4"], INPUT_COLUMN: ["a", "bb", "ccc", "dddd"]}, index=[4, 5, 6, 7])
+    api_column_names = ["sentiment_api_response", "sentiment_api_error_message", "sentiment_api_error_type"]
+    previous_api_values = {api_column_names[0]: "previous", api_column_names[1]: "", api_column_names[2]: ""}
+    # Only new or changed rows are uploaded and passed to the job, e.g. without the first row or a row in the middle
+    for reused_keys in [["1"], ["2"], ["1", "3"]]:
+        s3_client = MockS3Client()
+        batch_job = ComprehendBatchJob(
+            MockComprehendClient(s3_client),
+            s3_client,
+            S3_URI,
+            ROLE_ARN,
+            text_column=INPUT_COLUMN,
+            run_name="test",
+            poll_initial_delay=0,
+        )
+        previous_output_index = PreviousOutputIndex(
+            key_column="id", text_column=INPUT_COLUMN, api_column_names=api_column_names
+        )
+        previous_output_index.load([input_df[input_df["id"].isin(reused_keys)].assign(**previous_api_values)])
+        batch_job.upload_chunks([previous_output_index.filter_rows_to_process(input_df)])
+        uploaded_documents = [
+            body.decode("utf-8").split("\n") for (_, key), body in s3_client.objects.items() if "/input/" in key
+        ]
+        assert uploaded_documents == [
+            [t for k, t in zip(input_df["id"], input_df[INPUT_COLUMN]) if k not in reused_keys]
+        ]
+        batch_job.start_job("detect_sentiment", language_code="en")
+        batch_job.wait_for_jobs()
+        compute_api_results = partial(
+            batch_job.compute_api_results, operation="detect_sentiment", column_prefix="sentiment_api"
+        )
+        output_df = previous_output_index.process_chunk(compute_api_results, input_df)
+        previous_output_index.close()
+        batch_job.close()
+        responses = [r if r == "previous" else r["SentimentScore"]["Positive"] for r in output_df[api_column_names[0]]]
+        assert responses == ["previous" if k in reused_keys else int(k) / 100 for k in input_df["id"]]
+        assert list(output_df[api_column_names[2]]) == [""] * 4
+
+
+def test_batch_job_long_texts_segmented():
+    s3_client = MockS3Client()
+    batch_job = ComprehendBatchJob(
+        MockComprehendClient(s3_client),
+        s3_client,
+        S3_URI,
+        ROLE_ARN,
+        text_column=INPUT_COLUMN,
+        run_name="test",
+        max_document_bytes=20,
+        poll_initial_delay=0,
+    )
+    input_df = pd.DataFrame({INPUT_COLUMN: ["short", "A first sentence.\nAnd a second one.", "end"]})
+    batch_job.upload_chunks([input_df])
+    shard_body = s3_client.objects[("test-bucket", "comprehend/test/input/shard_000000000000.txt")]
+    assert shard_body == b"short\nA first sentence.\nAnd a second one.\nend"
+    batch_job.start_job("detect_sentiment", language_code="en")
+    batch_job.wait_for_jobs()
+    output_df = batch_job.compute_api_results(
+        input_df,
+        operation="detect_sentiment",
+        column_prefix="sentiment_api",
+        segment_response_merger=merge_sentiment_responses,
+    )
+    batch_job.close()
+    scores = [r["SentimentScore"]["Positive"] for r in output_df["sentiment_api_response"]]
+    # Segment scores are averaged with weights proportional to segment length
+    assert scores == [0.05, pytest.approx((0.17 * 17 + 0.17 * 17) / 34), 0.03]
+    assert list(output_df["sentiment_api_error_type"]) == [""] * 3
+
+
+def test_batch_job_resumed_with_same_run_name():
+    s3_client = MockS3Client()
+    client = MockComprehendClient(s3_client)
+    job_ids = []
+    for chunks in [generate_chunks(), generate_chunks(), list(generate_chunks())[:1]]:
+        s3_client.put_keys = []
+        batch_job = ComprehendBatchJob(
+            client, s3_client, S3_URI, ROLE_ARN, text_column=INPUT_COLUMN, run_name="test", poll_initial_delay=0
+        )
+        batch_job.upload_chunks(chunks)
+        job_ids.append(batch_job.start_job("detect_sentiment", language_code="en"))
+        batch_job.wait_for_jobs()
+        batch_job.close()
+        uploaded_shards = [k.split("/")[-1] for k in s3_client.put_keys if "/input/" in k]
+        if len(job_ids) == 1:
+            assert uploaded_shards == ["shard_000000000000.txt", "shard_000000000003.txt"]
+        else:
+            # Unchanged shards are not uploaded again, and shards which are not part of the input anymore are deleted
+            assert uploaded_shards == []
+    assert ("test-bucket", "comprehend/test/input/shard_000000000003.txt") not in s3_client.objects
+    # The job is reused on the same input, and started again when the input changes
+    assert job_ids == ["job0", "job0", "job1"]
+
+
+def test_batch_job_missing_result():
+    s3_client = MockS3Client()
+    batch_job = ComprehendBatchJob(
+        MockComprehendClient(s3_client), s3_client, S3_URI, ROLE_ARN, text_column=INPUT_COLUMN, run_name="test"
+    )
+    output_df = batch_job.compute_api_results(
+        pd.DataFrame({INPUT_COLUMN: ["not uploaded"]}), operation="detect_sentiment", column_prefix="sentiment_api"
+    )
+    assert list(output_df["sentiment_api_error_type"]) == [BATCH_INDEX_ERROR_TYPE]
+    with pytest.raises(Exception):
+        batch_job.compute_api_results(
+            pd.DataFrame({INPUT_COLUMN: ["not uploaded"]}),
+            operation="detect_sentiment",
+            column_prefix="sentiment_api",
+            error_handling=ErrorHandlingEnum.FAIL,
+        )
+    batch_job.close()
+
+
+def test_batch_job_fail_mode_with_invalid_rows():
+    s3_client = MockS3Client()
+    batch_job = ComprehendBatchJob(
+        MockComprehendClient(s3_client),
+        s3_client,
+        S3_URI,
+        ROLE_ARN,
+        text_column=INPUT_COLUMN,
+        run_name="test",
+        poll_initial_delay=0,
+    )
+    input_df = next(generate_chunks())
+    batch_job.upload_chunks([input_df])
+    batch_job.start_job("detect_sentiment", language_code="en")
+    batch_job.wait_for_jobs()
+    # Rows rejected by the row validator get an empty result instead of failing, as with synchronous API calls
+    output_df = batch_job.compute_api_results(
+        input_df,
+        operation="detect_sentiment",
+        column_prefix="sentiment_api",
+        row_validator=partial(validate_row, text_column=INPUT_COLUMN),
+        error_handling=ErrorHandlingEnum.FAIL,
+    )
+    batch_job.close()
+    assert [r["Sentiment"] if r else "" for r in output_df["sentiment_api_response"]] == ["POSITIVE", "POSITIVE", ""]
+
+
+def test_batch_job_failed():
+    s3_client = MockS3Client()
+    batch_job = ComprehendBatchJob(
+        MockComprehendClient(s3_client, final_status="FAILED"),
+        s3_client,
+        S3_URI,
+        ROLE_ARN,
+        text_column=INPUT_COLUMN,
+        run_name="test",
+        poll_initial_delay=0,
+    )
+    batch_job.upload_chunks(generate_chunks())
+    batch_job.start_job("detect_sentiment", language_code="en")
+    with pytest.raises(RuntimeError, match="Access denied"):
+        batch_job.wait_for_jobs()
+    batch_job.close()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import time
+from typing import Dict
+
+import pandas as pd
+
+from api_cache import ApiResponseCache
+from api_parallelizer import api_parallelizer  # noqa
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+API_EXCEPTIONS = (ValueError,)
+COLUMN_PREFIX = "test_api"
+INPUT_COLUMN = "text"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def test_cache_skips_api_calls(tmp_path):
+    api_calls = []
+
+    def call_mock_api(row: Dict) -> Dict:
+        api_calls.append(row[INPUT_COLUMN])
+        return {"length": len(row[INPUT_COLUMN].strip())}
+
+    input_df = pd.DataFrame({INPUT_COLUMN: ["a", "bb", "ccc"], "other_column": [1, 2, 3]})
+    api_cache = ApiResponseCache(path=str(tmp_path), operation="mock", params={"language": "en"})
+    api_parallelizer(
+        input_df=input_df.iloc[:2],
+        api_call_function=call_mock_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        input_columns=[INPUT_COLUMN],
+        api_cache=api_cache,
+    )
+    api_cache.close()
+    api_calls.clear()
+    api_cache = ApiResponseCache(path=str(tmp_path), operation="mock", params={"language": "en"})
+    df = api_parallelizer(
+        input_df=input_df.assign(**{INPUT_COLUMN: [" a ", "bb", "ccc"]}),
+        api_call_function=call_mock_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        input_columns=[INPUT_COLUMN],
+        api_cache=api_cache,
+    )
+    assert api_calls == ["ccc"]
+    assert [r["length"] for r in df[COLUMN_PREFIX + "_response"]] == [1, 2, 3]
+    assert (api_cache.num_hits, api_cache.num_misses) == (2, 1)
+    other_params_cache = ApiResponseCache(path=str(tmp_path), operation="mock", params={"language": "fr"})
+    assert len(other_params_cache.get_many([other_params_cache.compute_key(["a"])])) == 0
+
+
+def test_cache_eviction(tmp_path):
+    api_cache = ApiResponseCache(path=str(tmp_path), operation="mock", max_entries=2)
+    keys = [api_cache.compute_key([str(i)]) for i in range(3)]
+    for key in keys:
+        api_cache.set_many({key: {"result": key}})
+        time.sleep(0.01)
+    api_cache.evict()
+    assert sorted(api_cache.get_many(keys).keys()) == sorted(keys[1:])
+    api_cache.max_age_seconds = 0
+    api_cache.evict()
+    assert len(api_cache.get_many(keys)) == 0
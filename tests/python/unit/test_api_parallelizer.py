@@ -4,13 +4,24 @@
 # see https://docs.pytest.org for more information
 
 import json
-from typing import AnyStr, Dict
+import time
+from typing import AnyStr, Dict, List, NamedTuple
 from enum import Enum
+from functools import partial
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 from boto3.exceptions import Boto3Error
 
-from api_parallelizer import api_parallelizer  # noqa
+from api_parallelizer import api_parallelizer, submit_with_backpressure  # noqa
+from amazon_comprehend_api_client import (
+    EMPTY_TEXT_ERROR_TYPE,
+    UNSUPPORTED_LANGUAGE_ERROR_TYPE,
+    batch_api_response_parser,
+    is_transient_error,
+    validate_row,
+)
 
 
 # ==============================================================================
@@ -95,3 +106,275 @@ def test_invalid_input():
     expected_dictionary = APICaseEnum.INVALID_INPUT.value
     for k in expected_dictionary:
         assert output_dictionary[k] == expected_dictionary[k]
+
+
+def test_max_tasks_in_flight():
+    max_tasks_in_flight = 4
+    num_tasks = 50
+    completed_tasks = []
+
+    def slow_task(item: int) -> int:
+        time.sleep(0.005)
+        completed_tasks.append(item)
+        return item
+
+    def work_items():
+        for i in range(num_tasks):
+            assert i - len(completed_tasks) <= max_tasks_in_flight
+            yield (i, i)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(submit_with_backpressure(pool, slow_task, work_items(), "item", max_tasks_in_flight))
+    assert sorted(results) == [(i, i) for i in range(num_tasks)]
+
+
+def test_shared_pool():
+    parallel_workers = 4
+    num_analyses = 3
+    in_flight = []
+    concurrency = []
+    lock = Lock()
+
+    def call_mock_slow_api(row: Dict) -> AnyStr:
+        with lock:
+            in_flight.append(row["id"])
+            concurrency.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(row["id"])
+        return json.dumps({"id": row["id"]})
+
+    input_df = pd.DataFrame({"id": range(40)})
+    with ThreadPoolExecutor(max_workers=parallel_workers) as pool:
+        compute_analysis = partial(
+            api_parallelizer,
+            input_df=input_df,
+            api_call_function=call_mock_slow_api,
+            api_exceptions=API_EXCEPTIONS,
+            parallel_workers=parallel_workers,
+            pool=pool,
+        )
+        with ThreadPoolExecutor(max_workers=num_analyses) as analysis_pool:
+            column_prefixes = ["api_{}".format(i) for i in range(num_analyses)]
+            dfs = list(analysis_pool.map(lambda prefix: compute_analysis(column_prefix=prefix), column_prefixes))
+    assert max(concurrency) == parallel_workers  # Not parallel_workers times the number of concurrent analyses
+    for i, df in enumerate(dfs):
+        assert [json.loads(r)["id"] for r in df["api_{}_response".format(i)]] == list(range(40))
+
+
+def test_batch_keeps_input_order():
+    num_rows = 23
+
+    def call_mock_batch_api(batch: List[Dict]) -> List[Dict]:
+        time.sleep(0.001 * (num_rows - batch[0]["id"]))
+        return [{"id": row["id"]} for row in batch]
+
+    def parse_mock_batch_response(batch: List[Dict], response: List[Dict], api_column_names: NamedTuple) -> List[Dict]:
+        for row, result in zip(batch, response):
+            row[api_column_names.response] = json.dumps(result)
+        return batch
+
+    input_df = pd.DataFrame({"id": range(num_rows)}, index=range(100, 100 + num_rows))
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        api_support_batch=True,
+        batch_size=5,
+        batch_api_response_parser=parse_mock_batch_response,
+    )
+    assert list(df.index) == list(input_df.index)
+    assert [json.loads(r)["id"] for r in df[COLUMN_PREFIX + "_response"]] == list(range(num_rows))
+
+
+def test_input_columns_projection():
+    def call_mock_api_projected(row: Dict) -> AnyStr:
+        assert "large_column" not in row
+        return call_mock_api(row)
+
+    input_df = pd.DataFrame({INPUT_COLUMN: [APICaseEnum.SUCCESS], "large_column": ["x" * 1000]})
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_api_projected,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        input_columns=[INPUT_COLUMN],
+    )
+    output_dictionary = df.iloc[0, :].to_dict()
+    assert output_dictionary["large_column"] == "x" * 1000
+    for k, v in APICaseEnum.SUCCESS.value.items():
+        assert output_dictionary[k] == v
+
+
+def test_deduplicate():
+    api_calls = []
+
+    def call_mock_api_counted(row: Dict) -> AnyStr:
+        api_calls.append(row[INPUT_COLUMN])
+        return json.dumps({"result": row[INPUT_COLUMN]})
+
+    input_values = ["a", "b", "a", "c", "b", "a"]
+    input_df = pd.DataFrame({INPUT_COLUMN: input_values, "row_id": range(len(input_values))})
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_api_counted,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        input_columns=[INPUT_COLUMN],
+        deduplicate=True,
+    )
+    assert sorted(api_calls) == ["a", "b", "c"]
+    assert list(df["row_id"]) == list(range(len(input_values)))
+    assert [json.loads(r)["result"] for r in df[COLUMN_PREFIX + "_response"]] == input_values
+
+
+def test_partial_batch_retry():
+    num_rows = 12
+    api_calls = []
+
+    def call_mock_batch_api(batch: List[Dict]) -> Dict:
+        api_calls.extend([row["id"] for row in batch])
+        response = {"ResultList": [], "ErrorList": []}
+        for i, row in enumerate(batch):
+            if row["id"] == 5:
+                response["ErrorList"].append({"Index": i, "ErrorCode": "TextSizeLimitExceededException"})
+            elif row["id"] % 4 == 0 and api_calls.count(row["id"]) == 1:
+                response["ErrorList"].append({"Index": i, "ErrorCode": "InternalServerException"})
+            else:
+                response["ResultList"].append({"Index": i, "id": row["id"]})
+        return response
+
+    input_df = pd.DataFrame({"id": range(num_rows)})
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        api_support_batch=True,
+        batch_size=5,
+        batch_api_response_parser=batch_api_response_parser,
+        is_retryable_error=is_transient_error,
+        retry_base_delay=0.01,
+    )
+    assert sorted(api_calls) == sorted(list(range(num_rows)) + [0, 4, 8])
+    expected_error_types = ["TextSizeLimitExceededException" if i == 5 else "" for i in range(num_rows)]
+    assert list(df[COLUMN_PREFIX + "_error_type"]) == expected_error_types
+    assert [r["id"] for r in df[COLUMN_PREFIX + "_response"] if r != ""] == [i for i in range(num_rows) if i != 5]
+
+
+def test_batch_group_column():
+    languages = ["en", "fr", "en", "de", "fr", "en", "en", "fr"]
+    batch_languages = []
+
+    def call_mock_batch_api(batch: List[Dict]) -> List[Dict]:
+        batch_languages.append({row["language"] for row in batch})
+        return [{"id": row["id"]} for row in batch]
+
+    def parse_mock_batch_response(batch: List[Dict], response: List[Dict], api_column_names: NamedTuple) -> List[Dict]:
+        for row, result in zip(batch, response):
+            row[api_column_names.response] = result
+        return batch
+
+    input_df = pd.DataFrame({"id": range(len(languages)), "language": languages})
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        input_columns=["id"],
+        api_support_batch=True,
+        batch_size=3,
+        batch_group_column="language",
+        batch_api_response_parser=parse_mock_batch_response,
+    )
+    assert all([len(b) == 1 for b in batch_languages])
+    assert len(batch_languages) == 4  # 4 rows in English, 3 in French and 1 in German
+    assert [r["id"] for r in df[COLUMN_PREFIX + "_response"]] == list(range(len(languages)))
+
+
+def test_length_bucketing():
+    texts = ["x" * n for n in [5, 500, 10, 400, 20, 300, 30, 200]]
+    batch_lengths = []
+
+    def call_mock_batch_api(batch: List[Dict]) -> List[Dict]:
+        batch_lengths.append(sorted([len(row["text"]) for row in batch]))
+        return [{"length": len(row["text"])} for row in batch]
+
+    def parse_mock_batch_response(batch: List[Dict], response: List[Dict], api_column_names: NamedTuple) -> List[Dict]:
+        for row, result in zip(batch, response):
+            row[api_column_names.response] = result
+        return batch
+
+    df = api_parallelizer(
+        input_df=pd.DataFrame({"text": texts}),
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        api_support_batch=True,
+        batch_size=4,
+        length_bucketing_column="text",
+        batch_api_response_parser=parse_mock_batch_response,
+    )
+    assert sorted(batch_lengths) == [[5, 10, 20, 30], [200, 300, 400, 500]]
+    assert [r["length"] for r in df[COLUMN_PREFIX + "_response"]] == [len(t) for t in texts]
+    batch_lengths.clear()
+    df = api_parallelizer(
+        input_df=pd.DataFrame({"text": texts}),
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        api_support_batch=True,
+        batch_size=4,
+        length_bucketing_column="text",
+        max_batch_bytes=800,
+        batch_api_response_parser=parse_mock_batch_response,
+    )
+    assert sorted(batch_lengths) == [[5], [10, 20, 30, 200], [300, 400], [500]]
+    assert [r["length"] for r in df[COLUMN_PREFIX + "_response"]] == [len(t) for t in texts]
+
+
+def test_row_validator():
+    texts = ["hello", float("nan"), "  ", "bonjour", "hallo", "hello"]
+    languages = ["en", "en", "en", "fr", "nl", "en"]
+    batches = []
+
+    def call_mock_batch_api(batch: List[Dict]) -> List[Dict]:
+        batches.append([row["text"] for row in batch])
+        return [{"text": row["text"]} for row in batch]
+
+    def parse_mock_batch_response(batch: List[Dict], response: List[Dict], api_column_names: NamedTuple) -> List[Dict]:
+        for row, result in zip(batch, response):
+            row[api_column_names.response] = result
+        return batch
+
+    row_validator = partial(
+        validate_row,
+        text_column="text",
+        text_language="language_column",
+        language_column="language",
+        supported_languages={"en", "fr"},
+    )
+    df = api_parallelizer(
+        input_df=pd.DataFrame({"text": texts, "language": languages}),
+        api_call_function=call_mock_batch_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        api_support_batch=True,
+        batch_size=10,
+        batch_group_column="language",
+        batch_api_response_parser=parse_mock_batch_response,
+        row_validator=row_validator,
+        deduplicate=True,
+    )
+    assert sorted(batches) == [["bonjour"], ["hello"]]
+    expected_error_types = ["", EMPTY_TEXT_ERROR_TYPE, EMPTY_TEXT_ERROR_TYPE, "", UNSUPPORTED_LANGUAGE_ERROR_TYPE, ""]
+    assert list(df[COLUMN_PREFIX + "_error_type"]) == expected_error_types
+    assert [r["text"] if r != "" else "" for r in df[COLUMN_PREFIX + "_response"]] == [
+        "hello",
+        "",
+        "",
+        "bonjour",
+        "",
+        "hello",
+    ]
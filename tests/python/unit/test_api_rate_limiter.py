@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import time
+from threading import Lock
+from typing import Dict
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from api_rate_limiter import AdaptiveRateLimiter
+from api_parallelizer import api_parallelizer  # noqa
+from amazon_comprehend_api_client import API_EXCEPTIONS, is_throttling_exception
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+COLUMN_PREFIX = "test_api"
+INPUT_COLUMN = "text"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def build_client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "BatchDetectSentiment")
+
+
+def test_rate_limit():
+    rate_limiter = AdaptiveRateLimiter(rate_limit=5, period=0.1)
+    start = time.monotonic()
+    for _ in range(15):
+        rate_limiter.acquire()
+    # The first 5 calls use the initial burst, the next 10 wait for tokens at 50 calls per second
+    assert time.monotonic() - start >= 0.18
+
+
+def test_adaptive_rate():
+    rate_limiter = AdaptiveRateLimiter(rate_limit=100, decrease_cooldown=0)
+    rate_limiter.on_throttle()
+    rate_limiter.on_throttle()
+    assert rate_limiter.rate == 25
+    for _ in range(100):
+        rate_limiter.on_success()
+    assert rate_limiter.rate == rate_limiter.max_rate
+
+
+def test_is_throttling_exception():
+    assert is_throttling_exception(build_client_error("ThrottlingException"))
+    assert not is_throttling_exception(build_client_error("TextSizeLimitExceededException"))
+    assert not is_throttling_exception(ValueError("ThrottlingException"))
+
+
+def test_throttled_calls_are_retried():
+    lock = Lock()
+    throttled_rows = set()
+
+    def call_mock_api(row: Dict) -> Dict:
+        with lock:
+            if row[INPUT_COLUMN] not in throttled_rows:
+                throttled_rows.add(row[INPUT_COLUMN])
+                raise build_client_error("ThrottlingException")
+        return {"text": row[INPUT_COLUMN]}
+
+    input_df = pd.DataFrame({INPUT_COLUMN: [str(i) for i in range(10)]})
+    rate_limiter = AdaptiveRateLimiter(rate_limit=1000)
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_api,
+        api_exceptions=API_EXCEPTIONS,
+        column_prefix=COLUMN_PREFIX,
+        rate_limiter=rate_limiter,
+        is_throttling_exception=is_throttling_exception,
+    )
+    assert rate_limiter.num_throttled == 10
+    assert rate_limiter.rate < rate_limiter.max_rate
+    assert list(df[COLUMN_PREFIX + "_error_type"]) == [""] * 10
+    assert [r["text"] for r in df[COLUMN_PREFIX + "_response"]] == list(input_df[INPUT_COLUMN])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import os
+from functools import partial
+
+import pandas as pd
+import pytest
+
+from chunk_checkpoint import ChunkCheckpoint
+from chunk_parallelizer import iterate_chunk_results
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+NUM_CHUNKS = 4
+CHUNK_SIZE = 3
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def generate_chunks():
+    for i in range(NUM_CHUNKS):
+        index = range(i * CHUNK_SIZE, (i + 1) * CHUNK_SIZE)
+        yield pd.DataFrame({INPUT_COLUMN: [str(j) for j in index]}, index=index)
+
+
+def test_resume_interrupted_run(tmp_path):
+    processed_chunks = []
+
+    def process_chunk(input_df: pd.DataFrame, fail_at: int = None) -> pd.DataFrame:
+        if input_df.index[0] == fail_at:
+            raise RuntimeError("Interrupted run")
+        processed_chunks.append(input_df.index[0])
+        return input_df.assign(result=input_df[INPUT_COLUMN] + "!")
+
+    checkpoint = ChunkCheckpoint(path=str(tmp_path), operation="test", params={"language": "en"})
+    with pytest.raises(RuntimeError):
+        list(iterate_chunk_results(partial(checkpoint.process_chunk, process_chunk), generate_chunks(), fail_at=6))
+    assert processed_chunks == [0, 3]
+    checkpoint = ChunkCheckpoint(path=str(tmp_path), operation="test", params={"language": "en"})
+    output_dfs = list(iterate_chunk_results(partial(checkpoint.process_chunk, process_chunk), generate_chunks()))
+    assert processed_chunks == [0, 3, 6, 9]
+    assert list(pd.concat(output_dfs)["result"]) == [str(i) + "!" for i in range(NUM_CHUNKS * CHUNK_SIZE)]
+    checkpoint.clear()
+    assert not os.path.exists(checkpoint.directory)
+
+
+def test_chunk_key(tmp_path):
+    checkpoint = ChunkCheckpoint(path=str(tmp_path), operation="test")
+    chunks = list(generate_chunks())
+    assert checkpoint.compute_chunk_key(chunks[1]).startswith("chunk_000000000003_")
+    assert checkpoint.compute_chunk_key(chunks[1]) == checkpoint.compute_chunk_key(chunks[1].copy())
+    changed_chunk = chunks[1].assign(**{INPUT_COLUMN: ["changed"] * CHUNK_SIZE})
+    assert checkpoint.compute_chunk_key(chunks[1]) != checkpoint.compute_chunk_key(changed_chunk)
+    assert checkpoint.directory != ChunkCheckpoint(path=str(tmp_path), operation="test", params={"a": 1}).directory
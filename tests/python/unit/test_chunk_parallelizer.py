@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import os
+import time
+
+import pandas as pd
+
+from api_rate_limiter import AdaptiveRateLimiter
+from chunk_parallelizer import iterate_chunk_results
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+INPUT_COLUMN = "text"
+NUM_CHUNKS = 8
+CHUNK_SIZE = 5
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def generate_chunks():
+    for i in range(NUM_CHUNKS):
+        yield pd.DataFrame({INPUT_COLUMN: [str(i * CHUNK_SIZE + j) for j in range(CHUNK_SIZE)]})
+
+
+def test_chunks_processed_in_order():
+    def process_chunk(input_df: pd.DataFrame, suffix: str) -> pd.DataFrame:
+        time.sleep(0.05 * (int(input_df[INPUT_COLUMN][0]) % 3))  # Finish chunks out of order
+        return input_df.assign(pid=os.getpid(), result=input_df[INPUT_COLUMN] + suffix)
+
+    output_dfs = list(iterate_chunk_results(process_chunk, generate_chunks(), parallel_processes=3, suffix="!"))
+    output_df = pd.concat(output_dfs)
+    assert list(output_df["result"]) == [str(i) + "!" for i in range(NUM_CHUNKS * CHUNK_SIZE)]
+    assert os.getpid() not in set(output_df["pid"])
+
+
+def test_shared_rate_limiter():
+    rate_limiter = AdaptiveRateLimiter(rate_limit=20, period=0.1, shared=True)
+
+    def process_chunk(input_df: pd.DataFrame) -> pd.DataFrame:
+        for _ in range(len(input_df.index)):
+            rate_limiter.acquire()
+        rate_limiter.on_throttle()
+        return input_df
+
+    start = time.monotonic()
+    list(iterate_chunk_results(process_chunk, generate_chunks(), parallel_processes=4))
+    # 40 calls with a burst of 20 at 200 calls per second shared by all processes, slowed down by throttling
+    assert time.monotonic() - start >= 0.1
+    assert rate_limiter.num_throttled == NUM_CHUNKS
+    assert rate_limiter.rate < rate_limiter.max_rate
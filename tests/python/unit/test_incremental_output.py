@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+import pandas as pd
+
+from incremental_output import PreviousOutputIndex
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+KEY_COLUMN = "id"
+INPUT_COLUMN = "text"
+API_COLUMNS = ["test_api_length", "test_api_error_message"]
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def process_chunk(input_df: pd.DataFrame) -> pd.DataFrame:
+    return input_df.reset_index(drop=True).assign(
+        **{API_COLUMNS[0]: [str(len(t)) for t in input_df[INPUT_COLUMN]], API_COLUMNS[1]: ""}
+    )
+
+
+def test_only_new_or_changed_rows_processed():
+    previous_output_df = process_chunk(pd.DataFrame({KEY_COLUMN: ["1", "2", "3"], INPUT_COLUMN: ["a", "bb", "ccc"]}))
+    previous_output_df.loc[0, API_COLUMNS[0]] = "previous result"
+    previous_output_index = PreviousOutputIndex(
+        key_column=KEY_COLUMN, text_column=INPUT_COLUMN, api_column_names=API_COLUMNS
+    )
+    previous_output_index.load([previous_output_df.iloc[:2], previous_output_df.iloc[2:]])
+    processed_texts = []
+
+    def process_chunk_and_record(input_df: pd.DataFrame) -> pd.DataFrame:
+        processed_texts.extend(input_df[INPUT_COLUMN])
+        return process_chunk(input_df)
+
+    input_df = pd.DataFrame(
+        {KEY_COLUMN: ["4", "1", "2", "3"], INPUT_COLUMN: ["dddd", " a ", "changed", "ccc"]}, index=[10, 11, 12, 13]
+    )
+    rows_to_process = previous_output_index.filter_rows_to_process(input_df)
+    output_df = previous_output_index.process_chunk(process_chunk_and_record, input_df)
+    previous_output_index.close()
+    assert processed_texts == ["dddd", "changed"]
+    assert list(rows_to_process.index) == [10, 12]
+    assert list(output_df.index) == [10, 11, 12, 13]
+    assert list(output_df[KEY_COLUMN]) == ["4", "1", "2", "3"]
+    assert list(output_df[API_COLUMNS[0]]) == ["4", "previous result", "7", "3"]
+    assert list(output_df[API_COLUMNS[1]]) == [""] * 4
+
+
+def test_text_hash_column():
+    previous_output_df = pd.DataFrame(
+        {KEY_COLUMN: ["1", "2"], INPUT_COLUMN: ["a", "b"], "hash": ["h1", "h2"], API_COLUMNS[0]: ["x", "y"]}
+    )
+    previous_output_index = PreviousOutputIndex(
+        key_column=KEY_COLUMN, text_column=INPUT_COLUMN, api_column_names=API_COLUMNS[:1], text_hash_column="hash"
+    )
+    previous_output_index.load([previous_output_df])
+    input_df = pd.DataFrame({KEY_COLUMN: ["1", "2"], INPUT_COLUMN: ["a", "b"], "hash": ["h1", "h2 changed"]})
+    output_df = previous_output_index.process_chunk(
+        lambda input_df: input_df.assign(**{API_COLUMNS[0]: "new"}), input_df
+    )
+    previous_output_index.close()
+    assert list(output_df[API_COLUMNS[0]]) == ["x", "new"]
+
+
+def test_previously_failed_rows_processed():
+    previous_output_df = pd.DataFrame(
+        {
+            KEY_COLUMN: ["1", "2", "3"],
+            INPUT_COLUMN: ["a", "bb", "ccc"],
+            API_COLUMNS[0]: ["previous result", "", ""],
+            API_COLUMNS[1]: ["", "ThrottlingException", None],
+        }
+    )
+    previous_output_index = PreviousOutputIndex(
+        key_column=KEY_COLUMN, text_column=INPUT_COLUMN, api_column_names=API_COLUMNS
+    )
+    previous_output_index.load([previous_output_df])
+    output_df = previous_output_index.process_chunk(process_chunk, previous_output_df[[KEY_COLUMN, INPUT_COLUMN]])
+    previous_output_index.close()
+    assert list(output_df[API_COLUMNS[0]]) == ["previous result", "2", "3"]
+    assert list(output_df[API_COLUMNS[1]]) == [""] * 3
+
+
+def test_previously_empty_rows_processed():
+    previous_output_df = pd.DataFrame(
+        {
+            KEY_COLUMN: ["1", "2"],
+            INPUT_COLUMN: ["a", "bb"],
+            API_COLUMNS[0]: ["previous result", None],
+            API_COLUMNS[1]: "",
+        }
+    )
+    previous_output_index = PreviousOutputIndex(
+        key_column=KEY_COLUMN, text_column=INPUT_COLUMN, api_column_names=API_COLUMNS
+    )
+    previous_output_index.load([previous_output_df])
+    output_df = previous_output_index.process_chunk(process_chunk, previous_output_df[[KEY_COLUMN, INPUT_COLUMN]])
+    previous_output_index.close()
+    assert list(output_df[API_COLUMNS[0]]) == ["previous result", "2"]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# This is a test file intended to be used with pytest
+# pytest automatically runs all the function starting with "test_"
+# see https://docs.pytest.org for more information
+
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import pytest
+
+from text_segmentation import split_text, utf8_byte_length
+from api_parallelizer import api_parallelizer  # noqa
+
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+COLUMN_PREFIX = "test_api"
+INPUT_COLUMN = "text"
+
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def check_segments(text: str, max_bytes: int) -> List[Tuple[int, str]]:
+    segments = split_text(text, max_bytes)
+    stripped_text = text.strip()
+    for offset, segment in segments:
+        assert 0 < utf8_byte_length(segment) <= max_bytes
+        assert stripped_text[offset : offset + len(segment)] == segment
+    assert "".join("".join([segment for _, segment in segments]).split()) == "".join(stripped_text.split())
+    return segments
+
+
+def test_short_text():
+    assert split_text("  Hello world.  ", 20) == [(0, "Hello world.")]
+
+
+def test_split_on_sentences():
+    text = "First sentence here. Second sentence! Third one?"
+    segments = check_segments(text, 40)
+    assert [segment for _, segment in segments] == ["First sentence here. Second sentence!", "Third one?"]
+
+
+def test_split_on_whitespace_and_characters():
+    check_segments("word " * 50, 23)
+    check_segments("x" * 100, 7)
+
+
+def test_split_multibyte_characters():
+    segments = check_segments("日本語のテキスト。" * 20 + "é" * 30, 50)
+    assert len(segments) > 1
+
+
+def test_invalid_max_bytes():
+    with pytest.raises(ValueError):
+        split_text("text", 3)
+
+
+def test_parallelizer_segmentation():
+    def call_mock_api(row: Dict) -> Dict:
+        assert utf8_byte_length(row[INPUT_COLUMN]) <= 30
+        return {"length": len(row[INPUT_COLUMN])}
+
+    def merge_mock_responses(responses: List[Dict], segments: List[Tuple[int, str]]) -> Dict:
+        return {"length": sum([r["length"] for r in responses]), "num_segments": len(segments)}
+
+    long_text = "This is a sentence. " * 10
+    input_df = pd.DataFrame({INPUT_COLUMN: ["short", long_text, long_text]})
+    df = api_parallelizer(
+        input_df=input_df,
+        api_call_function=call_mock_api,
+        api_exceptions=(ValueError,),
+        column_prefix=COLUMN_PREFIX,
+        deduplicate=True,
+        segmentation_column=INPUT_COLUMN,
+        segment_response_merger=merge_mock_responses,
+        max_segment_bytes=30,
+    )
+    responses = list(df[COLUMN_PREFIX + "_response"])
+    assert len(responses) == 3
+    assert responses[0] == {"length": 5}
+    assert responses[1] == responses[2] == {"length": 10 * len("This is a sentence."), "num_segments": 10}